@@ -0,0 +1,26 @@
+"""生产环境启动入口：python -m app
+
+开发环境仍使用 `uvicorn app.main:app --reload`。
+"""
+import uvicorn
+
+from app.config import settings
+
+
+def main():
+    # loop/http 使用 auto：已安装 uvloop / httptools（uvicorn[standard]）时自动启用，
+    # Windows 上没有 uvloop 时回退到 asyncio
+    uvicorn.run(
+        "app.main:app",
+        host=settings.host,
+        port=settings.port,
+        workers=settings.workers,
+        loop="auto",
+        http="auto",
+        limit_concurrency=settings.limit_concurrency,
+        backlog=2048,
+    )
+
+
+if __name__ == "__main__":
+    main()
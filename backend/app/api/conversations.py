@@ -3,7 +3,9 @@ from typing import List, Optional
 from fastapi import APIRouter, HTTPException, status
 from pydantic import BaseModel, Field
 
+from app.services.cache_service import invalidate_graph_cache
 from app.services.conversation_service import ConversationService
+from app.services.document_service import get_document_service
 
 router = APIRouter(prefix="/api/conversations", tags=["conversations"])
 
@@ -164,6 +166,10 @@ async def delete_conversation(conversation_id: str):
             detail="删除对话失败"
         )
     
+    # 删除文档状态文件：其他 worker 的图谱缓存 key 随之变化，不会继续返回已删除的图谱
+    get_document_service().delete_status(conversation_id)
+    invalidate_graph_cache(conversation_id)
+    
     return None
 
 
@@ -3,7 +3,7 @@ from typing import List, Optional
 from fastapi import APIRouter, HTTPException, UploadFile, File, BackgroundTasks, status
 from pydantic import BaseModel
 
-from app.services.document_service import DocumentService
+from app.services.document_service import get_document_service
 from app.utils.document_parser import DocumentParser
 
 router = APIRouter(tags=["documents"])
@@ -67,7 +67,7 @@ async def upload_documents(
             detail="至少需要上传一个文件"
         )
     
-    service = DocumentService()
+    service = get_document_service()
     
     try:
         # 如果 conversation_id 是 "new"，转换为 None
@@ -106,7 +106,7 @@ async def list_documents(conversation_id: str):
     Args:
         conversation_id: 对话ID
     """
-    service = DocumentService()
+    service = get_document_service()
     
     try:
         documents = service.list_documents(conversation_id)
@@ -131,7 +131,7 @@ async def get_document(conversation_id: str, file_id: str):
         conversation_id: 对话ID
         file_id: 文件ID
     """
-    service = DocumentService()
+    service = get_document_service()
     
     document = service.get_document(conversation_id, file_id)
     
@@ -153,7 +153,7 @@ async def get_document_status(conversation_id: str, file_id: str):
         conversation_id: 对话ID
         file_id: 文件ID
     """
-    service = DocumentService()
+    service = get_document_service()
     
     doc_status = await service.get_document_status(conversation_id, file_id)
     
@@ -175,7 +175,7 @@ async def delete_document(conversation_id: str, file_id: str):
         conversation_id: 对话ID
         file_id: 文件ID
     """
-    service = DocumentService()
+    service = get_document_service()
     
     document = service.get_document(conversation_id, file_id)
     
@@ -226,7 +226,7 @@ async def get_document_slides(conversation_id: str, file_id: str):
     import os
     import hashlib
     
-    service = DocumentService()
+    service = get_document_service()
     parser = DocumentParser()
     
     # 获取文档信息
@@ -319,7 +319,7 @@ async def get_document_slide(conversation_id: str, file_id: str, slide_id: int):
         file_id: 文件ID
         slide_id: 幻灯片/页面编号（从1开始）
     """
-    service = DocumentService()
+    service = get_document_service()
     parser = DocumentParser()
     
     # 获取文档信息
@@ -1,23 +1,158 @@
 """样本试题管理API路由"""
-from fastapi import APIRouter, File, UploadFile, HTTPException, status, BackgroundTasks
-from fastapi.responses import FileResponse, JSONResponse, Response
-from typing import List
+from fastapi import APIRouter, File, UploadFile, HTTPException, status, BackgroundTasks, Request
+from fastapi.responses import FileResponse, JSONResponse, ORJSONResponse
+from typing import BinaryIO, List
 from pydantic import BaseModel
 from pathlib import Path
+import asyncio
+import io
 import os
 import json
+import logging
+import re
+
+from fastapi.concurrency import run_in_threadpool
+from fastapi import Form, File as FFile, UploadFile as FUploadFile
 
+import app.config as config
 from app.services.exercise_service import ExerciseService
 from app.agents.shared_state import shared_state
-from app.agents.database.question_bank_storage import load_question_bank
+from app.agents.database.question_bank_storage import load_question_bank, find_saved_question_bank_path
 from app.agents.models.quiz_models import Question
-from fastapi.concurrency import run_in_threadpool
-from fastapi import Form, File as FFile, UploadFile as FUploadFile
-import json
-import re
+from app.utils.pdf_parser import PDFParser
+from app.utils.http_cache import cache_headers, not_modified_response
+
+try:
+    from docx import Document
+    DOCX_AVAILABLE = True
+except ImportError:
+    DOCX_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# 学生答卷文件大小上限
+MAX_ANSWER_FILE_SIZE = 50 * 1024 * 1024
+
+# 样本原始文件扩展名及对应的 media_type
+_SAMPLE_FILE_EXTS = frozenset({'.pdf', '.docx', '.txt'})
+_SAMPLE_MEDIA_TYPES = {
+    '.pdf': 'application/pdf',
+    '.docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    '.doc': 'application/msword',
+    '.txt': 'text/plain'
+}
+
+# 按行解析答案时需排除的标题行关键字
+_HEADER_KEYWORDS = ('答案', '学生', '姓名', '班级', 'answer', 'student')
+
+# 答案解析：Q/GEN 题号与数字序号合并为一个模式，一次扫描完成
+# GEN 和数字序号分支使用前瞻捕获答案，不消耗行内容，保证同一行中的 Q 题号仍可被匹配
+_ANSWER_PATTERN = re.compile(
+    r"(?P<q>Q\d{1,4})\s*[:：\.\)]\s*(?P<ans>.+)"
+    r"|(?P<gen>GEN_\d{1,4})\s*[:：\.\)]\s*(?=(?P<gen_ans>.+))"
+    r"|^\s*(?P<num>\d{1,3})[\.、\)]\s*(?=(?P<num_ans>.+)$)",
+    re.I | re.M
+)
+
+
+def _parse_answers_text(text: str) -> dict:
+    """从答卷文本中解析答案
+    
+    优先级：Q编号 > GEN编号 > 数字序号 > 每行一个答案（无题号）
+    """
+    q_answers = {}
+    gen_answers = {}
+    num_answers = {}
+    # 上一个 GEN 答案的结束位置：GEN 答案占到行尾，其中出现的 GEN 编号不再单独计入
+    gen_end = -1
+    for m in _ANSWER_PATTERN.finditer(text):
+        if m.group("q"):
+            q_answers[m.group("q").upper()] = m.group("ans").strip()
+        elif m.group("gen"):
+            if m.start() >= gen_end:
+                gen_answers[m.group("gen").upper()] = m.group("gen_ans").strip()
+                gen_end = m.end("gen_ans")
+        else:
+            num_answers[f"Q{int(m.group('num')):03d}"] = m.group("num_ans").strip()
+    
+    answers_map = q_answers or gen_answers or num_answers
+    if answers_map:
+        return answers_map
+    
+    # 每行一个答案（无题号，按行序号匹配）
+    lines = [line for line in (raw.strip() for raw in text.splitlines()) if line]
+    if 0 < len(lines) <= 100:  # 合理的题目数量
+        for idx, line in enumerate(lines, 1):
+            # 排除明显的标题行
+            if not any(keyword in line for keyword in _HEADER_KEYWORDS):
+                answers_map[f"Q{idx:03d}"] = line
+    return answers_map
+
+
+_DIGIT_PATTERN = re.compile(r'(\d+)')
+
+# 题库文件路径 -> (mtime_ns, 按题目顺序排列的题目ID列表)
+_question_ids_cache: dict[str, tuple[int, list]] = {}
+
+
+def _load_question_ids(bank_id: str) -> list:
+    """加载题库中按顺序排列的题目ID列表（按文件修改时间缓存，阻塞操作，需在线程池中调用）"""
+    # 旧版本路径的题库不走缓存，直接加载
+    path = find_saved_question_bank_path(bank_id)
+    if path:
+        mtime_ns = os.stat(path).st_mtime_ns
+        cached = _question_ids_cache.get(path)
+        if cached and cached[0] == mtime_ns:
+            return cached[1]
+    
+    qb = load_question_bank(bank_id)
+    if not qb or not getattr(qb, 'questions', None):
+        return []
+    
+    question_ids = [
+        q.id if hasattr(q, 'id') else (q.get('id') if isinstance(q, dict) else None)
+        for q in qb.questions
+    ]
+    if path:
+        _question_ids_cache[path] = (mtime_ns, question_ids)
+    return question_ids
+
+
+def _get_upload_size(upload: UploadFile) -> int:
+    """获取上传文件大小（优先使用已知大小，否则通过 seek 计算，不读取文件内容）"""
+    size = getattr(upload, "size", None)
+    if size is not None:
+        return size
+    stream = upload.file
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    return size
+
+
+def _extract_docx_text(stream: BinaryIO) -> tuple[str, int]:
+    """提取 DOCX 所有非空段落文本（阻塞操作，需在线程池中调用）
+    
+    Args:
+        stream: DOCX 文件流（如 UploadFile.file）
+        
+    Returns:
+        (文本内容, 段落数)
+    """
+    doc = Document(stream)
+    # 直接写入缓冲区，避免中间列表
+    buf = io.StringIO()
+    paragraph_count = 0
+    for para in doc.paragraphs:
+        para_text = para.text
+        if para_text and para_text.strip():
+            buf.write(para_text)
+            buf.write('\n')
+            paragraph_count += 1
+    return buf.getvalue(), paragraph_count
+
 
 # 响应模型
 class SampleUploadResponse(BaseModel):
@@ -85,35 +220,14 @@ async def upload_samples(
         result = await service.upload_samples(conversation_id, files)
         
         # 添加后台任务：异步解析每个文件
+        # 原始文件路径由 upload_samples 直接返回，路由中不再访问磁盘
         for sample_info in result["uploaded_samples"]:
-            sample_id = sample_info["sample_id"]
-            sample_dir = service._get_sample_dir(conversation_id, sample_id)
-            # 从元数据中获取文件路径，或查找原始文件
-            metadata_file = service._get_metadata_file(conversation_id, sample_id)
-            original_file_path = None
-            
-            if metadata_file.exists():
-                import json
-                with open(metadata_file, 'r', encoding='utf-8') as f:
-                    metadata = json.load(f)
-                    rel_path = metadata.get("original_file_path")
-                    if rel_path:
-                        original_file_path = sample_dir / rel_path
-            
-            # 如果元数据中没有路径，查找文件
-            if not original_file_path or not original_file_path.exists():
-                for f in sample_dir.iterdir():
-                    if f.is_file() and f.suffix.lower() in ['.pdf', '.docx', '.txt']:
-                        original_file_path = f
-                        break
-            
-            if original_file_path and original_file_path.exists():
-                background_tasks.add_task(
-                    service._parse_sample_async,
-                    conversation_id,
-                    sample_id,
-                    original_file_path
-                )
+            background_tasks.add_task(
+                service._parse_sample_async,
+                conversation_id,
+                sample_info["sample_id"],
+                Path(sample_info.pop("original_file_path"))
+            )
         
         return SampleUploadResponse(**result)
     except ValueError as e:
@@ -268,14 +382,12 @@ async def get_sample_markdown(conversation_id: str, sample_id: str):
     "/api/conversations/{conversation_id}/exercises/samples/{sample_id}/images/{image_name}"
 )
 async def get_sample_image(
+    request: Request,
     conversation_id: str,
     sample_id: str,
     image_name: str
 ):
     """获取样本试题图片"""
-    from pathlib import Path
-    import app.config as config
-    
     # 构建图片路径
     exercises_dir = Path(config.settings.exercises_dir)
     image_path = exercises_dir / conversation_id / "samples" / sample_id / "images" / image_name
@@ -286,9 +398,16 @@ async def get_sample_image(
             detail=f"图片 {image_name} 不存在"
         )
     
+    # 样本图片上传后不再变化，使用长期缓存 + ETag
+    headers = cache_headers(image_path)
+    not_modified = not_modified_response(request, headers)
+    if not_modified:
+        return not_modified
+    
     return FileResponse(
         path=str(image_path),
-        media_type=f"image/{Path(image_name).suffix.lstrip('.')}"
+        media_type=f"image/{Path(image_name).suffix.lstrip('.')}",
+        headers=headers
     )
 
 
@@ -296,13 +415,11 @@ async def get_sample_image(
     "/api/conversations/{conversation_id}/exercises/samples/{sample_id}/file"
 )
 async def get_sample_file(
+    request: Request,
     conversation_id: str,
     sample_id: str
 ):
     """获取样本试题原始文件"""
-    from pathlib import Path
-    import app.config as config
-    
     service = ExerciseService()
     sample = service.get_sample(conversation_id, sample_id)
     
@@ -320,7 +437,7 @@ async def get_sample_file(
     # 如果原始文件不存在，尝试在样本目录中查找
     if not file_path or not file_path.exists():
         for f in sample_dir.iterdir():
-            if f.is_file() and f.suffix.lower() in ['.pdf', '.docx', '.txt']:
+            if f.is_file() and f.suffix.lower() in _SAMPLE_FILE_EXTS:
                 file_path = f
                 break
     
@@ -330,31 +447,36 @@ async def get_sample_file(
             detail="原始文件不存在"
         )
     
+    # 样本原始文件上传后不再变化，使用长期缓存 + ETag
+    headers = cache_headers(file_path)
+    not_modified = not_modified_response(request, headers)
+    if not_modified:
+        return not_modified
+    
     # 根据文件类型设置 media_type
     file_ext = file_path.suffix.lower()
-    media_type_map = {
-        '.pdf': 'application/pdf',
-        '.docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-        '.doc': 'application/msword',
-        '.txt': 'text/plain'
-    }
-    media_type = media_type_map.get(file_ext, 'application/octet-stream')
-    
-    # 读取文件内容
-    with open(file_path, 'rb') as f:
-        file_content = f.read()
+    media_type = _SAMPLE_MEDIA_TYPES.get(file_ext, 'application/octet-stream')
     
     # 设置响应头，强制内联显示（不下载）
-    headers = {
-        'Content-Disposition': f'inline; filename="{original_filename}"'
-    }
+    headers['Content-Disposition'] = f'inline; filename="{original_filename}"'
     
-    return Response(
-        content=file_content,
+    return FileResponse(
+        path=str(file_path),
         media_type=media_type,
         headers=headers
     )
 
+
+# conversation_id -> 正在执行的出题流水线任务
+_generate_tasks: dict[str, asyncio.Future] = {}
+
+
+def _release_generate_task(conversation_id: str, task: asyncio.Future):
+    """流水线结束后移除任务记录"""
+    if _generate_tasks.get(conversation_id) is task:
+        del _generate_tasks[conversation_id]
+
+
 @router.post(
     "/api/conversations/{conversation_id}/exercises/generate",
     response_model=GenerateQuizResponse
@@ -364,10 +486,17 @@ async def generate_exercises(conversation_id: str):
     基于当前会话上传的样本试卷，启动出题 Agent 链（A~F），
     并返回生成结果概要（题目数量 / 管道状态 / 质量报告等）。
     """
-    service = ExerciseService()
+    # 同一会话的并发请求（重复点击、前端重试）共享同一次流水线执行
+    task = _generate_tasks.get(conversation_id)
+    if task is None or task.done():
+        service = ExerciseService()
+        task = asyncio.ensure_future(run_in_threadpool(service.generate_questions, conversation_id))
+        _generate_tasks[conversation_id] = task
+        task.add_done_callback(lambda t: _release_generate_task(conversation_id, t))
+    
     try:
-        # 调用我们刚刚在 ExerciseService 里加的逻辑
-        result = await run_in_threadpool(service.generate_questions, conversation_id)
+        # shield：单个请求断开不会取消其它请求共享的流水线
+        result = await asyncio.shield(task)
         return GenerateQuizResponse(**result)
     except ValueError as e:
         # 比如没有样本、样本还在解析中等
@@ -381,13 +510,9 @@ async def generate_exercises(conversation_id: str):
             detail=f"生成题目失败: {e}"
         )
 
-from app.agents.database.question_bank_storage import load_question_bank
-from fastapi import HTTPException
-from fastapi.concurrency import run_in_threadpool
-from app.services.exercise_service import ExerciseService
-
 @router.get(
-    "/api/conversations/{conversation_id}/exercises/generated_questions"
+    "/api/conversations/{conversation_id}/exercises/generated_questions",
+    response_class=ORJSONResponse
 )
 async def get_generated_questions(conversation_id: str):
     """
@@ -433,7 +558,8 @@ async def get_generated_questions(conversation_id: str):
 
 
 @router.post(
-    "/api/conversations/{conversation_id}/exercises/submissions"
+    "/api/conversations/{conversation_id}/exercises/submissions",
+    response_class=ORJSONResponse
 )
 async def submit_student_answers(
     conversation_id: str,
@@ -450,15 +576,10 @@ async def submit_student_answers(
     """
     svc = ExerciseService()
 
-    # 调试信息
-    print(f"\n[DEBUG] ========== 批改请求 ==========")
-    print(f"[DEBUG] conversation_id: {conversation_id}")
-    print(f"[DEBUG] studentName: {studentName}")
-    print(f"[DEBUG] answers: {answers}")
-    print(f"[DEBUG] file: {file}")
-    if file:
-        print(f"[DEBUG] file.filename: {file.filename}")
-        print(f"[DEBUG] file.content_type: {file.content_type}")
+    logger.debug(
+        "批改请求: conversation_id=%s, studentName=%s, has_answers=%s, filename=%s",
+        conversation_id, studentName, bool(answers), getattr(file, "filename", None)
+    )
 
     answers_map = {}
 
@@ -474,15 +595,14 @@ async def submit_student_answers(
     # 2) 若没有 answers，则尝试解析上传的文件（支持 PDF/DOCX/TXT）
     # 检查文件是否真的存在：file 不为 None，且有 filename 且 filename 不为空字符串
     has_file = file is not None and hasattr(file, 'filename') and file.filename and file.filename.strip()
-    print(f"[DEBUG] has_file check: file={file}, has filename={hasattr(file, 'filename') if file else False}, filename={file.filename if file and hasattr(file, 'filename') else 'N/A'}")
     
     if not answers_map and has_file:
         try:
-            # 检查文件大小（50MB限制）
-            content = await file.read()
-            if not content or len(content) == 0:
+            # 检查文件大小（50MB限制），在读取内容之前完成
+            file_size = _get_upload_size(file)
+            if file_size == 0:
                 raise HTTPException(status_code=400, detail="上传的文件为空")
-            if len(content) > 50 * 1024 * 1024:
+            if file_size > MAX_ANSWER_FILE_SIZE:
                 raise HTTPException(status_code=400, detail="文件大小不能超过 50MB")
             
             # 根据文件类型解析内容
@@ -491,6 +611,7 @@ async def submit_student_answers(
             
             if file_ext == '.txt':
                 # TXT 文件直接解码
+                content = await file.read()
                 try:
                     text = content.decode('utf-8')
                 except Exception:
@@ -498,101 +619,42 @@ async def submit_student_answers(
             
             elif file_ext == '.pdf':
                 # PDF 文件解析
-                from app.utils.pdf_parser import PDFParser
-                import tempfile
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp:
-                    tmp.write(content)
-                    tmp_path = tmp.name
+                # 直接从上传文件流解析，解析为阻塞操作，放到线程池中执行
                 try:
                     parser = PDFParser()
-                    # 使用 extract_text 方法直接获取文本内容
-                    text = parser.extract_text(tmp_path)
-                    print(f"[DEBUG] PDF解析成功，文本长度: {len(text)}")
+                    text = await run_in_threadpool(parser.extract_text_from_stream, file.file)
+                    logger.debug("PDF解析成功，文本长度: %d", len(text))
                     if not text or not text.strip():
-                        print(f"[WARNING] PDF文件可能是扫描件（图片格式），无法提取文字")
+                        logger.warning("PDF文件可能是扫描件（图片格式），无法提取文字: %s", file.filename)
                         raise HTTPException(
                             status_code=400, 
                             detail="PDF文件无法提取文字。如果是扫描件，请使用OCR工具转换后再上传，或者使用TXT格式手动输入答案。"
                         )
-                    print(f"[DEBUG] PDF文本前200字符: {text[:200]}")
                 except HTTPException:
                     raise
                 except Exception as e:
-                    print(f"[ERROR] PDF解析失败: {e}")
+                    logger.error("PDF解析失败: %s", e)
                     raise HTTPException(status_code=400, detail=f"PDF解析失败: {str(e)}")
-                finally:
-                    Path(tmp_path).unlink(missing_ok=True)
             
-            elif file_ext in ['.docx', '.doc']:
+            elif file_ext in ('.docx', '.doc'):
                 # DOCX 文件解析
-                print(f"[DEBUG] 开始解析 DOCX 文件: {file.filename}")
-                import tempfile
-                try:
-                    from docx import Document
-                except ImportError:
+                if not DOCX_AVAILABLE:
                     raise HTTPException(status_code=500, detail="缺少 python-docx 库，请安装: pip install python-docx")
                 
-                with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as tmp:
-                    tmp.write(content)
-                    tmp_path = tmp.name
-                try:
-                    doc = Document(tmp_path)
-                    # 提取所有段落文本
-                    paragraphs = [para.text for para in doc.paragraphs if para.text.strip()]
-                    text = '\n'.join(paragraphs)
-                    print(f"[DEBUG] DOCX解析成功，段落数: {len(paragraphs)}, 文本长度: {len(text)}, 前200字符: {text[:200]}")
-                finally:
-                    Path(tmp_path).unlink(missing_ok=True)
+                text, paragraph_count = await run_in_threadpool(_extract_docx_text, file.file)
+                logger.debug("DOCX解析成功，段落数: %d, 文本长度: %d", paragraph_count, len(text))
             else:
                 raise HTTPException(
                     status_code=400, 
                     detail=f"不支持的文件格式: {file_ext}，仅支持 PDF、DOCX、TXT"
                 )
 
-            # 解析答案格式（支持多种格式）
-            # 格式1: Q001: 答案 或 Q001. 答案 或 Q001) 答案
-            pattern_q = re.compile(r"(Q\d{1,4})\s*[:：\.\)]\s*(.+)", re.I)  # 忽略大小写
-            matches = pattern_q.findall(text)
-            if matches:
-                for qid, ans in matches:
-                    answers_map[qid.upper()] = ans.strip()
-                print(f"[DEBUG] 解析到 {len(answers_map)} 道题目答案（Q格式）")
-            
-            # 格式2: GEN_001: 答案 或 GEN_001. 答案（支持生成的题目ID格式）
-            if not answers_map:
-                pattern_gen = re.compile(r"(GEN_\d{1,4})\s*[:：\.\)]\s*(.+)", re.I)
-                matches_gen = pattern_gen.findall(text)
-                if matches_gen:
-                    for qid, ans in matches_gen:
-                        answers_map[qid.upper()] = ans.strip()
-                    print(f"[DEBUG] 解析到 {len(answers_map)} 道题目答案（GEN格式）")
-            
-            # 格式3: 数字序号（1. 答案 或 1、答案 或 1) 答案）- 放宽匹配，允许行首有空白
-            if not answers_map:
-                pattern_n = re.compile(r"^\s*(\d{1,3})[\.、\)]\s*(.+)$", re.M)  # 允许行首空白
-                matches2 = pattern_n.findall(text)
-                if matches2:
-                    for num, ans in matches2:
-                        qid = f"Q{int(num):03d}"
-                        answers_map[qid] = ans.strip()
-                    print(f"[DEBUG] 解析到 {len(answers_map)} 道题目答案（数字格式）")
-            
-            # 格式4: 每行一个答案（无题号，按行序号匹配）
-            if not answers_map:
-                lines = [line.strip() for line in text.split('\n') if line.strip()]
-                if len(lines) > 0 and len(lines) <= 100:  # 合理的题目数量
-                    print(f"[DEBUG] 尝试按行解析（共{len(lines)}行）")
-                    for idx, line in enumerate(lines, 1):
-                        # 排除明显的标题行
-                        if not any(keyword in line for keyword in ['答案', '学生', '姓名', '班级', 'answer', 'student']):
-                            qid = f"Q{idx:03d}"
-                            answers_map[qid] = line
-                    if answers_map:
-                        print(f"[DEBUG] 按行解析到 {len(answers_map)} 道题目答案")
-            
-            if not answers_map:
-                print(f"[DEBUG] 未能从文本中解析出答案")
-                print(f"[DEBUG] 文本内容（前500字符）:\n{text[:500]}")
+            # 解析答案格式（支持多种格式，单次扫描）
+            answers_map = _parse_answers_text(text)
+            if answers_map:
+                logger.debug("解析到 %d 道题目答案", len(answers_map))
+            else:
+                logger.debug("未能从文本中解析出答案，文本长度: %d", len(text))
 
         except HTTPException:
             raise
@@ -619,51 +681,30 @@ async def submit_student_answers(
         error_msg += "  • PDF扫描件需先OCR转文字\n"
         error_msg += "  • 题号可使用中英文符号（: . 、）\n"
         error_msg += "  • 支持行首缩进或空格\n"
-        print(f"[DEBUG] {error_msg}")
         raise HTTPException(status_code=400, detail=error_msg)
 
-    print(f"[DEBUG] 解析到的原始答案格式: {answers_map}")
-
     # 智能匹配题目ID：将 Q001 格式映射到实际题库的ID格式（如 GEN_001）
     try:
-        from app.agents.database.question_bank_storage import load_question_bank
-        qb = load_question_bank(f"{conversation_id}_generated")
-        if qb and hasattr(qb, 'questions') and qb.questions:
-            # 创建序号到实际ID的映射
+        question_ids = await run_in_threadpool(_load_question_ids, f"{conversation_id}_generated")
+        if question_ids:
+            # 按序号匹配（Q001 -> 第1题），超出题目范围或无序号时保持原key
+            question_count = len(question_ids)
             remapped_answers = {}
-            questions_list = list(qb.questions)
-            
-            # 方案1: 尝试按序号匹配（Q001 -> 第1题）
             for key, ans in answers_map.items():
-                # 提取数字序号
-                num_match = re.search(r'(\d+)', key)
-                if num_match:
-                    idx = int(num_match.group(1)) - 1  # 转为0-based索引
-                    if 0 <= idx < len(questions_list):
-                        q = questions_list[idx]
-                        actual_id = q.id if hasattr(q, 'id') else (q.get('id') if isinstance(q, dict) else None)
-                        if actual_id:
-                            remapped_answers[actual_id] = ans
-                            print(f"[DEBUG] 映射 {key} -> {actual_id}: {ans[:50]}...")
-                        else:
-                            remapped_answers[key] = ans
-                    else:
-                        # 超出题目范围，保持原key
-                        remapped_answers[key] = ans
-                else:
-                    remapped_answers[key] = ans
-            
+                num_match = _DIGIT_PATTERN.search(key)
+                idx = int(num_match.group(1)) - 1 if num_match else -1  # 转为0-based索引
+                actual_id = question_ids[idx] if 0 <= idx < question_count else None
+                remapped_answers[actual_id or key] = ans
             answers_map = remapped_answers
-            print(f"[DEBUG] 智能映射后的答案: {answers_map}")
     except Exception as e:
-        print(f"[WARNING] 智能ID映射失败，使用原始ID: {e}")
+        logger.warning("智能ID映射失败，使用原始ID: %s", e)
 
-    print(f"[DEBUG] 最终解析到的答案: {answers_map}")
+    logger.debug("最终解析到 %d 道题目答案", len(answers_map))
 
     # 调用服务进行评分（在线程池中运行同步包装）
     try:
         report = await run_in_threadpool(svc.grade_submission, conversation_id, studentName, answers_map)
-        return JSONResponse(content=report)
+        return ORJSONResponse(content=report)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -706,7 +747,6 @@ async def get_grade_report(conversation_id: str):
     # 再尝试从磁盘读取 report 文件（存在于保存的 graded question bank 同目录）
     try:
         # graded question bank filename is <conversation_id>_graded.json under data or configured storage
-        from app.agents.database.question_bank_storage import find_saved_question_bank_path
         path = find_saved_question_bank_path(f"{conversation_id}_graded")
         if path:
             report_path = path.replace('.json', '_grade_report.json')
@@ -721,7 +761,8 @@ async def get_grade_report(conversation_id: str):
 
 
 @router.get(
-    "/api/conversations/{conversation_id}/exercises/records"
+    "/api/conversations/{conversation_id}/exercises/records",
+    response_class=ORJSONResponse
 )
 async def get_student_records(conversation_id: str):
     """
@@ -731,7 +772,7 @@ async def get_student_records(conversation_id: str):
     service = ExerciseService()
     try:
         records = await run_in_threadpool(service.get_all_records, conversation_id)
-        return JSONResponse(content={"records": records})
+        return ORJSONResponse(content={"records": records})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取记录失败: {e}")
 
@@ -760,9 +801,6 @@ async def download_grading_pdf(conversation_id: str, pdf_path: str):
     """
     下载批改报告PDF
     """
-    import app.config as config
-    from pathlib import Path
-    
     # 构建完整路径
     full_path = Path(config.settings.data_dir) / pdf_path
     
@@ -803,7 +841,7 @@ async def download_exam_paper(conversation_id: str):
     except FileNotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
-        print(f"[ERROR] 下载试卷PDF失败: {e}")
+        logger.error("下载试卷PDF失败: %s", e)
         raise HTTPException(status_code=500, detail=f"生成试卷失败: {str(e)}")
 
 
@@ -1,20 +1,175 @@
 """知识图谱查询 API"""
-import json
+import asyncio
+import logging
+from contextlib import aclosing
 from typing import Optional, List
-from fastapi import APIRouter, HTTPException, status, Query
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
+from fastapi import APIRouter, Depends, HTTPException, Request, status, Query
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, ValidationError
+import orjson
 
-from app.services.graph_service import GraphService
-from app.services.memory_service import MemoryService
+from app.services.cache_service import response_cache, graph_cache_prefix
+from app.services.document_service import get_document_service
+from app.services.graph_service import GraphService, get_graph_service
+from app.services.memory_service import get_memory_service
+from app.utils.json_response import MsgspecJSONResponse
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(tags=["graph"])
 
+# 知识图谱查询支持的模式（agent 模式在流式接口中单独处理）
+_VALID_MODES = frozenset({"naive", "local", "global", "mix"})
+_VALID_MODES_STR = "naive, local, global, mix"
+
+
+def _log_token_stats(token_stats: dict):
+    """记录输入 token 统计（DEBUG 级别，未启用时不做字符串格式化）"""
+    logger.debug(
+        "[Token统计] 模式=%s, 查询=%s, 历史=%s (保留%s条: 用户%s条+助手%s条), 总计=%s",
+        token_stats['mode'], token_stats['query_tokens'], token_stats['history_tokens'],
+        token_stats['history_count'], token_stats['history_user_count'],
+        token_stats['history_assistant_count'], token_stats['total_input_tokens'],
+    )
+
+
+def _graph_cache_key(conversation_id: str, suffix: str) -> str:
+    """图谱响应缓存的 key
+    
+    缓存在每个 worker 进程内，失效调用只发生在处理上传/删除的那个进程；
+    key 中带上文档状态文件的版本，其他 worker 在文档变化后也会自动错过旧缓存
+    """
+    version = get_document_service().status_version(conversation_id)
+    return f"{graph_cache_prefix(conversation_id)}{version}:{suffix}"
+
+
+def _ndjson_line(obj) -> bytes:
+    """将对象编码为一行 NDJSON（bytes，StreamingResponse 可直接发送）"""
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS) + b"\n"
+
+
+async def _agent_text_items(agent_chunks):
+    """把 Agent 事件流中的回答事件展开为文本，其他事件原样转发（供 _coalesce_chunks 合并文本）"""
+    async for chunk in agent_chunks:
+        if chunk["type"] == "response":
+            yield chunk["content"]
+        else:
+            yield chunk
+
+
+def _response_line(content: str) -> bytes:
+    """编码 {"response": content} 这一行 NDJSON
+    
+    回答内容按 token 流式发送，是最频繁的事件：只编码字符串本身，不再为每个块构建包装字典，
+    输出与 _ndjson_line({"response": content}) 逐字节一致。
+    """
+    return b'{"response":' + orjson.dumps(content) + b'}\n'
+
+
+# 降级提示等固定消息在模块加载时预先编码，每次流式请求直接发送
+_NEWLINE_LINE = _ndjson_line({"response": "\n\n"})
+_WARN_NO_UPLOAD_LINE = _ndjson_line({"warning": "[未上传文档 ,直接给出回答]"})
+_WARN_NO_DOCUMENTS_LINE = _ndjson_line({"warning": "⚠️ 未检索到相关文档，将基于通用知识回答："})
+_WARN_NO_CONTENT_LINE = _ndjson_line({"warning": "⚠️ 未检索到相关内容，将基于通用知识回答："})
+
+
+async def _coalesce_chunks(stream, max_delay: float = 0.016, max_chars: int = 512):
+    """合并 LLM 流式输出的小块，减少逐 token 发送的开销
+    
+    缓冲区中第一个块等待超过 max_delay 秒，或累计长度达到 max_chars 时合并输出。
+    非字符串项（如 Agent 的工具调用事件）会先发出已缓冲的文本，再原样转发，保持先后顺序。
+    
+    Args:
+        stream: LLM 响应的异步迭代器
+        max_delay: 最长缓冲时间（秒）
+        max_chars: 缓冲区最大字符数
+    """
+    loop = asyncio.get_running_loop()
+    iterator = stream.__aiter__()
+    buf = []
+    size = 0
+    deadline = 0.0
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            if buf:
+                # 等待下一个块，超时则先把已缓冲的内容发出去
+                done, _ = await asyncio.wait({pending}, timeout=max(0.0, deadline - loop.time()))
+                if not done:
+                    yield "".join(buf)
+                    buf.clear()
+                    size = 0
+                    continue
+            
+            next_chunk, pending = pending, None
+            try:
+                chunk = await next_chunk
+            except StopAsyncIteration:
+                break
+            except Exception:
+                # 出错前先发出已缓冲的内容
+                if buf:
+                    yield "".join(buf)
+                raise
+            
+            if not chunk:
+                continue
+            if not isinstance(chunk, str):
+                if buf:
+                    yield "".join(buf)
+                    buf.clear()
+                    size = 0
+                yield chunk
+                continue
+            if not buf:
+                deadline = loop.time() + max_delay
+            buf.append(chunk)
+            size += len(chunk)
+            if size >= max_chars:
+                yield "".join(buf)
+                buf.clear()
+                size = 0
+        
+        if buf:
+            yield "".join(buf)
+    finally:
+        if pending is not None and not pending.done():
+            pending.cancel()
+            await asyncio.wait({pending})
+        # 客户端断开时立即关闭上游 LLM 流，释放 HTTP 连接，不等 GC 回收
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
 # 请求/响应模型
 class QueryRequest(BaseModel):
     query: str
     mode: Optional[str] = "naive"  # naive/local/global/mix/agent
 
+async def _parse_query_request(request: Request) -> QueryRequest:
+    """用 model_validate_json 一次完成请求体的 JSON 解析和校验（跳过 json.loads + 二次校验）"""
+    body = await request.body()
+    try:
+        return QueryRequest.model_validate_json(body)
+    except ValidationError as e:
+        # 保持与 FastAPI 默认一致的 422 错误格式
+        raise RequestValidationError(
+            [{**err, "loc": ("body", *err["loc"])} for err in e.errors(include_url=False)]
+        )
+
+
+# 请求体由依赖手动解析，需显式声明到 OpenAPI 文档中
+_QUERY_REQUEST_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {"application/json": {"schema": QueryRequest.model_json_schema()}},
+    }
+}
+
 class QueryResponse(BaseModel):
     conversation_id: str
     query: str
@@ -70,9 +225,7 @@ async def get_graph_status(conversation_id: str):
     Returns:
         知识图谱状态信息
     """
-    from app.services.document_service import DocumentService
-    
-    doc_service = DocumentService()
+    doc_service = get_document_service()
     documents = doc_service.list_documents(conversation_id)
     
     total = len(documents)
@@ -95,7 +248,7 @@ async def get_graph_status(conversation_id: str):
     # 只有当所有文档都完成时，知识图谱才算完全生成
     is_ready = total > 0 and completed == total
     
-    return GraphStatusResponse(
+    return GraphStatusResponse.model_construct(
         is_ready=is_ready,
         total_documents=total,
         completed_documents=completed,
@@ -105,42 +258,105 @@ async def get_graph_status(conversation_id: str):
     )
 
 
+def _entity_to_dict(entity: dict) -> dict:
+    """将服务层实体数据转换为 EntityResponse 结构的字典（数据来自可信服务层，不做校验）"""
+    return {
+        "entity_id": entity["entity_id"],
+        "name": entity["name"],
+        "type": entity["type"],
+        "description": entity.get("description", ""),
+        "source_id": entity.get("source_id"),
+        "file_path": entity.get("file_path"),
+        "source_documents": [
+            {
+                "file_id": doc["file_id"],
+                "filename": doc["filename"],
+                "file_type": doc["file_type"],
+            }
+            for doc in entity.get("source_documents") or ()
+        ],
+    }
+
+
+def _relation_to_dict(relation: dict) -> dict:
+    """将服务层关系数据转换为 RelationResponse 结构的字典"""
+    return {
+        "relation_id": relation["relation_id"],
+        "source": relation["source"],
+        "target": relation["target"],
+        "type": relation["type"],
+        "description": relation["description"],
+    }
+
+
+async def _graph_ndjson_stream(service: GraphService, conversation_id: str):
+    """逐行输出知识图谱的实体和关系，峰值内存不随图谱规模增长"""
+    total_entities = 0
+    total_relations = 0
+    try:
+        async for entity in service.iter_all_entities(conversation_id):
+            total_entities += 1
+            yield _ndjson_line({"entity": _entity_to_dict(entity)})
+        async for relation in service.iter_all_relations(conversation_id):
+            total_relations += 1
+            yield _ndjson_line({"relation": _relation_to_dict(relation)})
+        yield _ndjson_line({"total_entities": total_entities, "total_relations": total_relations})
+    except Exception as e:
+        yield _ndjson_line({"error": f"获取知识图谱失败: {str(e)}"})
+
+
+# 图谱读取接口直接返回 MsgspecJSONResponse，跳过 Pydantic 校验和 jsonable_encoder；
+# 响应模型仅用于 OpenAPI 文档
 @router.get("/api/conversations/{conversation_id}/graph",
-            response_model=GraphResponse)
-async def get_graph(conversation_id: str):
+            response_class=MsgspecJSONResponse,
+            responses={200: {"model": GraphResponse}})
+async def get_graph(
+    conversation_id: str,
+    format: str = Query("json", description="响应格式：json（默认）或 ndjson（逐行流式输出）")
+):
     """获取对话的所有实体和关系
     
     Args:
         conversation_id: 对话ID
+        format: json 返回完整对象；ndjson 每行一个 {"entity": ...} / {"relation": ...}，
+            最后一行为 {"total_entities": n, "total_relations": m}
     """
-    service = GraphService()
+    service = get_graph_service()
+    
+    if format == "ndjson":
+        return StreamingResponse(
+            _graph_ndjson_stream(service, conversation_id),
+            media_type="application/x-ndjson",
+            headers={
+                "Cache-Control": "no-cache",
+                "X-Accel-Buffering": "no"
+            }
+        )
+    
+    cache_key = _graph_cache_key(conversation_id, "all")
+    cached = response_cache.get_bytes(cache_key)
+    if cached is not None:
+        return Response(cached, media_type="application/json")
     
     try:
-        entities = await service.get_all_entities(conversation_id)
-        relations = await service.get_all_relations(conversation_id)
-        
-        # 转换实体数据，包括来源文档
-        entity_responses = []
-        for entity in entities:
-            source_docs = [
-                SourceDocument(**doc) for doc in entity.get("source_documents", [])
-            ]
-            entity_responses.append(EntityResponse(
-                entity_id=entity["entity_id"],
-                name=entity["name"],
-                type=entity["type"],
-                description=entity.get("description", ""),
-                source_id=entity.get("source_id"),
-                file_path=entity.get("file_path"),
-                source_documents=source_docs
-            ))
-        
-        return GraphResponse(
-            entities=entity_responses,
-            relations=[RelationResponse(**relation) for relation in relations],
-            total_entities=len(entities),
-            total_relations=len(relations)
+        # 实体和关系来自相互独立的存储，并发读取
+        entities, relations = await asyncio.gather(
+            service.get_all_entities(conversation_id),
+            service.get_all_relations(conversation_id),
+            return_exceptions=True
         )
+        for result in (entities, relations):
+            if isinstance(result, BaseException):
+                raise result
+        
+        response = MsgspecJSONResponse({
+            "entities": [_entity_to_dict(entity) for entity in entities],
+            "relations": [_relation_to_dict(relation) for relation in relations],
+            "total_entities": len(entities),
+            "total_relations": len(relations),
+        })
+        response_cache.set_bytes(cache_key, response.body)
+        return response
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -149,7 +365,8 @@ async def get_graph(conversation_id: str):
 
 
 @router.get("/api/conversations/{conversation_id}/graph/entities/{entity_id}",
-            response_model=EntityResponse)
+            response_class=MsgspecJSONResponse,
+            responses={200: {"model": EntityResponse}})
 async def get_entity(conversation_id: str, entity_id: str):
     """获取单个实体详情
     
@@ -157,7 +374,12 @@ async def get_entity(conversation_id: str, entity_id: str):
         conversation_id: 对话ID
         entity_id: 实体ID
     """
-    service = GraphService()
+    cache_key = _graph_cache_key(conversation_id, f"entity:{entity_id}")
+    cached = response_cache.get_bytes(cache_key)
+    if cached is not None:
+        return Response(cached, media_type="application/json")
+    
+    service = get_graph_service()
     
     entity = await service.get_entity_detail(conversation_id, entity_id)
     
@@ -167,24 +389,14 @@ async def get_entity(conversation_id: str, entity_id: str):
             detail=f"实体 {entity_id} 不存在"
         )
     
-    # 转换来源文档
-    source_docs = [
-        SourceDocument(**doc) for doc in entity.get("source_documents", [])
-    ]
-    
-    return EntityResponse(
-        entity_id=entity["entity_id"],
-        name=entity["name"],
-        type=entity["type"],
-        description=entity.get("description", ""),
-        source_id=entity.get("source_id"),
-        file_path=entity.get("file_path"),
-        source_documents=source_docs
-    )
+    response = MsgspecJSONResponse(_entity_to_dict(entity))
+    response_cache.set_bytes(cache_key, response.body)
+    return response
 
 
 @router.get("/api/conversations/{conversation_id}/graph/relations",
-            response_model=RelationResponse)
+            response_class=MsgspecJSONResponse,
+            responses={200: {"model": RelationResponse}})
 async def get_relation(
     conversation_id: str,
     source: str = Query(..., description="源实体ID"),
@@ -197,7 +409,12 @@ async def get_relation(
         source: 源实体ID
         target: 目标实体ID
     """
-    service = GraphService()
+    cache_key = _graph_cache_key(conversation_id, f"relation:{source}->{target}")
+    cached = response_cache.get_bytes(cache_key)
+    if cached is not None:
+        return Response(cached, media_type="application/json")
+    
+    service = get_graph_service()
     
     relation = await service.get_relation_detail(conversation_id, source, target)
     
@@ -207,12 +424,18 @@ async def get_relation(
             detail=f"关系 {source} -> {target} 不存在"
         )
     
-    return RelationResponse(**relation)
+    response = MsgspecJSONResponse(_relation_to_dict(relation))
+    response_cache.set_bytes(cache_key, response.body)
+    return response
 
 
 @router.post("/api/conversations/{conversation_id}/query",
-            response_model=QueryResponse)
-async def query_knowledge_graph(conversation_id: str, request: QueryRequest):
+             response_model=QueryResponse,
+             openapi_extra=_QUERY_REQUEST_OPENAPI)
+async def query_knowledge_graph(
+    conversation_id: str,
+    request: QueryRequest = Depends(_parse_query_request)
+):
     """在对话的知识图谱中查询（非流式）
     
     支持不同的查询模式：
@@ -225,29 +448,25 @@ async def query_knowledge_graph(conversation_id: str, request: QueryRequest):
         conversation_id: 对话ID
         request: 查询请求（包含 query 和 mode）
     """
-    service = GraphService()
+    service = get_graph_service()
     
     # 验证查询模式
-    valid_modes = ["naive", "local", "global", "mix"]
-    if request.mode not in valid_modes:
+    if request.mode not in _VALID_MODES:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"无效的查询模式: {request.mode}，支持的模式: {', '.join(valid_modes)}"
+            detail=f"无效的查询模式: {request.mode}，支持的模式: {_VALID_MODES_STR}"
         )
     
     try:
         # 获取历史对话并计算 token（减少到3轮，并限制单条消息长度）
-        memory_service = MemoryService()
-        history = memory_service.get_recent_history(conversation_id, max_turns=3, max_tokens_per_message=500)
-        token_stats = memory_service.calculate_input_tokens(request.query, history, request.mode)
-        print(f"[Token统计] 模式={token_stats['mode']}, 查询={token_stats['query_tokens']}, "
-              f"历史={token_stats['history_tokens']} (保留{token_stats['history_count']}条: "
-              f"用户{token_stats['history_user_count']}条+助手{token_stats['history_assistant_count']}条), "
-              f"总计={token_stats['total_input_tokens']}")
+        memory_service = get_memory_service()
+        history = await memory_service.aget_recent_history(conversation_id, max_turns=3, max_tokens_per_message=500)
+        token_stats = await memory_service.acalculate_input_tokens(request.query, history, request.mode)
+        _log_token_stats(token_stats)
         
         result = await service.query(conversation_id, request.query, request.mode)
         
-        return QueryResponse(
+        return QueryResponse.model_construct(
             conversation_id=conversation_id,
             query=request.query,
             mode=request.mode,
@@ -260,8 +479,12 @@ async def query_knowledge_graph(conversation_id: str, request: QueryRequest):
         )
 
 
-@router.post("/api/conversations/{conversation_id}/query/stream")
-async def query_knowledge_graph_stream(conversation_id: str, request: QueryRequest):
+@router.post("/api/conversations/{conversation_id}/query/stream",
+             openapi_extra=_QUERY_REQUEST_OPENAPI)
+async def query_knowledge_graph_stream(
+    conversation_id: str,
+    request: QueryRequest = Depends(_parse_query_request)
+):
     """流式查询知识图谱（支持逐字显示）
     
     支持不同的查询模式：
@@ -281,18 +504,15 @@ async def query_knowledge_graph_stream(conversation_id: str, request: QueryReque
         - 每行一个 JSON 对象：{"response": "chunk"} 或 {"warning": "message"}
         - 错误时：{"error": "error message"}
     """
-    service = GraphService()
-    memory_service = MemoryService()
+    service = get_graph_service()
+    memory_service = get_memory_service()
     
     # 获取历史对话（减少到3轮，并限制单条消息长度）
-    history = memory_service.get_recent_history(conversation_id, max_turns=3, max_tokens_per_message=500)
+    history = await memory_service.aget_recent_history(conversation_id, max_turns=3, max_tokens_per_message=500)
     
-    # 计算并打印输入 token
-    token_stats = memory_service.calculate_input_tokens(request.query, history, request.mode)
-    print(f"[Token统计] 模式={token_stats['mode']}, 查询={token_stats['query_tokens']}, "
-          f"历史={token_stats['history_tokens']} (保留{token_stats['history_count']}条: "
-          f"用户{token_stats['history_user_count']}条+助手{token_stats['history_assistant_count']}条), "
-          f"总计={token_stats['total_input_tokens']}")
+    # 计算并记录输入 token
+    token_stats = await memory_service.acalculate_input_tokens(request.query, history, request.mode)
+    _log_token_stats(token_stats)
     
     # 检查是否是 Agent 模式
     if request.mode == "agent":
@@ -303,30 +523,33 @@ async def query_knowledge_graph_stream(conversation_id: str, request: QueryReque
         
         async def agent_stream():
             try:
-                async for chunk in agent_service.process_user_query(
+                agent_chunks = agent_service.process_user_query(
                     conversation_id,
                     request.query,
                     conversation_history=history
-                ):
-                    # 格式化输出
-                    if chunk["type"] == "tool_call":
-                        # tool_call 事件：发送 tool_call 对象
-                        yield f"{json.dumps({'tool_call': chunk.get('tool_call')})}\n"
-                    elif chunk["type"] == "tool_result":
-                        yield f"{json.dumps({'tool_result': chunk})}\n"
-                    elif chunk["type"] == "tool_error":
-                        yield f"{json.dumps({'tool_error': chunk})}\n"
-                    elif chunk["type"] == "mindmap_content":
-                        yield f"{json.dumps({'mindmap_content': chunk['content']})}\n"
-                    elif chunk["type"] == "response":
-                        yield f"{json.dumps({'response': chunk['content']})}\n"
-                    elif chunk["type"] == "error":
-                        yield f"{json.dumps({'error': chunk['content']})}\n"
+                )
+                # 回答文本按 token 到达，合并后再发送；工具调用等事件不合并，立即发送
+                async with aclosing(agent_chunks), aclosing(_coalesce_chunks(_agent_text_items(agent_chunks))) as items:
+                    async for chunk in items:
+                        # 格式化输出
+                        if isinstance(chunk, str):
+                            yield _response_line(chunk)
+                        elif chunk["type"] == "tool_call":
+                            # tool_call 事件：发送 tool_call 对象
+                            yield _ndjson_line({'tool_call': chunk.get('tool_call')})
+                        elif chunk["type"] == "tool_result":
+                            yield _ndjson_line({'tool_result': chunk})
+                        elif chunk["type"] == "tool_error":
+                            yield _ndjson_line({'tool_error': chunk})
+                        elif chunk["type"] == "mindmap_content":
+                            yield _ndjson_line({'mindmap_content': chunk['content']})
+                        elif chunk["type"] == "error":
+                            yield _ndjson_line({'error': chunk['content']})
             except Exception as e:
                 error_msg = str(e)
                 if "401" in error_msg or "Invalid token" in error_msg or "Unauthorized" in error_msg:
                     error_msg = "API Key 无效或已过期，请在设置中检查并更新 API Key"
-                yield f"{json.dumps({'error': error_msg})}\n"
+                yield _ndjson_line({'error': error_msg})
         
         return StreamingResponse(
             agent_stream(),
@@ -339,11 +562,10 @@ async def query_knowledge_graph_stream(conversation_id: str, request: QueryReque
         )
     
     # 验证查询模式（排除 bypass 模式和 agent 模式）
-    valid_modes = ["naive", "local", "global", "mix"]
-    if request.mode not in valid_modes:
+    if request.mode not in _VALID_MODES:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"无效的查询模式: {request.mode}，支持的模式: {', '.join(valid_modes + ['agent'])}"
+            detail=f"无效的查询模式: {request.mode}，支持的模式: {_VALID_MODES_STR}, agent"
         )
     
     # 第一层：快速检查是否有文档（无需初始化 LightRAG）
@@ -351,12 +573,9 @@ async def query_knowledge_graph_stream(conversation_id: str, request: QueryReque
         # 快速路径：直接使用 bypass 模式，无需初始化 LightRAG 和检查知识图谱
         async def fast_bypass_stream():
             try:
-                # 发送警告提示
-                warning_message = "[未上传文档 ,直接给出回答]"
-                yield f"{json.dumps({'warning': warning_message})}\n"
-                # 发送换行
-                newline_text = '\n\n'
-                yield f"{json.dumps({'response': newline_text})}\n"
+                # 发送警告提示和换行
+                yield _WARN_NO_UPLOAD_LINE
+                yield _NEWLINE_LINE
                 
                 # 初始化 LightRAG（仅用于 bypass 模式，无需检查知识图谱）
                 lightrag = await service.lightrag_service.get_lightrag_for_conversation(conversation_id)
@@ -377,18 +596,18 @@ async def query_knowledge_graph_stream(conversation_id: str, request: QueryReque
                     error_msg = str(e)
                     if "401" in error_msg or "Invalid token" in error_msg or "Unauthorized" in error_msg:
                         error_msg = "API Key 无效或已过期，请在设置中检查并更新 API Key"
-                    yield f"{json.dumps({'error': error_msg})}\n"
+                    yield _ndjson_line({'error': error_msg})
                     return
-                
-                # 恢复原始的 LLM 函数（用于文档抽取）
-                lightrag.llm_model_func = original_llm_func
+                finally:
+                    # 恢复原始的 LLM 函数（用于文档抽取），请求出错或被取消时同样恢复
+                    lightrag.llm_model_func = original_llm_func
                 
                 # 检查是否有错误状态
                 if bypass_result.get("status") == "failure":
                     error_msg = bypass_result.get("message", "查询失败")
                     if "401" in error_msg or "Invalid token" in error_msg or "Unauthorized" in error_msg:
                         error_msg = "API Key 无效或已过期，请在设置中检查并更新 API Key"
-                    yield f"{json.dumps({'error': error_msg})}\n"
+                    yield _ndjson_line({'error': error_msg})
                     return
                 
                 llm_response = bypass_result.get("llm_response", {})
@@ -398,29 +617,29 @@ async def query_knowledge_graph_stream(conversation_id: str, request: QueryReque
                     response_stream = llm_response.get("response_iterator")
                     if response_stream:
                         try:
-                            async for chunk in response_stream:
-                                if chunk:
-                                    yield f"{json.dumps({'response': chunk})}\n"
+                            async with aclosing(_coalesce_chunks(response_stream)) as chunks:
+                                async for chunk in chunks:
+                                    yield _response_line(chunk)
                         except Exception as e:
                             error_msg = str(e)
                             if "401" in error_msg or "Invalid token" in error_msg or "Unauthorized" in error_msg:
                                 error_msg = "API Key 无效或已过期，请在设置中检查并更新 API Key"
-                            yield f"{json.dumps({'error': error_msg})}\n"
+                            yield _ndjson_line({'error': error_msg})
                     else:
                         content = llm_response.get("content", "")
                         if content:
-                            yield f"{json.dumps({'response': content})}\n"
+                            yield _response_line(content)
                 else:
                     content = llm_response.get("content", "")
                     if content:
-                        yield f"{json.dumps({'response': content})}\n"
+                        yield _response_line(content)
                     else:
-                        yield f"{json.dumps({'error': 'No response generated'})}\n"
+                        yield _ndjson_line({'error': 'No response generated'})
             except Exception as e:
                 error_msg = str(e)
                 if "401" in error_msg or "Invalid token" in error_msg or "Unauthorized" in error_msg:
                     error_msg = "API Key 无效或已过期，请在设置中检查并更新 API Key"
-                yield f"{json.dumps({'error': error_msg})}\n"
+                yield _ndjson_line({'error': error_msg})
         
         return StreamingResponse(
             fast_bypass_stream(),
@@ -435,25 +654,31 @@ async def query_knowledge_graph_stream(conversation_id: str, request: QueryReque
     # 第二层：有文档，进入正常流程（包含知识图谱检查）
     async def stream_generator():
         try:
-            # 步骤1：查询前检测知识图谱是否为空
-            kg_empty_before, error_msg = await service.check_knowledge_graph_empty(conversation_id)
-            
-            if error_msg:
-                # 检测出错，显示错误信息
-                yield f"{json.dumps({'error': error_msg})}\n"
-                return
-            
-            lightrag = await service.lightrag_service.get_lightrag_for_conversation(conversation_id)
+            # 步骤1：查询前检测知识图谱是否为空（同时获取 LightRAG 实例，两者共享同一次初始化）
+            lightrag_task = asyncio.create_task(
+                service.lightrag_service.get_lightrag_for_conversation(conversation_id)
+            )
+            try:
+                kg_empty_before, error_msg = await service.check_knowledge_graph_empty(conversation_id)
+                
+                if error_msg:
+                    # 检测出错，显示错误信息
+                    yield _ndjson_line({'error': error_msg})
+                    return
+                
+                lightrag = await lightrag_task
+            finally:
+                # 检测出错、抛出异常或客户端断开时，取消并等待 LightRAG 初始化任务，不留下无人等待的任务
+                if not lightrag_task.done():
+                    lightrag_task.cancel()
+                await asyncio.gather(lightrag_task, return_exceptions=True)
             from lightrag import QueryParam
             
             # 如果查询前知识图谱为空，直接使用 bypass 模式，跳过查询
             if kg_empty_before:
-                # 直接发送警告提示并使用 bypass 模式
-                warning_message = "⚠️ 未检索到相关文档，将基于通用知识回答："
-                yield f"{json.dumps({'warning': warning_message})}\n"
-                # 发送换行（不能在 f-string 表达式中使用反斜杠）
-                newline_text = '\n\n'
-                yield f"{json.dumps({'response': newline_text})}\n"
+                # 直接发送警告提示和换行，并使用 bypass 模式
+                yield _WARN_NO_DOCUMENTS_LINE
+                yield _NEWLINE_LINE
                 
                 # 临时替换 LLM 函数为聊天配置（用于查询）
                 original_llm_func = lightrag.llm_model_func
@@ -470,18 +695,18 @@ async def query_knowledge_graph_stream(conversation_id: str, request: QueryReque
                     error_msg = str(e)
                     if "401" in error_msg or "Invalid token" in error_msg or "Unauthorized" in error_msg:
                         error_msg = "API Key 无效或已过期，请在设置中检查并更新 API Key"
-                    yield f"{json.dumps({'error': error_msg})}\n"
+                    yield _ndjson_line({'error': error_msg})
                     return
-                
-                # 恢复原始的 LLM 函数（用于文档抽取）
-                lightrag.llm_model_func = original_llm_func
+                finally:
+                    # 恢复原始的 LLM 函数（用于文档抽取），请求出错或被取消时同样恢复
+                    lightrag.llm_model_func = original_llm_func
                 
                 # 检查是否有错误状态
                 if bypass_result.get("status") == "failure":
                     error_msg = bypass_result.get("message", "查询失败")
                     if "401" in error_msg or "Invalid token" in error_msg or "Unauthorized" in error_msg:
                         error_msg = "API Key 无效或已过期，请在设置中检查并更新 API Key"
-                    yield f"{json.dumps({'error': error_msg})}\n"
+                    yield _ndjson_line({'error': error_msg})
                     return
                 
                 llm_response = bypass_result.get("llm_response", {})
@@ -501,41 +726,39 @@ async def query_knowledge_graph_stream(conversation_id: str, request: QueryReque
                     error_msg = str(e)
                     if "401" in error_msg or "Invalid token" in error_msg or "Unauthorized" in error_msg:
                         error_msg = "API Key 无效或已过期，请在设置中检查并更新 API Key"
-                    yield f"{json.dumps({'error': error_msg})}\n"
+                    yield _ndjson_line({'error': error_msg})
                     return
-                
-                # 恢复原始的 LLM 函数（用于文档抽取）
-                lightrag.llm_model_func = original_llm_func
+                finally:
+                    # 恢复原始的 LLM 函数（用于文档抽取），请求出错或被取消时同样恢复
+                    lightrag.llm_model_func = original_llm_func
                 
                 # 步骤3：查询后验证结果
                 result_empty, no_content = await service.check_query_result_empty(result, kg_empty_before)
                 
                 # 判断是否需要降级到 bypass 模式
                 need_fallback = False
-                warning_message = None
+                warning_line = None
                 
                 if result_empty:
                     if no_content:
                         # 有知识图谱但查询未匹配到相关内容
                         need_fallback = True
-                        warning_message = "⚠️ 未检索到相关内容，将基于通用知识回答："
+                        warning_line = _WARN_NO_CONTENT_LINE
                     else:
                         # 其他情况（查询失败等）
                         need_fallback = True
-                        warning_message = "⚠️ 未检索到相关文档，将基于通用知识回答："
+                        warning_line = _WARN_NO_DOCUMENTS_LINE
                 elif result.get("status") == "failure":
                     # 查询失败（非 401 错误）
                     need_fallback = True
-                    warning_message = "⚠️ 未检索到相关文档，将基于通用知识回答："
+                    warning_line = _WARN_NO_DOCUMENTS_LINE
                 
                 # 如果需要降级，使用 bypass 模式重新查询
                 if need_fallback:
                     # 先发送警告提示
-                    if warning_message:
-                        yield f"{json.dumps({'warning': warning_message})}\n"
-                        # 发送换行（不能在 f-string 表达式中使用反斜杠）
-                        newline_text = '\n\n'
-                        yield f"{json.dumps({'response': newline_text})}\n"
+                    if warning_line:
+                        yield warning_line
+                        yield _NEWLINE_LINE
                     
                     # 临时替换 LLM 函数为聊天配置（用于查询）
                     original_llm_func = lightrag.llm_model_func
@@ -552,11 +775,11 @@ async def query_knowledge_graph_stream(conversation_id: str, request: QueryReque
                         error_msg = str(e)
                         if "401" in error_msg or "Invalid token" in error_msg or "Unauthorized" in error_msg:
                             error_msg = "API Key 无效或已过期，请在设置中检查并更新 API Key"
-                        yield f"{json.dumps({'error': error_msg})}\n"
+                        yield _ndjson_line({'error': error_msg})
                         return
-                    
-                    # 恢复原始的 LLM 函数（用于文档抽取）
-                    lightrag.llm_model_func = original_llm_func
+                    finally:
+                        # 恢复原始的 LLM 函数（用于文档抽取），请求出错或被取消时同样恢复
+                        lightrag.llm_model_func = original_llm_func
                     llm_response = bypass_result.get("llm_response", {})
                 else:
                     # 正常使用查询结果
@@ -576,7 +799,7 @@ async def query_knowledge_graph_stream(conversation_id: str, request: QueryReque
                 error_msg = result_to_check.get("message", "查询失败")
                 if "401" in error_msg or "Invalid token" in error_msg or "Unauthorized" in error_msg:
                     error_msg = "API Key 无效或已过期，请在设置中检查并更新 API Key"
-                yield f"{json.dumps({'error': error_msg})}\n"
+                yield _ndjson_line({'error': error_msg})
                 return
             
             # 步骤5：流式发送响应
@@ -585,33 +808,34 @@ async def query_knowledge_graph_stream(conversation_id: str, request: QueryReque
                 response_stream = llm_response.get("response_iterator")
                 if response_stream:
                     try:
-                        async for chunk in response_stream:
-                            if chunk:  # 只发送非空内容
-                                yield f"{json.dumps({'response': chunk})}\n"
+                        # 合并小块后发送（空内容在合并时已过滤）
+                        async with aclosing(_coalesce_chunks(response_stream)) as chunks:
+                            async for chunk in chunks:
+                                yield _response_line(chunk)
                     except Exception as e:
                         error_msg = str(e)
                         if "401" in error_msg or "Invalid token" in error_msg or "Unauthorized" in error_msg:
                             error_msg = "API Key 无效或已过期，请在设置中检查并更新 API Key"
-                        yield f"{json.dumps({'error': error_msg})}\n"
+                        yield _ndjson_line({'error': error_msg})
                 else:
                     # 如果没有流式响应，发送完整内容
                     content = llm_response.get("content", "")
                     if content:
-                        yield f"{json.dumps({'response': content})}\n"
+                        yield _response_line(content)
             else:
                 # 非流式模式：发送完整响应
                 content = llm_response.get("content", "")
                 if content:
-                    yield f"{json.dumps({'response': content})}\n"
+                    yield _response_line(content)
                 else:
-                    yield f"{json.dumps({'error': 'No response generated'})}\n"
+                    yield _ndjson_line({'error': 'No response generated'})
                     
         except Exception as e:
             error_msg = str(e)
             # 检测 401 错误
             if "401" in error_msg or "Invalid token" in error_msg or "Unauthorized" in error_msg:
                 error_msg = "API Key 无效或已过期，请在设置中检查并更新 API Key"
-            yield f"{json.dumps({'error': error_msg})}\n"
+            yield _ndjson_line({'error': error_msg})
     
     return StreamingResponse(
         stream_generator(),
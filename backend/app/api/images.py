@@ -1,25 +1,100 @@
 """图片渲染 API"""
+import asyncio
+import os
 from pathlib import Path
-from fastapi import APIRouter, HTTPException, status, Response
+from fastapi import APIRouter, HTTPException, Request, status, Response
 from fastapi.responses import FileResponse
-from typing import Optional
+from typing import Dict, Optional, Tuple
 
 import app.config as config
-from app.services.document_service import DocumentService
+from app.services.document_service import get_document_service
 from app.utils.image_renderer import ImageRenderer
+from app.utils.http_cache import cache_headers, not_modified_response
 
 router = APIRouter(tags=["images"])
 
+# 图片投递相关配置在运行期间不会变化，启动时绑定为模块常量，避免每次请求重复读取和解析路径
+_IMAGE_CACHE_DIR = Path(config.settings.image_cache_dir).resolve()
+_BEHIND_NGINX = config.settings.behind_nginx
+_ACCEL_REDIRECT_PREFIX = config.settings.image_accel_redirect_prefix
+
 # 初始化图片渲染器
 image_renderer = ImageRenderer(
-    cache_dir=config.settings.image_cache_dir,
+    cache_dir=str(_IMAGE_CACHE_DIR),
     resolution=config.settings.image_resolution,
     cache_expiry_hours=config.settings.image_cache_expiry_hours
 )
 
+# 限制同时渲染的数量，避免 PDF/PPTX 渲染进程过多抢占 CPU
+_render_semaphore = asyncio.Semaphore(os.cpu_count() or 4)
+
+# 正在进行的渲染任务：(file_id, slide_number, is_thumbnail, use_cache) -> Future
+_inflight_renders: Dict[Tuple, asyncio.Future] = {}
+
+
+async def _run_render(**kwargs) -> Optional[Path]:
+    """在线程池中执行同步渲染，并发数受 _render_semaphore 限制"""
+    async with _render_semaphore:
+        return await asyncio.to_thread(image_renderer.get_image_path, **kwargs)
+
+
+async def _render_slide_image(
+    file_path: str,
+    slide_number: int,
+    file_id: str,
+    file_extension: str,
+    use_cache: bool,
+    is_thumbnail: bool
+) -> Optional[Path]:
+    """渲染幻灯片图片（在线程中执行，同一张图片的并发请求共享一次渲染）"""
+    key = (file_id, slide_number, is_thumbnail, use_cache)
+    task = _inflight_renders.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_run_render(
+            file_path=file_path,
+            slide_number=slide_number,
+            file_id=file_id,
+            file_extension=file_extension,
+            use_cache=use_cache,
+            is_thumbnail=is_thumbnail
+        ))
+        _inflight_renders[key] = task
+        task.add_done_callback(lambda _: _inflight_renders.pop(key, None))
+    # shield：单个请求断开不会取消其它请求共享的渲染
+    return await asyncio.shield(task)
+
+
+# 渲染后的幻灯片图片按 (file_id, slide_id) 固定，内容变化时 ETag 随之变化
+_SLIDE_CACHE_CONTROL = "public, max-age=86400, immutable"
+
+
+def _slide_image_response(image_path: Path, filename: str, headers: dict) -> Response:
+    """构建幻灯片图片响应
+    
+    部署在 Nginx 之后时返回 X-Accel-Redirect，由 Nginx 直接发送缓存目录中的图片；
+    否则（或图片不在缓存目录中）回退到 FileResponse。
+    """
+    if _BEHIND_NGINX:
+        try:
+            rel_path = image_path.resolve().relative_to(_IMAGE_CACHE_DIR)
+        except ValueError:
+            rel_path = None
+        if rel_path is not None:
+            headers["X-Accel-Redirect"] = f"{_ACCEL_REDIRECT_PREFIX}{rel_path.as_posix()}"
+            headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+            return Response(media_type="image/png", headers=headers)
+    
+    return FileResponse(
+        path=str(image_path),
+        media_type="image/png",
+        filename=filename,
+        headers=headers
+    )
+
 
 @router.get("/api/conversations/{conversation_id}/documents/{file_id}/slides/{slide_id}/image")
 async def get_slide_image(
+    request: Request,
     conversation_id: str,
     file_id: str,
     slide_id: int,
@@ -33,7 +108,7 @@ async def get_slide_image(
         slide_id: 幻灯片/页面编号（从1开始）
         use_cache: 是否使用缓存（默认True）
     """
-    service = DocumentService()
+    service = get_document_service()
     
     # 获取文档信息
     document = service.get_document(conversation_id, file_id)
@@ -52,7 +127,7 @@ async def get_slide_image(
     
     try:
         # 渲染图片
-        image_path = image_renderer.get_image_path(
+        image_path = await _render_slide_image(
             file_path=document["file_path"],
             slide_number=slide_id,
             file_id=file_id,
@@ -67,16 +142,14 @@ async def get_slide_image(
                 detail=f"图片渲染失败：无法生成幻灯片 {slide_id} 的图片"
             )
         
+        # 客户端缓存仍有效时返回 304，不再发送图片内容
+        headers = cache_headers(image_path, _SLIDE_CACHE_CONTROL)
+        not_modified = not_modified_response(request, headers)
+        if not_modified:
+            return not_modified
+        
         # 返回文件响应
-        response = FileResponse(
-            path=str(image_path),
-            media_type="image/png",
-            filename=f"slide_{slide_id}.png"
-        )
-        # 显式添加CORS头（确保图片可以跨域加载）
-        response.headers["Access-Control-Allow-Origin"] = "http://localhost:5173"
-        response.headers["Access-Control-Allow-Credentials"] = "true"
-        return response
+        return _slide_image_response(image_path, f"slide_{slide_id}.png", headers)
     except HTTPException:
         raise
     except Exception as e:
@@ -92,6 +165,7 @@ async def get_slide_image(
 
 @router.get("/api/conversations/{conversation_id}/documents/{file_id}/slides/{slide_id}/thumbnail")
 async def get_slide_thumbnail(
+    request: Request,
     conversation_id: str,
     file_id: str,
     slide_id: int,
@@ -105,7 +179,7 @@ async def get_slide_thumbnail(
         slide_id: 幻灯片/页面编号（从1开始）
         use_cache: 是否使用缓存（默认True）
     """
-    service = DocumentService()
+    service = get_document_service()
     
     # 获取文档信息
     document = service.get_document(conversation_id, file_id)
@@ -124,7 +198,7 @@ async def get_slide_thumbnail(
     
     try:
         # 渲染缩略图
-        image_path = image_renderer.get_image_path(
+        image_path = await _render_slide_image(
             file_path=document["file_path"],
             slide_number=slide_id,
             file_id=file_id,
@@ -139,16 +213,14 @@ async def get_slide_thumbnail(
                 detail=f"缩略图渲染失败：无法生成幻灯片 {slide_id} 的缩略图"
             )
         
+        # 客户端缓存仍有效时返回 304，不再发送图片内容
+        headers = cache_headers(image_path, _SLIDE_CACHE_CONTROL)
+        not_modified = not_modified_response(request, headers)
+        if not_modified:
+            return not_modified
+        
         # 返回文件响应
-        response = FileResponse(
-            path=str(image_path),
-            media_type="image/png",
-            filename=f"slide_{slide_id}_thumb.png"
-        )
-        # 显式添加CORS头（确保图片可以跨域加载）
-        response.headers["Access-Control-Allow-Origin"] = "http://localhost:5173"
-        response.headers["Access-Control-Allow-Credentials"] = "true"
-        return response
+        return _slide_image_response(image_path, f"slide_{slide_id}_thumb.png", headers)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
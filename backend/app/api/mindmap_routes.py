@@ -5,7 +5,7 @@ from pydantic import BaseModel
 from typing import Optional
 
 from app.services.mindmap_service import MindMapService
-from app.services.document_service import DocumentService
+from app.services.document_service import get_document_service
 from app.utils.document_parser import DocumentParser
 
 router = APIRouter(tags=["mindmap"])
@@ -42,7 +42,7 @@ async def generate_mindmap(conversation_id: str, document_id: Optional[str] = No
         document_id: 文档ID（可选，如果提供则只处理该文档）
     """
     service = MindMapService()
-    doc_service = DocumentService()
+    doc_service = get_document_service()
     parser = DocumentParser()
     from app.services.conversation_service import ConversationService
     conv_service = ConversationService()
@@ -1,17 +1,30 @@
+import json
+import os
+from dataclasses import dataclass, field, fields
 from pathlib import Path
-from pydantic_settings import BaseSettings
-from typing import List
+from typing import Dict, List
 
 BASE_DIR = Path(__file__).resolve().parent.parent
+ENV_FILE = BASE_DIR / ".env"
 
 
-class Settings(BaseSettings):
-    """应用配置"""
+@dataclass(slots=True)
+class Settings:
+    """应用配置
+
+    字段均为简单标量/列表，启动时从环境变量和 .env 读取一次（环境变量优先，不区分大小写）。
+    不设为 frozen：ConfigService 会在运行时更新分场景 LLM 配置。
+    """
     # 服务器配置
     host: str = "0.0.0.0"
     port: int = 8000
-    debug: bool = True
-    cors_origins: List[str] = ["http://localhost:5173", "http://localhost:3000"]
+    debug: bool = False  # 开发时可设置 DEBUG=true，出错时返回调试堆栈
+    workers: int = max(1, (os.cpu_count() or 2) // 2)  # python -m app 启动的 worker 进程数
+    limit_concurrency: int = 512  # 单个 worker 同时处理的最大连接数，超出返回 503
+    log_level: str = "INFO"  # 根日志级别，设为 DEBUG 可查看 token 统计等调试日志
+    cors_origins: List[str] = field(default_factory=lambda: ["http://localhost:5173", "http://localhost:3000"])
+    cors_allow_methods: List[str] = field(default_factory=lambda: ["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"])
+    cors_allow_headers: List[str] = field(default_factory=lambda: ["authorization", "content-type", "x-request-id"])
     
     # LightRAG 配置（后续使用）
     lightrag_working_dir: str = "./data/.lightrag"
@@ -55,8 +68,11 @@ class Settings(BaseSettings):
     # 文件上传配置
     upload_dir: str = str(BASE_DIR / "uploads")
     max_file_size: int = 52428800  # 50MB
-    allowed_extensions: List[str] = ["pptx", "ppt", "pdf"]
+    allowed_extensions: List[str] = field(default_factory=lambda: ["pptx", "ppt", "pdf"])
     max_files_per_conversation: int = 20  # 每个对话最多文件数
+    upload_concurrency: int = 4  # 进程内同时处理的上传请求数（限制峰值内存）
+    upload_wait_secs: int = 30  # 等待上传名额的最长时间，超时返回 503
+    upload_rate_limit: str = "15/minute"  # 每个客户端 IP 的上传频率上限（次数/second|minute|hour|day）
     
     # 对话和元数据存储配置
     conversations_metadata_dir: str = str(BASE_DIR / "uploads/metadata")
@@ -70,10 +86,14 @@ class Settings(BaseSettings):
     image_resolution: int = 150  # DPI
     image_cache_expiry_hours: int = 24  # 缓存过期时间（小时）
     enable_image_cache: bool = True  # 是否启用图片缓存
+    # 部署在 Nginx 之后时启用：图片通过 X-Accel-Redirect 交给 Nginx 直接发送
+    # Nginx 需配置 location /_image_cache/ { internal; alias <image_cache_dir>/; }
+    behind_nginx: bool = False
+    image_accel_redirect_prefix: str = "/_image_cache/"
     
     # 样本试题配置
     exercises_dir: str = str(BASE_DIR / "uploads/exercises")
-    exercise_allowed_extensions: List[str] = ["pdf", "docx", "txt"]  # 样本试题支持的文件类型
+    exercise_allowed_extensions: List[str] = field(default_factory=lambda: ["pdf", "docx", "txt"])  # 样本试题支持的文件类型
     max_samples_per_conversation: int = 50  # 每个对话最多样本试题数
 
     # 外部 PaddleOCR（Gitee）配置
@@ -84,9 +104,56 @@ class Settings(BaseSettings):
     gitee_ocr_poll_interval: int = 5
     gitee_ocr_max_wait: int = 60  # 秒，轮询总等待时长
 
-    class Config:
-        env_file = str(Path(__file__).resolve().parent.parent / ".env")
-        case_sensitive = False
-        extra = "ignore"
 
-settings = Settings()
+def _read_env_file(path: Path) -> Dict[str, str]:
+    """解析 .env 文件（KEY=VALUE 格式，支持注释、export 前缀和引号），键统一转小写"""
+    values: Dict[str, str] = {}
+    if not path.is_file():
+        return values
+    for line in path.read_text(encoding="utf-8-sig").splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("export "):
+            line = line[len("export "):]
+        key, sep, value = line.partition("=")
+        if not sep:
+            continue
+        value = value.strip()
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'":
+            value = value[1:-1]
+        else:
+            value = value.split(" #", 1)[0].rstrip()
+        values[key.strip().lower()] = value
+    return values
+
+
+def _cast(raw: str, tp):
+    """按字段类型转换环境变量字符串"""
+    if tp is bool:
+        return raw.strip().lower() in ("1", "true", "yes", "on")
+    if tp is int:
+        return int(raw)
+    if tp == List[str]:
+        raw = raw.strip()
+        if raw.startswith("["):
+            return [str(item) for item in json.loads(raw)]
+        return [item.strip() for item in raw.split(",") if item.strip()]
+    return raw
+
+
+def load_settings(env_file: Path = ENV_FILE) -> Settings:
+    """从 .env 和环境变量构建配置（环境变量覆盖 .env）"""
+    env = _read_env_file(env_file)
+    env.update((key.lower(), value) for key, value in os.environ.items())
+    
+    overrides = {}
+    for f in fields(Settings):
+        raw = env.get(f.name)
+        if raw is None or (raw == "" and f.type is not str):
+            continue
+        overrides[f.name] = _cast(raw, f.type)
+    return Settings(**overrides)
+
+
+settings = load_settings()
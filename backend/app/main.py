@@ -1,61 +1,156 @@
 from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
+import sys
+import orjson
 from app.config import settings
-from app.api import conversations, documents, graph, images, exercises, mindmap_routes
-from app.api import settings as settings_api
 from app.services.config_service import config_service
+from app.services.cache_service import response_cache
+from app.utils.compression import ScopedGZipMiddleware
+from app.utils.cors import FastCORSMiddleware
+from app.utils.http_cache import STATIC_IMAGE_MAX_AGE, ImageCacheControl
+from app.utils.logging_config import setup_queue_logging
+from app.utils.probe import ProbeBypassMiddleware
+from app.utils.upload_limits import MaxUploadBodySize, UploadConcurrencyLimiter, UploadRateLimiter
+
+# 日志通过队列在后台线程输出，避免阻塞事件循环
+log_listener = setup_queue_logging(settings.log_level)
 
 app = FastAPI(
     title="Agent for Exam",
     description="基于 LightRAG 的 Web 应用程序",
-    version="1.0.0"
+    version="1.0.0",
+    debug=settings.debug
+)
+
+# 中间件约定：统一使用纯 ASGI 类，不使用 @app.middleware("http") / BaseHTTPMiddleware，
+# 后者每个请求都会额外创建任务和内存通道，吞吐量损失明显
+
+# 知识图谱 JSON 体积大（大量中文描述），压缩后传输量可降低数倍；
+# 流式问答接口不在此范围内，避免缓冲破坏逐字输出
+app.add_middleware(ScopedGZipMiddleware, path_segments=["/graph"], minimum_size=1024, compresslevel=5)
+
+# 限制并发上传数量，在读取请求体之前排队，避免多个大文件同时占用内存
+app.add_middleware(
+    UploadConcurrencyLimiter,
+    concurrency=settings.upload_concurrency,
+    wait_seconds=settings.upload_wait_secs,
+)
+
+# 按客户端 IP 限制上传频率，避免单个客户端占满上传名额；
+# 部署在 Nginx 之后时从 X-Real-IP / X-Forwarded-For 取真实 IP
+app.add_middleware(
+    UploadRateLimiter,
+    rate=settings.upload_rate_limit,
+    trust_proxy_headers=settings.behind_nginx,
 )
 
-# CORS 配置
+# 超大上传在排队和读取请求体之前直接返回 413，上限按接口各自的文件数量配置计算：
+# 文档最多 max_files_per_conversation 个，样本试题最多 max_samples_per_conversation 个，
+# 学生答卷只有一个文件；另留 1MB 给 multipart 边界和表单字段
+_MULTIPART_OVERHEAD = 1024 * 1024
 app.add_middleware(
-    CORSMiddleware,
+    MaxUploadBodySize,
+    limits={
+        "/documents/upload": settings.max_file_size * settings.max_files_per_conversation + _MULTIPART_OVERHEAD,
+        "/exercises/samples/upload": settings.max_file_size * settings.max_samples_per_conversation + _MULTIPART_OVERHEAD,
+        "/exercises/submissions": settings.max_file_size + _MULTIPART_OVERHEAD,
+    },
+)
+
+# CORS 配置（方法和请求头使用明确列表，预检响应头可预先拼接）
+# 在上传限流中间件之后添加，位于它们外层：限流直接返回的 503/429/413 也带 CORS 头，
+# 否则跨域的前端只能看到网络错误，看不到具体状态码
+app.add_middleware(
+    FastCORSMiddleware,
     allow_origins=settings.cors_origins,  # 使用明确配置的端口列表
+    allow_methods=settings.cors_allow_methods,
+    allow_headers=settings.cors_allow_headers,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
     expose_headers=["*"],  # 暴露所有响应头，包括图片相关的
 )
 
+# 探活请求（/_probe/health）在最外层直接分流，不经过 CORS 和压缩中间件；需最后添加
+app.add_middleware(ProbeBypassMiddleware)
+
 # 挂载静态文件服务（用于访问上传的图片）
-data_dir = Path(settings.data_dir)
-if data_dir.exists():
-    app.mount("/uploads", StaticFiles(directory=str(data_dir)), name="uploads")
+# 部署在 Nginx 之后时由 Nginx 直接 sendfile 发送（见 部署.md），不再经过 Python
+data_dir = Path(settings.data_dir).resolve()
+if data_dir.exists() and not settings.behind_nginx:
+    # 两个路径指向同一目录，共用一个 StaticFiles 实例；目录已检查过，跳过 check_dir
+    # 图片会在原路径上重新生成（如幻灯片图片），不能标记 immutable：
+    # 短期内直接使用浏览器缓存，过期后凭 StaticFiles 的 ETag / Last-Modified 重新验证
+    data_static = ImageCacheControl(
+        StaticFiles(directory=str(data_dir), check_dir=False),
+        STATIC_IMAGE_MAX_AGE,
+    )
+    app.mount("/uploads", data_static, name="uploads")
     # 🆕 添加 /data 路由，方便前端访问图片
-    app.mount("/data", StaticFiles(directory=str(data_dir)), name="data")
-
-# 注册路由
-app.include_router(conversations.router)
-app.include_router(documents.router)
-app.include_router(graph.router)
-app.include_router(images.router)
-app.include_router(exercises.router)
-app.include_router(mindmap_routes.router)
-app.include_router(settings_api.router)
-
-# 启动时加载配置
+    app.mount("/data", data_static, name="data")
+
+def _register_routers():
+    """导入 API 模块并注册路由
+    
+    API 模块会间接导入 LightRAG、文档解析等重型依赖，推迟到启动阶段导入，
+    使 `import app.main`（工具脚本、进程管理器预加载）保持轻量。
+    各 router 的路径前缀和 tags 在定义时已写入路由本身，直接追加路由对象，
+    省去 include_router 逐条复制路由的开销。
+    """
+    from app.api import conversations, documents, graph, images, exercises, mindmap_routes
+    from app.api import settings as settings_api
+    
+    for api_router in (
+        conversations.router,
+        documents.router,
+        graph.router,
+        images.router,
+        exercises.router,
+        mindmap_routes.router,
+        settings_api.router,
+    ):
+        app.router.routes.extend(api_router.routes)
+    # 路由变化后重新生成 OpenAPI 文档
+    app.openapi_schema = None
+
+# 启动时注册路由并加载配置
 @app.on_event("startup")
 async def startup_event():
-    """启动时加载配置"""
+    """启动时注册路由并加载配置"""
+    log_listener.start()
+    _register_routers()
     config_service.reload_all_configs()
     print("✅ 配置服务已加载")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """关闭时释放共享的 LLM HTTP 会话，刷新并停止日志队列"""
+    # Agent 模块按需加载，未加载过说明会话从未创建
+    agent_module = sys.modules.get("app.services.agent.agent_service")
+    if agent_module is not None:
+        await agent_module.close_http_session()
+    log_listener.stop()
+
+# 根路径和健康检查的响应内容固定，启动时编码一次
+_ROOT_BODY = orjson.dumps({
+    "message": "Agent for Exam API",
+    "version": "1.0.0",
+    "status": "running"
+})
+_HEALTH_BODY = orjson.dumps({"status": "healthy"})
+_NO_CACHE_HEADERS = {"Cache-Control": "no-cache"}
+
 @app.get("/")
 async def root():
     """根路径"""
-    return {
-        "message": "Agent for Exam API",
-        "version": "1.0.0",
-        "status": "running"
-    }
+    return Response(_ROOT_BODY, media_type="application/json", headers=_NO_CACHE_HEADERS)
 
 @app.get("/health")
 async def health_check():
     """健康检查"""
-    return {"status": "healthy"}
+    return Response(_HEALTH_BODY, media_type="application/json", headers=_NO_CACHE_HEADERS)
+
+@app.get("/api/meta/cache-stats")
+async def cache_stats():
+    """响应缓存统计（命中率等）"""
+    return response_cache.stats()
@@ -29,45 +29,145 @@ Agent 核心服务模块
     - 工具执行结果会自动发送回 LLM 生成最终回答
     - 所有消息的 content 字段必须是字符串类型（不能是 None）
 """
+import asyncio
 import json
+import logging
 import re
-from typing import Dict, List, Optional, AsyncIterator, Any
+import time
+import orjson
+from contextlib import nullcontext
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Annotated, Dict, List, Mapping, Optional, AsyncIterator, Any, Tuple, Union
 from app.services.agent.tool_registry import ToolRegistry
 from app.services.agent.tool_executor import ToolExecutor
 from app.services.agent.tools.mindmap_tool import MINDMAP_TOOL
 from app.services.agent.tools.query_tool import QUERY_TOOL
 from app.services.agent.tools.list_documents_tool import LIST_DOCUMENTS_TOOL
 from app.services.lightrag_service import LightRAGService
-from app.services.memory_service import MemoryService
+from app.services.memory_service import get_memory_service
+from app.services.config_service import config_service
 import app.config as config
+from app.utils.json_response import encode_json
+from app.utils.sse import SSE_DONE, iter_sse_data
 import aiohttp
 
+try:
+    import msgspec
+    MSGSPEC_AVAILABLE = True
+except ImportError:
+    MSGSPEC_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+if MSGSPEC_AVAILABLE:
+    # 已经符合 LLM API 要求的消息格式（与 _clean_llm_message 的清理规则一致）：
+    # 整个消息列表能通过校验时说明无需任何清理，校验在 msgspec 的 C 实现中一次完成
+    _NonEmptyStr = Annotated[str, msgspec.Meta(min_length=1)]
+
+    class _CleanFunction(msgspec.Struct, forbid_unknown_fields=True):
+        name: _NonEmptyStr
+        arguments: str
+
+    class _CleanToolCall(msgspec.Struct, forbid_unknown_fields=True):
+        id: _NonEmptyStr
+        type: str
+        function: _CleanFunction
+
+    class _CleanSystemMessage(msgspec.Struct, tag_field="role", tag="system"):
+        content: str
+
+    class _CleanUserMessage(msgspec.Struct, tag_field="role", tag="user"):
+        content: str
+
+    class _CleanAssistantMessage(msgspec.Struct, tag_field="role", tag="assistant"):
+        content: str
+        tool_calls: Annotated[List[_CleanToolCall], msgspec.Meta(min_length=1)] = []
+
+    class _CleanToolMessage(msgspec.Struct, tag_field="role", tag="tool"):
+        content: str
+        tool_call_id: _NonEmptyStr
+
+    _CleanMessages = List[Union[_CleanSystemMessage, _CleanUserMessage, _CleanAssistantMessage, _CleanToolMessage]]
+
+# LLM 请求共享的 HTTP 会话：连接池保持长连接，多轮工具调用不再重复 TCP/TLS 握手
+_http_session: Optional[aiohttp.ClientSession] = None
+
+
+async def get_http_session() -> aiohttp.ClientSession:
+    """获取共享的 aiohttp 会话（首次调用时创建）"""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=64,
+            limit_per_host=32,
+            ttl_dns_cache=300,
+            keepalive_timeout=75,
+        )
+        _http_session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=300),
+        )
+    return _http_session
+
+
+async def close_http_session():
+    """关闭共享的 aiohttp 会话（应用关闭时调用）"""
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
+
+
+def _temp_tool_call_id(index: int) -> str:
+    """为缺少 id 的 tool_call 生成临时 id（索引 + 纳秒时间戳）"""
+    return f"call_{index}_{time.time_ns()}"
+
+
+@lru_cache(maxsize=1)
+def _default_tool_registry() -> ToolRegistry:
+    """注册默认工具（进程内只注册一次，所有 AgentService 共享）"""
+    registry = ToolRegistry()
+    registry.register(MINDMAP_TOOL)
+    registry.register(QUERY_TOOL)
+    registry.register(LIST_DOCUMENTS_TOOL)
+    logger.info("📦 Agent 工具注册完成，已注册 %d 个工具", len(registry.tools))
+    return registry
+
 
 class AgentService:
     """Agent 核心服务"""
     
+    # 系统提示词缓存（所有实例共享同一工具注册表）：工具集合不变时复用，
+    # 保持逐字节一致，便于 LLM 端前缀缓存命中
+    _system_prompt_cache: Optional[str] = None
+    _system_prompt_version: int = -1
+    # 聊天 LLM 配置缓存：(配置版本号, 解析结果)，配置更新后版本号变化，自动重新解析
+    _chat_llm_cache: Optional[Tuple[int, Dict[str, Any]]] = None
+    
     def __init__(self):
-        self.tool_registry = ToolRegistry()
+        self.tool_registry = _default_tool_registry()
+        # 执行器按请求创建，执行历史和速率限制计数不跨请求共享
         self.tool_executor = ToolExecutor(self.tool_registry)
-        self._register_default_tools()
-    
-    def _register_default_tools(self):
-        """注册默认工具"""
-        self.tool_registry.register(MINDMAP_TOOL)
-        self.tool_registry.register(QUERY_TOOL)
-        self.tool_registry.register(LIST_DOCUMENTS_TOOL)
-        print(f"📦 Agent 服务初始化完成，已注册 {len(self.tool_registry.tools)} 个工具")
     
     def _build_agent_system_prompt(self) -> str:
+        """获取 Agent 系统提示词（工具集合未变化时复用缓存）"""
+        cls = type(self)
+        if cls._system_prompt_version != self.tool_registry.version:
+            cls._system_prompt_cache = self._render_agent_system_prompt()
+            cls._system_prompt_version = self.tool_registry.version
+        return cls._system_prompt_cache
+    
+    def _render_agent_system_prompt(self) -> str:
         """构建 Agent 系统提示词"""
-        tools_description = []
-        for tool in self.tool_registry.list_tools():
-            tools_description.append(f"- {tool.name}: {tool.description}")
+        tools_description = "\n".join(
+            f"- {tool.name}: {tool.description}" for tool in self.tool_registry.list_tools()
+        )
         
         return f"""你是一个智能助手，可以帮助用户完成各种任务。
 
 你可以使用以下工具：
-{chr(10).join(tools_description)}
+{tools_description}
 
 基本使用规则：
 1. 根据用户的需求，智能选择合适的工具
@@ -154,13 +254,18 @@ class AgentService:
         # 1. 获取工具列表（转换为 Function Calling 格式）
         functions = self.tool_registry.to_function_calling_format()
         
-        # 2. 构建系统提示词
+        # 2. 构建系统提示词（系统消息每次查询只构建一次，各轮共用）
         system_prompt = self._build_agent_system_prompt()
+        system_msg = {"role": "system", "content": system_prompt}
         
-        # 3. 获取历史对话
+        # 聊天 LLM 配置每次查询读取一次，配置更新从下一次查询开始生效
+        llm_ctx = self._resolve_chat_llm()
+        
+        # 3. 获取历史对话（读取消息文件在线程中执行，不阻塞事件循环）
         if conversation_history is None:
-            memory_service = MemoryService()
-            conversation_history = memory_service.get_recent_history(
+            # 使用共享实例，保留各对话的历史窗口起点
+            memory_service = get_memory_service()
+            conversation_history = await memory_service.aget_recent_history(
                 conversation_id,
                 max_turns=3,
                 max_tokens_per_message=500
@@ -170,17 +275,17 @@ class AgentService:
         round_count = 0
         current_messages = []
         
-        # 添加历史对话到当前消息列表
+        # 添加历史对话到当前消息列表（只在查询开始时清理一次，之后每轮直接复用）
         if conversation_history:
-            current_messages.extend(conversation_history)
+            current_messages.extend(self._prepare_llm_messages(conversation_history))
         
         # 添加用户查询
         current_messages.append({"role": "user", "content": user_query})
         
         while round_count < max_rounds:
             round_count += 1
-            print(f"🔄 [Agent] 第 {round_count} 轮工具调用（最大 {max_rounds} 轮）")
-            print(f"📨 [Agent] 当前消息列表长度: {len(current_messages)}")
+            logger.debug("🔄 [Agent] 第 %d 轮工具调用（最大 %d 轮）", round_count, max_rounds)
+            logger.debug("📨 [Agent] 当前消息列表长度: %d", len(current_messages))
             
             # 调用 LLM（支持 Function Calling）
             tool_calls_buffer = []
@@ -189,9 +294,10 @@ class AgentService:
             
             async for chunk in self._call_llm_with_tools_round(
                 conversation_id,
-                system_prompt,
+                system_msg,
                 current_messages,
-                functions
+                functions,
+                llm_ctx
             ):
                 # 检查是否是工具调用
                 if chunk.get("type") == "tool_call":
@@ -207,116 +313,80 @@ class AgentService:
     
             # 如果没有工具调用，生成最终回答并退出
             if not has_tool_calls or not tool_calls_buffer:
-                print(f"✅ [Agent] 没有更多工具调用，生成最终回答")
+                logger.debug("✅ [Agent] 没有更多工具调用，生成最终回答")
                 # 如果 LLM 已经生成了文本内容，说明它已经回答了，不需要继续
                 if accumulated_content:
-                    print(f"💬 [Agent] LLM 已生成文本回答: {accumulated_content[:100]}...")
+                    logger.debug("💬 [Agent] LLM 已生成文本回答: %.100s...", accumulated_content)
                 break
             
             # 执行工具
-            print(f"🔧 [Agent] 执行 {len(tool_calls_buffer)} 个工具调用")
-            
-            # 调试：打印 tool_calls_buffer 的原始内容
-            print(f"🔍 [Agent] tool_calls_buffer 原始内容:")
-            for i, tc in enumerate(tool_calls_buffer):
-                print(f"  tool_call[{i}]: {tc}")
-                if isinstance(tc, dict):
-                    print(f"    id={tc.get('id')}, id类型={type(tc.get('id')).__name__}")
-                    print(f"    type={tc.get('type')}, type类型={type(tc.get('type')).__name__}")
-                    func = tc.get('function', {})
-                    print(f"    function.name={func.get('name')}, name类型={type(func.get('name')).__name__}")
-                    print(f"    function.arguments={func.get('arguments')[:100] if func.get('arguments') else None}, arguments类型={type(func.get('arguments')).__name__}")
+            logger.debug("🔧 [Agent] 执行 %d 个工具调用", len(tool_calls_buffer))
+
+            # 调试：打印 tool_calls_buffer 的原始内容（参数可能很长，只在 DEBUG 级别展开）
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("🔍 [Agent] tool_calls_buffer 原始内容:")
+                for i, tc in enumerate(tool_calls_buffer):
+                    logger.debug("  tool_call[%d]: %s", i, tc)
+                    if isinstance(tc, dict):
+                        func = tc.get('function', {})
+                        arguments = func.get('arguments')
+                        logger.debug(
+                            "    id=%s, type=%s, function.name=%s, function.arguments=%.100s, arguments类型=%s",
+                            tc.get('id'), tc.get('type'), func.get('name'),
+                            arguments, type(arguments).__name__
+                        )
             
             tool_results = []
             
             # 验证并修复 tool_calls_buffer 的格式（确保 arguments 是字符串）
             validated_tool_calls = []
             for tool_call in tool_calls_buffer:
-                if not isinstance(tool_call, dict):
+                normalized = self._normalize_tool_call(tool_call)
+                if normalized is None:
                     continue
                 
-                # 确保所有字段都是字符串类型
-                tool_call_id = tool_call.get("id")
-                if tool_call_id is None:
-                    tool_call_id = ""
-                elif not isinstance(tool_call_id, str):
-                    tool_call_id = str(tool_call_id) if tool_call_id else ""
-                
-                tool_call_type = tool_call.get("type", "function")
-                if not isinstance(tool_call_type, str):
-                    tool_call_type = str(tool_call_type) if tool_call_type else "function"
-                
-                function = tool_call.get("function", {})
-                if not isinstance(function, dict):
-                    continue
-                
-                function_name = function.get("name", "")
-                if not isinstance(function_name, str):
-                    function_name = str(function_name) if function_name else ""
-                
-                # 关键：确保 arguments 是字符串
-                function_arguments = function.get("arguments", "{}")
-                if not isinstance(function_arguments, str):
-                    # 如果是字典，转换为 JSON 字符串
-                    if isinstance(function_arguments, dict):
-                        function_arguments = json.dumps(function_arguments, ensure_ascii=False)
-                    else:
-                        function_arguments = str(function_arguments) if function_arguments is not None else "{}"
-                
                 # 如果 function_name 存在，即使 id 为空也保留（会在后面生成临时 id）
-                if function_name:
+                if normalized["function"]["name"]:
                     # 如果 id 为空，生成一个临时 id（使用索引和时间戳）
-                    if not tool_call_id:
-                        import time
-                        tool_call_id = f"call_{len(validated_tool_calls)}_{int(time.time() * 1000)}"
-                        print(f"⚠️ [Agent] tool_call id 为空，生成临时 id: {tool_call_id}")
+                    if not normalized["id"]:
+                        normalized["id"] = _temp_tool_call_id(len(validated_tool_calls))
+                        logger.warning("⚠️ [Agent] tool_call id 为空，生成临时 id: %s", normalized['id'])
                     
-                    validated_tool_calls.append({
-                        "id": tool_call_id,
-                        "type": tool_call_type,
-                        "function": {
-                            "name": function_name,
-                            "arguments": function_arguments
-                        }
-                    })
+                    validated_tool_calls.append(normalized)
                 else:
-                    print(f"⚠️ [Agent] 跳过无效的 tool_call: function_name 为空")
+                    logger.warning("⚠️ [Agent] 跳过无效的 tool_call: function_name 为空")
             
+            # validated_tool_calls 已规范化，直接构建符合 API 要求的 assistant 消息
             assistant_message = {
                 "role": "assistant",
-                "content": accumulated_content if accumulated_content else "",
-                "tool_calls": validated_tool_calls
+                "content": accumulated_content if accumulated_content else ""
             }
+            if validated_tool_calls:
+                assistant_message["tool_calls"] = validated_tool_calls
             current_messages.append(assistant_message)
-            print(f"✅ [Agent] 添加 assistant 消息，包含 {len(validated_tool_calls)} 个工具调用")
-            for i, tc in enumerate(validated_tool_calls):
-                args = tc.get("function", {}).get("arguments", "")
-                print(f"  工具调用[{i}]: id={tc.get('id')}, name={tc.get('function', {}).get('name')}, arguments类型={type(args).__name__}, arguments长度={len(str(args))}")
+            logger.debug("✅ [Agent] 添加 assistant 消息，包含 %d 个工具调用", len(validated_tool_calls))
+            if logger.isEnabledFor(logging.DEBUG):
+                for i, tc in enumerate(validated_tool_calls):
+                    logger.debug(
+                        "  工具调用[%d]: id=%s, name=%s, arguments长度=%d",
+                        i, tc["id"], tc["function"]["name"], len(tc["function"]["arguments"])
+                    )
             
-            # 执行工具调用，并正确匹配 tool_call_id
+            # 执行工具调用（同一轮内并发），按结果中的 tool_call_id 匹配工具调用
             # 注意：tool_call 事件已经在流式解析时 yield 了，这里不需要重复 yield
-            # 使用 validated_tool_calls 而不是 tool_calls_buffer，确保 id 正确
-            tool_call_index = 0
             async for result in self._execute_tool_calls(
                 validated_tool_calls,
                 conversation_id
             ):
                 # 先 yield 给前端（用于实时显示）
                 yield result
-                
+
                 # 收集工具结果
                 if result["type"] == "tool_result":
                     tool_results.append(result)
-                    
-                    # 从 validated_tool_calls 中获取对应的 tool_call_id
-                    tool_call_id = ""
-                    if tool_call_index < len(validated_tool_calls):
-                        tool_call = validated_tool_calls[tool_call_index]
-                        tool_call_id = tool_call.get("id", "")
-                        print(f"🔗 [Agent] 工具调用 ID: {tool_call_id}, 工具名: {result.get('tool_name')}")
-                    else:
-                        print(f"⚠️ [Agent] 警告: tool_call_index ({tool_call_index}) 超出 validated_tool_calls 长度 ({len(validated_tool_calls)})")
-                    
+                    tool_call_id = result.get("tool_call_id", "")
+                    logger.debug("🔗 [Agent] 工具调用 ID: %s, 工具名: %s", tool_call_id, result.get('tool_name'))
+
                     # 添加 tool 消息到当前消息列表
                     tool_result_content = self._format_tool_result(result.get("result", {}))
                     tool_message = {
@@ -324,168 +394,246 @@ class AgentService:
                         "content": tool_result_content,
                         "tool_call_id": tool_call_id
                     }
-                    current_messages.append(tool_message)
-                    print(f"📝 [Agent] 添加 tool 消息到历史，tool_call_id={tool_call_id}, content长度={len(tool_result_content)}")
-                    tool_call_index += 1
+                    # 缺少 tool_call_id 的 tool 消息会被 API 拒绝，不加入消息列表
+                    if tool_call_id:
+                        current_messages.append(tool_message)
+                    logger.debug("📝 [Agent] 添加 tool 消息到历史，tool_call_id=%s, content长度=%d", tool_call_id, len(tool_result_content))
                 elif result["type"] == "tool_error":
-                    # 从 validated_tool_calls 中获取对应的 tool_call_id
-                    tool_call_id = ""
-                    if tool_call_index < len(validated_tool_calls):
-                        tool_call = validated_tool_calls[tool_call_index]
-                        tool_call_id = tool_call.get("id", "")
-                    
+                    tool_call_id = result.get("tool_call_id", "")
                     tool_message = {
                         "role": "tool",
                         "content": f"工具执行失败: {result.get('message', '')}",
                         "tool_call_id": tool_call_id
                     }
-                    current_messages.append(tool_message)
-                    print(f"❌ [Agent] 添加 tool 错误消息到历史，tool_call_id={tool_call_id}")
+                    if tool_call_id:
+                        current_messages.append(tool_message)
+                    logger.warning("❌ [Agent] 添加 tool 错误消息到历史，tool_call_id=%s", tool_call_id)
                     tool_results.append(result)  # 收集错误结果，确保循环继续
-                    tool_call_index += 1
-            
+
             # 如果没有工具结果，退出循环
             if not tool_results:
-                print(f"⚠️ [Agent] 没有工具执行结果，退出循环")
+                logger.warning("⚠️ [Agent] 没有工具执行结果，退出循环")
                 break
             
-            print(f"✅ [Agent] 工具执行完成，当前消息列表长度: {len(current_messages)}")
-            print(f"🔄 [Agent] 准备进行下一轮工具调用...")
+            logger.debug("✅ [Agent] 工具执行完成，当前消息列表长度: %d", len(current_messages))
+            logger.debug("🔄 [Agent] 准备进行下一轮工具调用...")
         
         if round_count >= max_rounds:
-            print(f"⚠️ [Agent] 达到最大工具调用轮次限制 ({max_rounds} 轮)")
+            logger.warning("⚠️ [Agent] 达到最大工具调用轮次限制 (%d 轮)", max_rounds)
             yield {
                 "type": "error",
                 "content": f"达到最大工具调用轮次限制 ({max_rounds} 轮)，请简化您的请求"
             }
     
+    @staticmethod
+    def _normalize_tool_call(tool_call: Any) -> Optional[Dict[str, Any]]:
+        """规范化单个 tool_call：id/type/function.name/function.arguments 统一转为字符串
+        
+        Args:
+            tool_call: 流式解析或历史消息中的 tool_call
+            
+        Returns:
+            规范化后的新 tool_call；不是字典或缺少 function 字典时返回 None
+        """
+        # 快速路径：字段齐全且都是字符串（流式解析出的 tool_call 几乎都是这样），直接复制
+        try:
+            function = tool_call["function"]
+            tool_call_id = tool_call["id"]
+            tool_call_type = tool_call["type"]
+            function_name = function["name"]
+            function_arguments = function["arguments"]
+        except (KeyError, TypeError):
+            pass
+        else:
+            if (
+                type(tool_call_id) is str
+                and type(tool_call_type) is str
+                and type(function_name) is str
+                and type(function_arguments) is str
+            ):
+                return {
+                    "id": tool_call_id,
+                    "type": tool_call_type,
+                    "function": {
+                        "name": function_name,
+                        "arguments": function_arguments
+                    }
+                }
+        
+        # 慢路径：逐个字段检查并转换类型
+        if not isinstance(tool_call, dict):
+            return None
+        
+        function = tool_call.get("function", {})
+        if not isinstance(function, dict):
+            return None
+        
+        tool_call_id = tool_call.get("id", "")
+        if not isinstance(tool_call_id, str):
+            tool_call_id = str(tool_call_id) if tool_call_id else ""
+        
+        tool_call_type = tool_call.get("type", "function")
+        if not isinstance(tool_call_type, str):
+            tool_call_type = str(tool_call_type) if tool_call_type else "function"
+        
+        function_name = function.get("name", "")
+        if not isinstance(function_name, str):
+            function_name = str(function_name) if function_name else ""
+        
+        # 关键：确保 arguments 是字符串
+        function_arguments = function.get("arguments", "{}")
+        if not isinstance(function_arguments, str):
+            # 如果是字典，转换为 JSON 字符串
+            if isinstance(function_arguments, dict):
+                function_arguments = orjson.dumps(function_arguments).decode()
+            else:
+                function_arguments = str(function_arguments) if function_arguments is not None else "{}"
+        
+        return {
+            "id": tool_call_id,
+            "type": tool_call_type,
+            "function": {
+                "name": function_name,
+                "arguments": function_arguments
+            }
+        }
+    
+    @staticmethod
+    def _clean_tool_message(msg: Dict) -> Optional[Dict]:
+        """tool 消息：缺少 tool_call_id 的会被 API 拒绝，直接丢弃"""
+        if not msg.get("tool_call_id"):
+            return None
+        return msg
+    
+    @staticmethod
+    def _clean_assistant_message(msg: Dict) -> Dict:
+        """assistant 消息：规范化 tool_calls，关键字段为空的跳过，全部无效时移除该字段"""
+        if "tool_calls" not in msg:
+            return msg
+        
+        # 需要修改 tool_calls，复制一份，不影响原消息
+        msg = msg.copy()
+        tool_calls = msg["tool_calls"]
+        if not isinstance(tool_calls, list) or not tool_calls:
+            msg.pop("tool_calls", None)
+            return msg
+        
+        valid_tool_calls = []
+        for tool_call in tool_calls:
+            normalized = AgentService._normalize_tool_call(tool_call)
+            if normalized and normalized["id"] and normalized["function"]["name"]:
+                valid_tool_calls.append(normalized)
+        
+        if valid_tool_calls:
+            msg["tool_calls"] = valid_tool_calls
+            logger.debug("🔍 [Agent] 验证 assistant 消息的 tool_calls: %d 个有效调用", len(valid_tool_calls))
+        else:
+            # 如果没有有效的 tool_calls，移除该字段
+            msg.pop("tool_calls", None)
+            logger.warning("⚠️ [Agent] assistant 消息的 tool_calls 验证后全部无效，已移除")
+        return msg
+    
+    # 按角色分派的消息清理函数，其他角色只需要规范 content
+    _ROLE_CLEANERS = {
+        "tool": _clean_tool_message,
+        "assistant": _clean_assistant_message,
+    }
+    
+    def _clean_llm_message(self, msg: Dict) -> Optional[Dict]:
+        """清理单条消息，确保字段格式符合 LLM API 要求
+        
+        Args:
+            msg: 原始消息（不会被修改）
+            
+        Returns:
+            清理后的消息，只有需要修改时才复制，格式已经正确的消息原样返回（与原消息共享）；
+            无效消息（缺少 tool_call_id 的 tool 消息）返回 None
+        """
+        # 确保 content 字段存在且为字符串
+        content = msg.get("content")
+        if not isinstance(content, str):
+            msg = {**msg, "content": "" if content is None else str(content)}
+        
+        cleaner = self._ROLE_CLEANERS.get(msg.get("role"))
+        return cleaner(msg) if cleaner else msg
+    
+    def _prepare_llm_messages(self, messages: List[Dict]) -> List[Dict]:
+        """批量清理消息，丢弃无效消息"""
+        if MSGSPEC_AVAILABLE:
+            # 快速路径：历史消息通常已经是合法格式，一次校验通过后直接复用原消息
+            try:
+                msgspec.convert(messages, type=_CleanMessages)
+            except msgspec.ValidationError:
+                pass
+            else:
+                return list(messages)
+        
+        prepared = []
+        for msg in messages:
+            cleaned_msg = self._clean_llm_message(msg)
+            if cleaned_msg is not None:
+                prepared.append(cleaned_msg)
+        return prepared
+    
+    def _resolve_chat_llm(self) -> Dict[str, Any]:
+        """解析聊天场景的 LLM 配置（每次查询解析一次，各轮共用）
+        
+        配置未变化时直接返回缓存的结果（所有实例共享），调用方不要修改返回值。
+        
+        Returns:
+            {"api_url": 接口地址, "headers": 请求头, "model": 模型名称}
+        """
+        # get_config 会检查配置文件是否被修改，并在变化时更新 version
+        chat_config = config_service.get_config("chat")
+        cls = type(self)
+        cached = cls._chat_llm_cache
+        if cached is not None and cached[0] == config_service.version:
+            return cached[1]
+        
+        model = chat_config.get("model", config.settings.chat_llm_model)
+        api_key = chat_config.get("api_key", config.settings.chat_llm_binding_api_key)
+        host = chat_config.get("host", config.settings.chat_llm_binding_host)
+        llm_ctx = {
+            "api_url": f"{host}/chat/completions",
+            # 请求头在所有请求间共享，用只读映射防止被意外修改
+            "headers": MappingProxyType({
+                "Authorization": f"Bearer {api_key}",
+                "Content-Type": "application/json"
+            }),
+            "model": model,
+        }
+        cls._chat_llm_cache = (config_service.version, llm_ctx)
+        return llm_ctx
+    
     async def _call_llm_with_tools_round(
         self,
         conversation_id: str,
-        system_prompt: str,
+        system_msg: Dict[str, str],
         messages: List[Dict],
-        functions: List[Dict]
+        functions: List[Dict],
+        llm_ctx: Dict[str, Any]
     ) -> AsyncIterator[Dict[str, Any]]:
         """单轮 LLM 调用（支持 Function Calling）
         
         Args:
             conversation_id: 对话ID
-            system_prompt: 系统提示词
-            messages: 消息列表（包含历史对话和用户查询）
+            system_msg: 系统消息 {"role": "system", "content": 系统提示词}
+            messages: 已清理的消息列表（包含历史对话和用户查询，见 _prepare_llm_messages）
             functions: 工具定义列表
+            llm_ctx: 聊天 LLM 的请求参数（见 _resolve_chat_llm）
             
         Yields:
             流式响应数据
         """
-        # 构建消息列表
-        llm_messages = [
-            {"role": "system", "content": system_prompt}
-        ]
-        
-        # 添加消息（确保所有 content 都是字符串）
-        for msg in messages:
-            cleaned_msg = msg.copy()
-            role = cleaned_msg.get("role")
-            
-            # 确保 content 字段存在且为字符串
-            if "content" not in cleaned_msg:
-                cleaned_msg["content"] = ""
-            elif cleaned_msg.get("content") is None:
-                cleaned_msg["content"] = ""
-            elif not isinstance(cleaned_msg.get("content"), str):
-                cleaned_msg["content"] = str(cleaned_msg["content"])
-            
-            # 对于 tool 消息，确保 tool_call_id 存在
-            if role == "tool":
-                if "tool_call_id" not in cleaned_msg or not cleaned_msg.get("tool_call_id"):
-                    continue
-            
-            # 对于 assistant 消息，如果有 tool_calls，确保格式正确
-            if role == "assistant" and "tool_calls" in cleaned_msg:
-                tool_calls = cleaned_msg.get("tool_calls", [])
-                if not isinstance(tool_calls, list) or not tool_calls:
-                    cleaned_msg.pop("tool_calls", None)
-                else:
-                    # 验证并修复每个 tool_call 的字段类型
-                    valid_tool_calls = []
-                    for tool_call in tool_calls:
-                        if not isinstance(tool_call, dict):
-                            continue
-                        
-                        # 确保 id 是字符串
-                        tool_call_id = tool_call.get("id", "")
-                        if not isinstance(tool_call_id, str):
-                            tool_call_id = str(tool_call_id) if tool_call_id else ""
-                        
-                        # 确保 type 是字符串
-                        tool_call_type = tool_call.get("type", "function")
-                        if not isinstance(tool_call_type, str):
-                            tool_call_type = str(tool_call_type) if tool_call_type else "function"
-                        
-                        # 确保 function 存在且是字典
-                        function = tool_call.get("function", {})
-                        if not isinstance(function, dict):
-                            continue
-                        
-                        # 确保 function.name 是字符串
-                        function_name = function.get("name", "")
-                        if not isinstance(function_name, str):
-                            function_name = str(function_name) if function_name else ""
-                        
-                        # 确保 function.arguments 是字符串（关键修复点）
-                        function_arguments = function.get("arguments", "{}")
-                        if not isinstance(function_arguments, str):
-                            # 如果是字典，转换为 JSON 字符串
-                            if isinstance(function_arguments, dict):
-                                function_arguments = json.dumps(function_arguments, ensure_ascii=False)
-                            else:
-                                function_arguments = str(function_arguments) if function_arguments is not None else "{}"
-                        
-                        # 如果关键字段为空，跳过此 tool_call
-                        if not tool_call_id or not function_name:
-                            continue
-                        
-                        # 构建有效的 tool_call
-                        valid_tool_calls.append({
-                            "id": tool_call_id,
-                            "type": tool_call_type,
-                            "function": {
-                                "name": function_name,
-                                "arguments": function_arguments
-                            }
-                        })
-                    
-                    # 更新 cleaned_msg 中的 tool_calls
-                    if valid_tool_calls:
-                        cleaned_msg["tool_calls"] = valid_tool_calls
-                        print(f"🔍 [Agent] 验证 assistant 消息的 tool_calls: {len(valid_tool_calls)} 个有效调用")
-                        for i, tc in enumerate(valid_tool_calls):
-                            args = tc.get("function", {}).get("arguments", "")
-                            print(f"  验证后工具调用[{i}]: id={tc.get('id')}, name={tc.get('function', {}).get('name')}, arguments类型={type(args).__name__}, arguments长度={len(str(args))}")
-                    else:
-                        # 如果没有有效的 tool_calls，移除该字段
-                        cleaned_msg.pop("tool_calls", None)
-                        print(f"⚠️ [Agent] assistant 消息的 tool_calls 验证后全部无效，已移除")
-            
-            llm_messages.append(cleaned_msg)
-        
-        # 使用聊天场景的配置
-        from app.services.config_service import config_service
-        chat_config = config_service.get_config("chat")
-        binding = chat_config.get("binding", config.settings.chat_llm_binding)
-        model = chat_config.get("model", config.settings.chat_llm_model)
-        api_key = chat_config.get("api_key", config.settings.chat_llm_binding_api_key)
-        host = chat_config.get("host", config.settings.chat_llm_binding_host)
+        # 构建消息列表（messages 已在加入时清理过，这里不再逐条复制）
+        llm_messages = [system_msg, *messages]
         
         # 调用 LLM API
-        api_url = f"{host}/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
+        api_url = llm_ctx["api_url"]
+        headers = llm_ctx["headers"]
         
         payload = {
-            "model": model,
+            "model": llm_ctx["model"],
             "messages": llm_messages,
             "stream": True,
             "temperature": 0.7
@@ -497,161 +645,146 @@ class AgentService:
             payload["tool_choice"] = "auto"
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    api_url,
-                    headers=headers,
-                    json=payload,
-                    timeout=aiohttp.ClientTimeout(total=300)
-                ) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        # 401 错误：API Key 无效
-                        if response.status == 401:
-                            error_msg = "API Key 无效或已过期，请在设置中检查并更新 API Key"
-                        else:
-                            error_msg = f"LLM API 错误: {response.status}, {error_text}"
-                        yield {"type": "error", "content": error_msg}
+            session = await get_http_session()
+            async with session.post(
+                api_url,
+                headers=headers,
+                # 请求体（含完整工具定义）用 C 实现的编码器预先编码，不走 aiohttp 默认的 json.dumps
+                data=encode_json(payload),
+            ) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    # 401 错误：API Key 无效
+                    if response.status == 401:
+                        error_msg = "API Key 无效或已过期，请在设置中检查并更新 API Key"
+                    else:
+                        error_msg = f"LLM API 错误: {response.status}, {error_text}"
+                    yield {"type": "error", "content": error_msg}
+                    return
+                
+                accumulated_content = ""
+                tool_calls_buffer: Dict[int, Dict[str, Any]] = {}  # LLM 返回的 index -> tool_call
+                finished_tool_calls = False
+                yielded_tool_call_indices = set()  # 跟踪已 yield 的 tool_call index
+                # 参数增量按 index 收集成列表，流结束时一次性拼接，避免字符串反复 += 的二次方开销
+                arguments_parts: Dict[int, List[str]] = {}
+                
+                def join_arguments():
+                    # 已 yield 的 tool_call 副本与缓冲共享 function 字典，拼接后调用方拿到的是完整参数
+                    for i, parts in arguments_parts.items():
+                        tool_calls_buffer[i]["function"]["arguments"] = "".join(parts)
+                    arguments_parts.clear()
+                
+                async for chunk in iter_sse_data(response):
+                    if chunk == SSE_DONE:
+                        join_arguments()
+                        # 处理剩余的工具调用（只处理那些还没有 yield 过的）
+                        if tool_calls_buffer and not finished_tool_calls:
+                            finished_tool_calls = True
+                            logger.debug("🔍 [Agent] [DONE] 时，检查 tool_calls_buffer，已 yield 的索引: %s", yielded_tool_call_indices)
+                            for i, tool_call in sorted(tool_calls_buffer.items()):
+                                if tool_call.get("function", {}).get("name") and i not in yielded_tool_call_indices:
+                                    # 确保 tool_call 有有效的 id
+                                    if not tool_call.get("id"):
+                                        tool_call["id"] = _temp_tool_call_id(i)
+                                        logger.warning("⚠️ [Agent] [DONE] 时，tool_call id 为空，生成临时 id: %s", tool_call['id'])
+                                    logger.debug("🚀 [Agent] [DONE] 时 yield tool_call: %s, id: %s, index: %d", tool_call['function']['name'], tool_call.get('id'), i)
+                                    yield {
+                                        "type": "tool_call",
+                                        "tool_call": tool_call
+                                    }
+                                    yielded_tool_call_indices.add(i)
                         return
                     
-                    accumulated_content = ""
-                    tool_calls_buffer = []
-                    finished_tool_calls = False
-                    yielded_tool_call_indices = set()  # 跟踪已 yield 的 tool_call index
-                    
-                    async for line in response.content:
-                        if not line:
-                            continue
-                        
-                        line_text = line.decode('utf-8')
-                        for chunk in line_text.split('\n'):
-                            if not chunk.strip() or chunk.startswith(':'):
-                                continue
-                            
-                            if chunk.startswith('data: '):
-                                chunk = chunk[6:]
+                    try:
+                        data = orjson.loads(chunk)
+                        choices = data.get('choices', [])
+                        if choices:
+                            delta = choices[0].get('delta', {})
                             
-                            if chunk.strip() == '[DONE]':
-                                # 处理剩余的工具调用（只处理那些还没有 yield 过的）
-                                if tool_calls_buffer and not finished_tool_calls:
-                                    finished_tool_calls = True
-                                    import time
-                                    print(f"🔍 [Agent] [DONE] 时，检查 tool_calls_buffer，已 yield 的索引: {yielded_tool_call_indices}")
-                                    for i, tool_call in enumerate(tool_calls_buffer):
-                                        if tool_call.get("function", {}).get("name") and i not in yielded_tool_call_indices:
+                            # 检查是否是工具调用
+                            if 'tool_calls' in delta and delta['tool_calls']:
+                                tool_calls = delta['tool_calls']
+                                for tool_call_delta in tool_calls:
+                                    index = tool_call_delta.get('index', 0)
+                                    
+                                    tool_call = tool_calls_buffer.get(index)
+                                    if tool_call is None:
+                                        tool_call = tool_calls_buffer[index] = {
+                                            "id": "",
+                                            "type": "function",
+                                            "function": {"name": "", "arguments": ""}
+                                        }
+                                    
+                                    # 更新工具调用信息
+                                    if 'id' in tool_call_delta:
+                                        tool_call["id"] = tool_call_delta['id']
+                                        logger.debug("🔍 [Agent] 收到 tool_call id: %s, index: %d", tool_call_delta['id'], index)
+                                    
+                                    if 'function' in tool_call_delta:
+                                        func_delta = tool_call_delta['function']
+                                        arguments_delta = func_delta.get('arguments')
+                                        
+                                        # 常见情况：已 yield 的工具调用只收到参数增量，直接收集，不再做其他检查
+                                        if index in yielded_tool_call_indices:
+                                            if arguments_delta:
+                                                arguments_parts.setdefault(index, []).append(arguments_delta)
+                                            continue
+                                        
+                                        # 处理 name
+                                        if func_delta.get('name'):
+                                            tool_call["function"]["name"] = func_delta['name']
+                                            logger.debug("🔍 [Agent] 收到 tool_call name: %s, index: %d", func_delta['name'], index)
+                                        
+                                        # 处理 arguments（可能 name 和 arguments 同时到达，也可能先于 name 到达）
+                                        if arguments_delta:
+                                            arguments_parts.setdefault(index, []).append(arguments_delta)
+                                        
+                                        # 一旦检测到 tool_call 的 name，立即 yield（每个 tool_call 只 yield 一次）
+                                        if tool_call["function"]["name"]:
                                             # 确保 tool_call 有有效的 id
                                             if not tool_call.get("id"):
-                                                tool_call["id"] = f"call_{i}_{int(time.time() * 1000)}"
-                                                print(f"⚠️ [Agent] [DONE] 时，tool_call id 为空，生成临时 id: {tool_call['id']}")
-                                            print(f"🚀 [Agent] [DONE] 时 yield tool_call: {tool_call['function']['name']}, id: {tool_call.get('id')}, index: {i}")
-                                            yield {
-                                                "type": "tool_call",
-                                                "tool_call": tool_call
-                                            }
-                                            yielded_tool_call_indices.add(i)
-                                return
-                            
-                            try:
-                                data = json.loads(chunk)
-                                choices = data.get('choices', [])
-                                if choices:
-                                    delta = choices[0].get('delta', {})
-                                    
-                                    # 检查是否是工具调用
-                                    if 'tool_calls' in delta and delta['tool_calls']:
-                                        tool_calls = delta['tool_calls']
-                                        for tool_call_delta in tool_calls:
-                                            index = tool_call_delta.get('index', 0)
-                                            
-                                            # 确保 tool_calls_buffer 有足够的元素
-                                            while len(tool_calls_buffer) <= index:
-                                                tool_calls_buffer.append({
-                                                    "id": "",
-                                                    "type": "function",
-                                                    "function": {"name": "", "arguments": ""}
-                                                })
+                                                tool_call["id"] = _temp_tool_call_id(index)
+                                                logger.warning("⚠️ [Agent] tool_call id 为空，生成临时 id: %s", tool_call['id'])
                                             
-                                            tool_call = tool_calls_buffer[index]
+                                            yielded_tool_call_indices.add(index)
+                                            logger.debug("🚀 [Agent] 立即 yield tool_call: %s, id: %s, index: %d", tool_call['function']['name'], tool_call.get('id'), index)
                                             
-                                            # 更新工具调用信息
-                                            if 'id' in tool_call_delta:
-                                                tool_call["id"] = tool_call_delta['id']
-                                                # print(f"🔍 [Agent] 收到 tool_call id: {tool_call_delta['id']}, index: {index}")  # 调试日志已关闭
-                                            
-                                            if 'function' in tool_call_delta:
-                                                func_delta = tool_call_delta['function']
-                                                
-                                                # 处理 name
-                                                if 'name' in func_delta and func_delta['name']:
-                                                    tool_call["function"]["name"] = func_delta['name']
-                                                    print(f"🔍 [Agent] 收到 tool_call name: {func_delta['name']}, index: {index}, 已yield: {index in yielded_tool_call_indices}")
-                                                    
-                                                    # 一旦检测到 tool_call 的 name，立即 yield（如果还没有 yield 过）
-                                                    if index not in yielded_tool_call_indices:
-                                                        # 确保 tool_call 有有效的 id
-                                                        if not tool_call.get("id"):
-                                                            import time
-                                                            tool_call["id"] = f"call_{index}_{int(time.time() * 1000)}"
-                                                            print(f"⚠️ [Agent] tool_call id 为空，生成临时 id: {tool_call['id']}")
-                                                        
-                                                        yielded_tool_call_indices.add(index)
-                                                        print(f"🚀 [Agent] 立即 yield tool_call: {func_delta['name']}, id: {tool_call.get('id')}, index: {index}")
-                                                        
-                                                        # 立即 yield 工具调用，让前端立即显示
-                                                        yield {
-                                                            "type": "tool_call",
-                                                            "tool_call": tool_call.copy()  # 使用副本，避免后续修改影响
-                                                        }
-                                                
-                                                # 处理 arguments（可能 name 和 arguments 同时到达）
-                                                if 'arguments' in func_delta and func_delta['arguments']:
-                                                    tool_call["function"]["arguments"] += func_delta['arguments']
-                                                    # 如果 name 已经设置但还没有 yield（可能 name 和 arguments 同时到达，但 name 先处理）
-                                                    if tool_call.get("function", {}).get("name") and index not in yielded_tool_call_indices:
-                                                        # 确保 tool_call 有有效的 id
-                                                        if not tool_call.get("id"):
-                                                            import time
-                                                            tool_call["id"] = f"call_{index}_{int(time.time() * 1000)}"
-                                                            print(f"⚠️ [Agent] 通过 arguments 检测到 tool_call，id 为空，生成临时 id: {tool_call['id']}")
-                                                        
-                                                        yielded_tool_call_indices.add(index)
-                                                        print(f"🚀 [Agent] 通过 arguments 立即 yield tool_call: {tool_call['function']['name']}, id: {tool_call.get('id')}, index: {index}")
-                                                        
-                                                        # 立即 yield 工具调用，让前端立即显示
-                                                        yield {
-                                                            "type": "tool_call",
-                                                            "tool_call": tool_call.copy()
-                                                        }
-                                    
-                                    # 正常文本内容
-                                    if 'content' in delta:
-                                        content = delta.get('content', '')
-                                        if content:
-                                            accumulated_content += content
+                                            # 立即 yield 工具调用，让前端立即显示
                                             yield {
-                                                "type": "response",
-                                                "content": content
+                                                "type": "tool_call",
+                                                "tool_call": tool_call.copy()  # 使用副本，避免后续修改 id 等字段影响
                                             }
                             
-                            except json.JSONDecodeError:
-                                continue
+                            # 正常文本内容
+                            if 'content' in delta:
+                                content = delta.get('content', '')
+                                if content:
+                                    accumulated_content += content
+                                    yield {
+                                        "type": "response",
+                                        "content": content
+                                    }
                     
-                    # 流式结束后，处理工具调用（只处理那些还没有 yield 过的）
-                    if tool_calls_buffer and not finished_tool_calls:
-                        finished_tool_calls = True
-                        import time
-                        for i, tool_call in enumerate(tool_calls_buffer):
-                            if tool_call.get("function", {}).get("name") and i not in yielded_tool_call_indices:
-                                # 确保 tool_call 有有效的 id
-                                if not tool_call.get("id"):
-                                    tool_call["id"] = f"call_{i}_{int(time.time() * 1000)}"
-                                    print(f"⚠️ [Agent] 流式响应结束时，tool_call id 为空，生成临时 id: {tool_call['id']}")
-                                yield {
-                                    "type": "tool_call",
-                                    "tool_call": tool_call
-                                }
-                                yielded_tool_call_indices.add(i)
-        
+                    except json.JSONDecodeError:
+                        continue
+                
+                # 流式结束后，处理工具调用（只处理那些还没有 yield 过的）
+                join_arguments()
+                if tool_calls_buffer and not finished_tool_calls:
+                    finished_tool_calls = True
+                    for i, tool_call in sorted(tool_calls_buffer.items()):
+                        if tool_call.get("function", {}).get("name") and i not in yielded_tool_call_indices:
+                            # 确保 tool_call 有有效的 id
+                            if not tool_call.get("id"):
+                                tool_call["id"] = _temp_tool_call_id(i)
+                                logger.warning("⚠️ [Agent] 流式响应结束时，tool_call id 为空，生成临时 id: %s", tool_call['id'])
+                            yield {
+                                "type": "tool_call",
+                                "tool_call": tool_call
+                            }
+                            yielded_tool_call_indices.add(i)
+    
         except Exception as e:
             yield {
                 "type": "error",
@@ -679,9 +812,10 @@ class AgentService:
         # 调用新的单轮方法
         async for chunk in self._call_llm_with_tools_round(
             conversation_id,
-            system_prompt,
-            messages,
-            functions
+            {"role": "system", "content": system_prompt},
+            self._prepare_llm_messages(messages),
+            functions,
+            self._resolve_chat_llm()
         ):
             yield chunk
     
@@ -693,267 +827,93 @@ class AgentService:
         conversation_history: Optional[List[Dict]],
         user_query: str,
         api_url: Optional[str] = None,
-        headers: Optional[Dict[str, str]] = None
+        headers: Optional[Mapping[str, str]] = None
     ) -> AsyncIterator[Dict[str, Any]]:
         """基于工具执行结果生成最终回答"""
-        print(f"🔄 [Agent] 开始生成最终回答，工具结果数量: {len(tool_results)}")
+        logger.debug("🔄 [Agent] 开始生成最终回答，工具结果数量: %d", len(tool_results))
         
-        # 使用聊天场景的配置
-        from app.services.config_service import config_service
-        chat_config = config_service.get_config("chat")
-        binding = chat_config.get("binding", config.settings.chat_llm_binding)
-        model = chat_config.get("model", config.settings.chat_llm_model)
-        api_key = chat_config.get("api_key", config.settings.chat_llm_binding_api_key)
-        host = chat_config.get("host", config.settings.chat_llm_binding_host)
-        
-        # 如果未提供 api_url 和 headers，使用聊天配置
-        if not api_url:
-            api_url = f"{host}/chat/completions"
-        if not headers:
-            headers = {
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            }
+        # 使用聊天场景的配置（未提供 api_url 和 headers 时使用）
+        llm_ctx = self._resolve_chat_llm()
+        model = llm_ctx["model"]
+        api_url = api_url or llm_ctx["api_url"]
+        headers = headers or llm_ctx["headers"]
 
-        # 1. 将工具结果格式化为 LLM 需要的 tool 消息
-        tool_messages: List[Dict[str, Any]] = []
-        tool_result_index = 0
-        
-        for i, tool_call in enumerate(tool_calls_buffer):
-            func = tool_call.get("function", {})
-            if not func.get("name"):
-                continue
-                                
-            tool_call_id = tool_call.get("id") or f"call_{i}"
-            if not isinstance(tool_call_id, str):
-                tool_call_id = str(tool_call_id)
-                                
-            if tool_result_index < len(tool_results):
-                tool_result = tool_results[tool_result_index]
-                result_data = tool_result.get("result", {})
-                result_content = self._format_tool_result(result_data)
-                if not isinstance(result_content, str):
-                    result_content = str(result_content) if result_content is not None else ""
-                
-                tool_messages.append(
-                    {
-                        "role": "tool",
-                        "content": result_content,
-                        "tool_call_id": tool_call_id,
-                    }
-                )
-                tool_result_index += 1
-                            
-        # 2. 构建完整的消息历史（system + 历史对话 + 当前 user）
-        complete_messages: List[Dict[str, Any]] = [
-            {"role": "system", "content": system_prompt}
-        ]
-                            
-        if conversation_history:
-            for msg in conversation_history:
-                cleaned_msg = msg.copy()
-                role = cleaned_msg.get("role")
-                
-                # 确保 content 字段存在且为字符串
-                content = cleaned_msg.get("content")
-                if content is None:
-                    cleaned_msg["content"] = ""
-                elif not isinstance(content, str):
-                    cleaned_msg["content"] = str(content)
-                
-                # 对于 tool 消息，确保 tool_call_id 存在且有效
-                if role == "tool":
-                    tool_call_id = cleaned_msg.get("tool_call_id")
-                    if tool_call_id is None or (
-                        isinstance(tool_call_id, str) and not tool_call_id.strip()
-                    ):
-                        print(
-                            "⚠️ [Agent] 警告: 历史对话中的 tool 消息缺少或包含空的 tool_call_id，跳过此消息"
-                        )
-                        continue
-                
-                # 对于 assistant 消息，如果有 tool_calls，确保格式正确
-                if role == "assistant" and "tool_calls" in cleaned_msg:
-                    tool_calls = cleaned_msg.get("tool_calls", [])
-                    if not isinstance(tool_calls, list):
-                        print(
-                            "⚠️ [Agent] 警告: 历史对话中的 assistant 消息的 tool_calls 不是列表，移除"
-                        )
-                        cleaned_msg.pop("tool_calls", None)
-                    else:
-                        valid_tool_calls: List[Dict[str, Any]] = []
-                        for tc in tool_calls:
-                            if not isinstance(tc, dict):
-                                continue
-                            if not tc.get("id"):
-                                print(
-                                    "⚠️ [Agent] 警告: 历史对话中的 tool_call 缺少 id，跳过"
-                                )
-                                continue
-                            if tc.get("type") != "function":
-                                print(
-                                    "⚠️ [Agent] 警告: 历史对话中的 tool_call type 不正确，跳过"
-                                )
-                                continue
-                            func = tc.get("function", {})
-                            if not func.get("name"):
-                                print(
-                                    "⚠️ [Agent] 警告: 历史对话中的 tool_call function.name 缺失，跳过"
-                                )
-                                continue
-                            if "arguments" not in func:
-                                print(
-                                    "⚠️ [Agent] 警告: 历史对话中的 tool_call function.arguments 缺失，跳过"
-                                )
-                                continue
-                            valid_tool_calls.append(tc)
-                        cleaned_msg["tool_calls"] = valid_tool_calls
-                        if not valid_tool_calls:
-                            cleaned_msg.pop("tool_calls", None)
-                
-                complete_messages.append(cleaned_msg)
-                            
-        # 添加当前用户查询
-        complete_messages.append({"role": "user", "content": user_query})
-                            
-        # 3. 构建 assistant 的 tool_calls 消息
+        # 1. 一次遍历规范化 tool_calls，同时生成对应的 tool 结果消息
+        # 工具并发执行，结果按完成顺序返回，因此按 tool_call_id 而不是位置匹配
+        results_by_id = {
+            result["tool_call_id"]: result
+            for result in tool_results
+            if result.get("tool_call_id")
+        }
         tool_calls_list: List[Dict[str, Any]] = []
+        tool_messages: List[Dict[str, Any]] = []
         for i, tool_call in enumerate(tool_calls_buffer):
-            func = tool_call.get("function", {})
-            if not func.get("name"):
+            normalized = self._normalize_tool_call(tool_call)
+            if normalized is None or not normalized["function"]["name"]:
                 continue
-            
-            tool_call_id = tool_call.get("id") or f"call_{i}"
-            if not isinstance(tool_call_id, str):
-                tool_call_id = str(tool_call_id)
-            
-            function_name = func.get("name", "")
-            if not isinstance(function_name, str):
-                function_name = str(function_name)
-            
-            function_arguments = func.get("arguments", "{}")
-            if not isinstance(function_arguments, str):
-                function_arguments = (
-                    str(function_arguments) if function_arguments is not None else "{}"
-                )
+            tool_result = results_by_id.get(normalized["id"])
+            normalized["id"] = normalized["id"] or f"call_{i}"
+            normalized["type"] = "function"
+            normalized["function"]["arguments"] = normalized["function"]["arguments"] or "{}"
+            tool_calls_list.append(normalized)
 
-            if not tool_call_id:
-                import time
-
-                tool_call_id = f"call_{i}_{int(time.time() * 1000)}"
-            if not function_name:
-                print("    ⚠️ 警告: function_name 为空，跳过此 tool_call")
+            if tool_result is None:
                 continue
-            if not function_arguments:
-                function_arguments = "{}"
-            
-            tool_calls_list.append(
+            if tool_result.get("type") == "tool_error":
+                result_content = f"工具执行失败: {tool_result.get('message', '')}"
+            else:
+                result_content = self._format_tool_result(tool_result.get("result", {}))
+            tool_messages.append(
                 {
-                    "id": tool_call_id,
-                    "type": "function",
-                    "function": {
-                        "name": function_name,
-                        "arguments": function_arguments,
-                    },
+                    "role": "tool",
+                    "content": result_content,
+                    "tool_call_id": normalized["id"],
                 }
             )
-        
+
+        # 2. 构建完整的消息历史：system + 历史对话 + 当前 user + assistant(tool_calls) + tool 结果
+        # 历史消息由 _prepare_llm_messages 清理，这里构建的消息已经是合法格式，无需再校验一遍
+        complete_messages: List[Dict[str, Any]] = [
+            {"role": "system", "content": system_prompt},
+            *self._prepare_llm_messages(conversation_history or []),
+            {"role": "user", "content": user_query},
+        ]
         if tool_calls_list:
-            assistant_message = {
-                "role": "assistant",
-                "content": "",
-                "tool_calls": tool_calls_list,
-            }
-            complete_messages.append(assistant_message)
+            complete_messages.append(
+                {
+                    "role": "assistant",
+                    "content": "",
+                    "tool_calls": tool_calls_list,
+                }
+            )
         else:
-            print("    ⚠️ 警告: tool_calls_list 为空，不添加 assistant 消息")
-                            
-        # 4. 添加工具结果消息
+            logger.warning("⚠️ [Agent] tool_calls_list 为空，不添加 assistant 消息")
         complete_messages.extend(tool_messages)
         
-        # 5. 打印调试信息（仅显示最后几条）
-        print(f"📝 [Agent] 构建的消息历史（共 {len(complete_messages)} 条）:")
-        start_index = max(0, len(complete_messages) - 3)
-        for i, msg in enumerate(complete_messages[start_index:], start=start_index):
-            role = msg.get("role")
-            content = msg.get("content", "")
-            if role == "tool":
-                tool_call_id = msg.get("tool_call_id", "")
-                print(
-                    f"  [{i}] tool: content_type={type(content).__name__}, "
-                    f"tool_call_id={tool_call_id}, content_preview={str(content)[:100]}..."
-                )
-            elif role == "assistant":
-                tool_calls = msg.get("tool_calls", [])
-                print(
-                    f"  [{i}] assistant: content='{str(content)[:50]}...', tool_calls={len(tool_calls)}"
-                )
-                for j, tc in enumerate(tool_calls):
-                    tc_id = tc.get("id")
-                    tc_type = tc.get("type")
-                    func = tc.get("function", {})
-                    func_name = func.get("name")
-                    func_args = func.get("arguments")
-                    print(
-                        f"    tool_call[{j}]: id={tc_id}, type={tc_type}, "
-                        f"name={func_name}, args_type={type(func_args).__name__}"
-                    )
-            else:
-                print(
-                    f"  [{i}] {role}: content_type={type(content).__name__}, "
-                    f"content_preview={str(content)[:50]}..."
-                )
-        
-        # 6. 确保所有消息都有必需的字段
-        validated_messages: List[Dict[str, Any]] = []
-        for msg in complete_messages:
-            role = msg.get("role")
-            if role == "assistant" and "tool_calls" in msg:
-                if "content" not in msg:
-                    msg["content"] = ""
-                tool_calls = msg.get("tool_calls", [])
-                if not tool_calls:
-                    print("    ⚠️ 警告: assistant 消息的 tool_calls 为空")
-                else:
-                    for tc in tool_calls:
-                        if not tc.get("id"):
-                            print("    ⚠️ 警告: tool_call 缺少 id")
-                        if tc.get("type") != "function":
-                            print(
-                                f"    ⚠️ 警告: tool_call type 不正确: {tc.get('type')}"
-                            )
-                        func = tc.get("function", {})
-                        if not func.get("name"):
-                            print("    ⚠️ 警告: tool_call function.name 为空")
-                        if "arguments" not in func:
-                            print("    ⚠️ 警告: tool_call function.arguments 缺失")
-            elif role == "tool":
-                if "content" not in msg:
-                    msg["content"] = ""
-                tool_call_id = msg.get("tool_call_id")
-                if "tool_call_id" not in msg:
-                    print("    ⚠️ 警告: tool 消息缺少 tool_call_id 字段")
-                elif not tool_call_id or (
-                    isinstance(tool_call_id, str) and not tool_call_id.strip()
-                ):
-                    print(
-                        f"    ⚠️ 警告: tool 消息的 tool_call_id 为空或无效: {repr(tool_call_id)}"
+        # 3. 打印调试信息（仅显示最后几条，只在 DEBUG 级别格式化）
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("📝 [Agent] 构建的消息历史（共 %d 条）:", len(complete_messages))
+            start_index = max(0, len(complete_messages) - 3)
+            for i, msg in enumerate(complete_messages[start_index:], start=start_index):
+                role = msg.get("role")
+                content = msg.get("content", "")
+                if role == "tool":
+                    logger.debug(
+                        "  [%d] tool: tool_call_id=%s, content_preview=%.100s...",
+                        i, msg.get("tool_call_id", ""), content
                     )
-                    print("    ⚠️ 警告: 跳过无效的 tool 消息")
-                    continue
+                elif role == "assistant":
+                    tool_calls = msg.get("tool_calls", [])
+                    logger.debug("  [%d] assistant: content='%.50s...', tool_calls=%d", i, content, len(tool_calls))
+                    for j, tc in enumerate(tool_calls):
+                        logger.debug(
+                            "    tool_call[%d]: id=%s, type=%s, name=%s",
+                            j, tc["id"], tc["type"], tc["function"]["name"]
+                        )
                 else:
-                    if not isinstance(tool_call_id, str):
-                        msg["tool_call_id"] = str(tool_call_id)
-                        print("    ✅ 修复: tool_call_id 类型已转换为字符串")
-            else:
-                if "content" not in msg:
-                    msg["content"] = ""
-            
-            validated_messages.append(msg)
+                    logger.debug("  [%d] %s: content_preview=%.50s...", i, role, content)
         
-        complete_messages = validated_messages
-                            
-        # 7. 构建最终 payload
+        # 4. 构建最终 payload
         final_payload = {
             "model": model,
             "messages": complete_messages,
@@ -961,76 +921,60 @@ class AgentService:
             "temperature": 0.7,
         }
         
-        print("📦 [Agent] 最终 payload 结构:")
-        print(f"  - model: {final_payload.get('model')}")
-        print(f"  - messages count: {len(final_payload.get('messages', []))}")
-        print(f"  - stream: {final_payload.get('stream')}")
-        print(f"  - temperature: {final_payload.get('temperature')}")
-        print(f"  - has tools: {'tools' in final_payload}")
-        
-        print("🚀 [Agent] 二次调用 LLM 生成最终回答...")
-                            
-        # 8. 流式调用 LLM 生成最终回答
-        async with aiohttp.ClientSession() as final_session:
-            async with final_session.post(
-                api_url,
-                headers=headers,
-                json=final_payload,
-                timeout=aiohttp.ClientTimeout(total=300),
-            ) as final_response:
-                print(f"📡 [Agent] LLM 响应状态: {final_response.status}")
-                if final_response.status == 200:
-                    content_received = False
-                    async for line in final_response.content:
-                        if not line:
-                            continue
-                        
-                        line_text = line.decode("utf-8")
-                        for chunk in line_text.split("\n"):
-                            if not chunk.strip() or chunk.startswith(":"):
-                                continue
+        logger.debug(
+            "🚀 [Agent] 二次调用 LLM 生成最终回答: model=%s, messages=%d",
+            model, len(complete_messages)
+        )
                             
-                            if chunk.startswith("data: "):
-                                chunk = chunk[6:]
-                            
-                            if chunk.strip() == "[DONE]":
-                                return
-                            
-                            try:
-                                data = json.loads(chunk)
-                            except json.JSONDecodeError:
-                                continue
+        # 5. 流式调用 LLM 生成最终回答
+        final_session = await get_http_session()
+        async with final_session.post(
+            api_url,
+            headers=headers,
+            data=encode_json(final_payload),
+        ) as final_response:
+            logger.debug("📡 [Agent] LLM 响应状态: %d", final_response.status)
+            if final_response.status == 200:
+                content_received = False
+                async for chunk in iter_sse_data(final_response):
+                    if chunk == SSE_DONE:
+                        return
+                    
+                    try:
+                        data = orjson.loads(chunk)
+                    except orjson.JSONDecodeError:
+                        continue
 
-                            choices = data.get("choices", [])
-                            if not choices:
-                                continue
+                    choices = data.get("choices", [])
+                    if not choices:
+                        continue
 
-                            delta = choices[0].get("delta", {})
-                            if "content" not in delta:
-                                continue
+                    delta = choices[0].get("delta", {})
+                    if "content" not in delta:
+                        continue
 
-                            content = delta.get("content", "")
-                            if not content:
-                                continue
+                    content = delta.get("content", "")
+                    if not content:
+                        continue
 
-                            if not content_received:
-                                print("✅ [Agent] 开始接收 LLM 最终回答内容")
-                                content_received = True
+                    if not content_received:
+                        logger.debug("✅ [Agent] 开始接收 LLM 最终回答内容")
+                        content_received = True
 
-                            yield {
-                                "type": "response",
-                                "content": content,
-                            }
+                    yield {
+                        "type": "response",
+                        "content": content,
+                    }
+            else:
+                error_text = await final_response.text()
+                logger.error("❌ [Agent] LLM 最终回答生成失败: %d, %s", final_response.status, error_text)
+                # 401 错误：API Key 无效
+                if final_response.status == 401:
+                    error_msg = "API Key 无效或已过期，请在设置中检查并更新 API Key"
                 else:
-                    error_text = await final_response.text()
-                    print(f"❌ [Agent] LLM 最终回答生成失败: {final_response.status}, {error_text}")
-                    # 401 错误：API Key 无效
-                    if final_response.status == 401:
-                        error_msg = "API Key 无效或已过期，请在设置中检查并更新 API Key"
-                    else:
-                        error_msg = f"LLM API 错误: {final_response.status}, {error_text}"
-                    yield {"type": "error", "content": error_msg}
-    
+                    error_msg = f"LLM API 错误: {final_response.status}, {error_text}"
+                yield {"type": "error", "content": error_msg}
+
     def _format_tool_result(self, result_data: Dict[str, Any]) -> str:
         """格式化工具执行结果为字符串，用于发送回 LLM
         
@@ -1078,57 +1022,96 @@ class AgentService:
         
         else:
             # 其他状态
-            return f"执行状态：{status}\n结果：{json.dumps(result_data, ensure_ascii=False)}"
+            result_json = orjson.dumps(result_data, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+            return f"执行状态：{status}\n结果：{result_json}"
     
     async def _execute_tool_calls(
         self,
         tool_calls: List[Dict],
         conversation_id: str
     ) -> AsyncIterator[Dict[str, Any]]:
-        """执行工具调用"""
+        """并发执行同一轮中的工具调用，按完成顺序返回结果
+
+        每个结果都带有对应的 tool_call_id，调用方按 id 而不是顺序匹配工具调用。
+        不能并发的工具（concurrency_safe=False）共用一把锁，按调用顺序依次执行。
+        """
+        pending = []
+        serial_lock = asyncio.Lock()
         for tool_call in tool_calls:
             if not tool_call.get("function", {}).get("name"):
                 continue
-            
+
+            tool_call_id = tool_call.get("id", "")
             tool_name = tool_call["function"]["name"]
             arguments_str = tool_call["function"].get("arguments", "{}")
-            
+
             # 如果参数为空，使用空字典
             if not arguments_str or arguments_str.strip() == "":
                 arguments_str = "{}"
-            
+
             try:
                 # 解析参数
                 arguments = json.loads(arguments_str)
             except json.JSONDecodeError as e:
                 yield {
                     "type": "tool_error",
+                    "tool_call_id": tool_call_id,
                     "tool_name": tool_name,
                     "message": f"工具参数解析失败: {arguments_str}, 错误: {str(e)}"
                 }
                 continue
-            
-            # 执行工具
+
+            tool = self.tool_registry.get_tool(tool_name)
+            lock = serial_lock if tool is not None and not tool.concurrency_safe else None
+            pending.append(asyncio.create_task(
+                self._execute_tool_call(tool_call_id, tool_name, arguments, conversation_id, lock)
+            ))
+
+        try:
+            # 只读工具之间相互独立（RAG 查询、文件读取等 I/O），总耗时取决于最慢的一个
+            for next_done in asyncio.as_completed(pending):
+                tool_call_id, tool_name, arguments, result = await next_done
+
+                # 返回工具执行结果（包含参数信息，供前端显示）
+                yield {
+                    "type": "tool_result",
+                    "tool_call_id": tool_call_id,
+                    "tool_name": tool_name,
+                    "arguments": arguments,  # 添加参数信息
+                    "result": result
+                }
+
+                # 如果是思维脑图工具，还需要流式返回思维脑图内容
+                if tool_name == "generate_mindmap" and result.get("status") == "success":
+                    mindmap_content = result.get("result", {}).get("mindmap_content")
+                    if mindmap_content:
+                        yield {
+                            "type": "mindmap_content",
+                            "content": mindmap_content
+                        }
+        finally:
+            # 客户端断开等原因提前结束时，取消尚未完成的工具调用，
+            # 并等待它们真正结束（释放串行锁、取走异常，避免 "Task exception was never retrieved"）
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _execute_tool_call(
+        self,
+        tool_call_id: str,
+        tool_name: str,
+        arguments: Dict[str, Any],
+        conversation_id: str,
+        lock: Optional[asyncio.Lock] = None
+    ) -> Tuple[str, str, Dict[str, Any], Dict[str, Any]]:
+        """执行单个工具调用，返回 (tool_call_id, tool_name, arguments, result)
+
+        传入 lock 时持有锁执行（任务按创建顺序获取锁，即按调用顺序依次执行）
+        """
+        async with lock if lock is not None else nullcontext():
             result = await self.tool_executor.execute(
                 tool_name,
                 arguments,
                 conversation_id
             )
-            
-            # 返回工具执行结果（包含参数信息，供前端显示）
-            yield {
-                "type": "tool_result",
-                "tool_name": tool_name,
-                "arguments": arguments,  # 添加参数信息
-                "result": result
-            }
-            
-            # 如果是思维脑图工具，还需要流式返回思维脑图内容
-            if tool_name == "generate_mindmap" and result.get("status") == "success":
-                mindmap_content = result.get("result", {}).get("mindmap_content")
-                if mindmap_content:
-                    yield {
-                        "type": "mindmap_content",
-                        "content": mindmap_content
-                    }
-
+        return tool_call_id, tool_name, arguments, result
@@ -32,9 +32,12 @@
 """
 import time
 import asyncio
+import logging
 from typing import Dict, Any, List, Optional
 from app.services.agent.tool_registry import ToolRegistry, ToolDefinition
 
+logger = logging.getLogger(__name__)
+
 
 class ToolExecutor:
     """工具执行器"""
@@ -90,10 +93,19 @@ class ToolExecutor:
                 "tool_name": tool_name
             }
         
+        # 通过检查后立即记录本次调用：同一轮的工具调用是并发执行的，
+        # 如果等执行完成才记录，同时发起的调用都会通过速率限制检查
+        record = {
+            "tool_name": tool_name,
+            "parameters": parameters,
+            "result": None,
+            "timestamp": time.time()
+        }
+        self.execution_history.append(record)
+        
         # 5. 执行工具
         try:
-            
-            print(f"🔧 执行工具: {tool_name}, 参数: {parameters}")
+            logger.debug("🔧 执行工具: %s, 参数: %s", tool_name, parameters)
             
             # 调用工具处理函数
             if asyncio.iscoroutinefunction(tool.handler):
@@ -101,15 +113,10 @@ class ToolExecutor:
             else:
                 result = tool.handler(**parameters)
             
-            # 5. 记录执行历史
-            self.execution_history.append({
-                "tool_name": tool_name,
-                "parameters": parameters,
-                "result": result,
-                "timestamp": time.time()
-            })
+            # 6. 记录执行结果
+            record["result"] = result
             
-            print(f"✅ 工具执行成功: {tool_name}")
+            logger.debug("✅ 工具执行成功: %s", tool_name)
             
             return {
                 "status": "success",
@@ -119,7 +126,7 @@ class ToolExecutor:
         
         except Exception as e:
             error_msg = f"工具执行失败: {str(e)}"
-            print(f"❌ {error_msg}")
+            logger.warning("❌ %s", error_msg)
             return {
                 "status": "error",
                 "message": error_msg,
@@ -39,10 +39,13 @@
     - conversation_id 参数会自动从 Function Calling 格式中排除
     - 工具参数必须符合 JSON Schema 规范
 """
+import logging
 from typing import Dict, List, Callable, Any, Optional
 from pydantic import BaseModel, Field
 from enum import Enum
 
+logger = logging.getLogger(__name__)
+
 
 class ToolParameter(BaseModel):
     """工具参数定义（JSON Schema 格式）"""
@@ -63,6 +66,10 @@ class ToolDefinition(BaseModel):
     category: str = Field(default="general", description="工具类别")
     requires_auth: bool = Field(default=False, description="是否需要认证")
     rate_limit: Optional[int] = Field(default=None, description="速率限制（每分钟调用次数）")
+    concurrency_safe: bool = Field(
+        default=True,
+        description="能否与同一轮的其他工具调用并发执行（会修改共享文件等状态的工具设为 False）"
+    )
 
 
 class ToolRegistry:
@@ -70,19 +77,25 @@ class ToolRegistry:
     
     def __init__(self):
         self.tools: Dict[str, ToolDefinition] = {}
+        # 工具集合版本号，注册/注销时递增，供调用方判断缓存是否失效
+        self.version = 0
+        # Function Calling 格式缓存：(版本号, 工具列表)
+        self._functions_cache: Optional[tuple] = None
     
     def register(self, tool: ToolDefinition):
         """注册工具"""
         if tool.name in self.tools:
             raise ValueError(f"工具 {tool.name} 已存在")
         self.tools[tool.name] = tool
-        print(f"✅ 工具已注册: {tool.name} ({tool.category})")
+        self.version += 1
+        logger.debug("✅ 工具已注册: %s (%s)", tool.name, tool.category)
     
     def unregister(self, tool_name: str):
         """注销工具"""
         if tool_name in self.tools:
             del self.tools[tool_name]
-            print(f"🗑️ 工具已注销: {tool_name}")
+            self.version += 1
+            logger.debug("🗑️ 工具已注销: %s", tool_name)
     
     def get_tool(self, name: str) -> Optional[ToolDefinition]:
         """获取工具"""
@@ -95,10 +108,18 @@ class ToolRegistry:
         return list(self.tools.values())
     
     def to_function_calling_format(self) -> List[Dict]:
-        """转换为 OpenAI Function Calling 格式
+        """转换为 OpenAI Function Calling 格式（工具集合未变化时返回缓存，调用方不应修改返回值）
         
         注意：conversation_id 参数会被自动排除，因为它在执行时会自动注入
         """
+        if self._functions_cache is not None and self._functions_cache[0] == self.version:
+            return self._functions_cache[1]
+        functions = self._build_function_calling_format()
+        self._functions_cache = (self.version, functions)
+        return functions
+    
+    def _build_function_calling_format(self) -> List[Dict]:
+        """构建 OpenAI Function Calling 格式的工具列表"""
         functions = []
         for tool in self.tools.values():
             # 构建参数属性
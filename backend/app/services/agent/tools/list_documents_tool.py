@@ -34,7 +34,7 @@
 """
 from typing import Dict, Any
 from app.services.agent.tool_registry import ToolDefinition, ToolParameter
-from app.services.document_service import DocumentService
+from app.services.document_service import get_document_service
 
 
 async def list_documents_handler(
@@ -49,7 +49,7 @@ async def list_documents_handler(
         工具执行结果
     """
     try:
-        doc_service = DocumentService()
+        doc_service = get_document_service()
         
         # 获取文档列表
         documents = doc_service.list_documents(conversation_id)
@@ -31,12 +31,17 @@
     用户输入："为文档1和文档2生成思维导图"
     LLM 调用：generate_mindmap({"document_ids": ["doc1", "doc2"]})
 """
+import logging
+from pathlib import Path
 from typing import List, Optional, Dict, Any
+import app.config as config
 from app.services.agent.tool_registry import ToolDefinition, ToolParameter
 from app.services.mindmap_service import MindMapService
-from app.services.document_service import DocumentService
+from app.services.document_service import get_document_service
 from app.services.conversation_service import ConversationService
 
+logger = logging.getLogger(__name__)
+
 
 async def generate_mindmap_handler(
     conversation_id: str,
@@ -53,7 +58,7 @@ async def generate_mindmap_handler(
     """
     try:
         mindmap_service = MindMapService()
-        doc_service = DocumentService()
+        doc_service = get_document_service()
         conv_service = ConversationService()
         
         # 获取对话信息
@@ -102,7 +107,7 @@ async def generate_mindmap_handler(
         # 按文件名排序（确保生成顺序一致）
         doc_list.sort(key=lambda x: x["filename"])
         total_docs = len(doc_list)
-        print(f"📋 [思维脑图] 准备生成思维脑图，共 {total_docs} 个文档（已按文件名排序）")
+        logger.debug("📋 [思维脑图] 准备生成思维脑图，共 %d 个文档（已按文件名排序）", total_docs)
 
         # 每次新的思维脑图生成请求，先清空当前对话的脑图文件，再重新逐个追加
         mindmap_service.reset_mindmap(conversation_id)
@@ -117,7 +122,7 @@ async def generate_mindmap_handler(
             document_filenames.append(doc_filename)
             
             # 显示进度
-            print(f"🔄 [思维脑图] 正在处理第 {i}/{total_docs} 个文档: {doc_filename}")
+            logger.debug("🔄 [思维脑图] 正在处理第 %d/%d 个文档: %s", i, total_docs, doc_filename)
             
             # 所有文档都只生成当前文档的脑图，不合并已有脑图
             # 合并通过 _save_mindmap 的文件级追加实现
@@ -132,14 +137,11 @@ async def generate_mindmap_handler(
             ):
                 accumulated_content += chunk
             
-            print(f"✅ [思维脑图] 已完成第 {i}/{total_docs} 个文档: {doc_filename}")
+            logger.debug("✅ [思维脑图] 已完成第 %d/%d 个文档: %s", i, total_docs, doc_filename)
         
-        print(f"🎉 [思维脑图] 所有文档处理完成，共 {total_docs} 个文档")
+        logger.debug("🎉 [思维脑图] 所有文档处理完成，共 %d 个文档", total_docs)
         
         # 提取最终保存的思维脑图内容
-        from pathlib import Path
-        import app.config as config
-        
         mindmap_dir = Path(config.settings.data_dir) / "mindmaps"
         mindmap_file = mindmap_dir / f"{conversation_id}.md"
         
@@ -192,6 +194,8 @@ MINDMAP_TOOL = ToolDefinition(
     },
     handler=generate_mindmap_handler,
     category="mindmap",
-    rate_limit=5  # 每分钟最多5次
+    rate_limit=5,  # 每分钟最多5次
+    # 会重置并追加写入对话的思维导图文件，同一轮的多次调用必须依次执行
+    concurrency_safe=False
 )
 
@@ -44,8 +44,9 @@
     - 查询结果会包含从知识图谱中检索到的相关实体、关系和文本块
 """
 from typing import Dict, Any
+from lightrag import QueryParam
 from app.services.agent.tool_registry import ToolDefinition, ToolParameter
-from app.services.graph_service import GraphService
+from app.services.graph_service import get_graph_service
 
 
 async def query_knowledge_graph_handler(
@@ -64,7 +65,7 @@ async def query_knowledge_graph_handler(
         工具执行结果
     """
     try:
-        service = GraphService()
+        service = get_graph_service()
         
         # 验证查询模式
         valid_modes = ["naive", "local", "global", "mix"]
@@ -85,10 +86,7 @@ async def query_knowledge_graph_handler(
         
         # 执行查询 - 使用 aquery_data 获取原始数据，而不是 LLM 生成的回答
         # 这样 Agent 的 LLM 可以基于原始数据生成更合适的回答
-        from app.services.lightrag_service import LightRAGService
-        lightrag_service = LightRAGService()
-        lightrag = await lightrag_service.get_lightrag_for_conversation(conversation_id)
-        from lightrag import QueryParam
+        lightrag = await service.lightrag_service.get_lightrag_for_conversation(conversation_id)
         param = QueryParam(mode=mode)
         
         # 使用 aquery_data 获取原始查询数据（实体、关系、文本块等）
@@ -0,0 +1,78 @@
+"""
+响应缓存服务
+
+进程内的 cache-aside 缓存，存储已编码的响应字节：
+- 按 key 读写，带过期时间（TTL）
+- 按前缀失效（如某个对话的全部图谱缓存）
+- 统计命中率
+"""
+import time
+from typing import Dict, Optional, Tuple
+
+# 默认缓存有效期（秒）
+DEFAULT_TTL_SECONDS = 300
+
+# 最多缓存条目数，超出后淘汰最早写入的条目
+MAX_ENTRIES = 1024
+
+
+class ResponseCache:
+    """已编码响应的进程内缓存"""
+
+    def __init__(self, ttl_seconds: int = DEFAULT_TTL_SECONDS, max_entries: int = MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: Dict[str, Tuple[float, bytes]] = {}
+        self._hits = 0
+        self._misses = 0
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        """读取缓存，未命中或已过期返回 None"""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                self._entries.pop(key, None)
+            self._misses += 1
+            return None
+        self._hits += 1
+        return entry[1]
+
+    def set_bytes(self, key: str, value: bytes, ttl_seconds: Optional[int] = None):
+        """写入缓存"""
+        expires_at = time.monotonic() + (ttl_seconds or self.ttl_seconds)
+        self._entries.pop(key, None)
+        self._entries[key] = (expires_at, value)
+        while len(self._entries) > self.max_entries:
+            # dict 保持插入顺序，淘汰最早写入的条目
+            self._entries.pop(next(iter(self._entries)))
+
+    def invalidate(self, prefix: str) -> int:
+        """删除所有以 prefix 开头的缓存，返回删除数量"""
+        keys = [key for key in self._entries if key.startswith(prefix)]
+        for key in keys:
+            self._entries.pop(key, None)
+        return len(keys)
+
+    def stats(self) -> Dict:
+        """缓存统计信息"""
+        total = self._hits + self._misses
+        return {
+            "entries": len(self._entries),
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": self._hits / total if total else 0.0,
+        }
+
+
+def graph_cache_prefix(conversation_id: str) -> str:
+    """对话知识图谱缓存的 key 前缀"""
+    return f"graph:{conversation_id}:"
+
+
+def invalidate_graph_cache(conversation_id: str) -> int:
+    """知识图谱或文档发生变化时，使该对话的图谱缓存失效"""
+    return response_cache.invalidate(graph_cache_prefix(conversation_id))
+
+
+# 全局响应缓存实例
+response_cache = ResponseCache()
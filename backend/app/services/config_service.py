@@ -8,8 +8,9 @@
 """
 import json
 import base64
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
 from cryptography.fernet import Fernet
 import app.config as config
 
@@ -29,8 +30,9 @@ def _get_or_create_key() -> bytes:
         _KEY_FILE.write_bytes(key)
         return key
 
+@lru_cache(maxsize=1)
 def _get_cipher():
-    """获取加密器"""
+    """获取加密器（密钥文件创建后不会变化，进程内只读取一次）"""
     key = _get_or_create_key()
     return Fernet(key)
 
@@ -58,22 +60,40 @@ class ConfigService:
         self.config_file = CONFIG_FILE
         self.config_file.parent.mkdir(parents=True, exist_ok=True)
         self._config_cache: Optional[Dict] = None
+        # 缓存对应的配置文件状态 (mtime_ns, size)，用于判断其他 worker 是否修改过配置
+        self._config_stat: Optional[Tuple[int, int]] = None
+        # 配置版本号：配置内容每次变化（重新加载或更新）时递增，调用方据此判断自己的缓存是否过期
+        self.version = 0
+        # 已解密的场景配置：场景 -> (版本号, 配置)
+        self._resolved_cache: Dict[str, Tuple[int, Dict[str, str]]] = {}
+    
+    def _file_stat(self) -> Optional[Tuple[int, int]]:
+        """获取配置文件的 (mtime_ns, size)，文件不存在时返回 None"""
+        try:
+            stat = self.config_file.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
     
     def _load_config(self, force_reload: bool = False) -> Dict:
         """加载配置文件
         
         Args:
-            force_reload: 如果为 True，强制重新加载（忽略缓存）
+            force_reload: 如果为 True，检查配置文件是否被修改（例如其他 worker 更新了配置），
+                修改过才重新读取；文件未变化时直接使用缓存
         """
-        if force_reload:
-            self._config_cache = None
-        
         if self._config_cache is not None:
-            return self._config_cache
+            if not force_reload:
+                return self._config_cache
+            stat = self._file_stat()
+            if stat is not None and stat == self._config_stat:
+                return self._config_cache
         
+        self.version += 1
         if self.config_file.exists():
             with open(self.config_file, 'r', encoding='utf-8') as f:
                 self._config_cache = json.load(f)
+            self._config_stat = self._file_stat()
         else:
             # 初始化默认配置（从环境变量或全局配置读取）
             # 如果全局配置有 API Key，则加密存储
@@ -121,18 +141,25 @@ class ConfigService:
         """保存配置文件"""
         with open(self.config_file, 'w', encoding='utf-8') as f:
             json.dump(self._config_cache, f, ensure_ascii=False, indent=2)
+        self._config_stat = self._file_stat()
     
     def get_config(self, scene: str, force_reload: bool = True) -> Dict[str, str]:
         """获取指定场景的配置
         
         Args:
             scene: 场景名称（knowledge_graph, chat, mindmap）
-            force_reload: 如果为 True，强制重新加载配置（忽略缓存），默认为 True 确保获取最新配置
+            force_reload: 如果为 True，检查配置文件是否被修改，默认为 True 确保获取最新配置
             
         Returns:
             配置字典，包含 binding, model, host, api_key（已解密）
         """
         config_data = self._load_config(force_reload=force_reload)
+        
+        # 配置未变化时复用已解密的结果，不再每次解密 API Key
+        cached = self._resolved_cache.get(scene)
+        if cached is not None and cached[0] == self.version:
+            return dict(cached[1])
+        
         scene_config = config_data.get(scene, {})
         
         # 解密 API Key
@@ -149,7 +176,8 @@ class ConfigService:
         # 调试输出
         print(f"📋 [Config] 读取 {scene} 配置: binding={result['binding']}, model={result['model']}, host={result['host'][:50] if result['host'] else 'None'}...")
         
-        return result
+        self._resolved_cache[scene] = (self.version, result)
+        return dict(result)
     
     def update_config(self, scene: str, binding: str, model: str, host: str, api_key: Optional[str] = None):
         """更新指定场景的配置
@@ -180,6 +208,7 @@ class ConfigService:
         
         # 更新缓存并保存
         self._config_cache = config_data
+        self.version += 1
         self._save_config()
         
         # 立即更新全局配置（立即生效）
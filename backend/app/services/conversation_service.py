@@ -1,15 +1,38 @@
 """对话服务"""
 import json
+import shutil
+import threading
 import uuid
-from datetime import datetime
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
+import orjson
 import app.config as config
+from app.utils.atomic_write import atomic_write_bytes
+
+
+# 时间戳格式：UTC、以 Z 结尾、固定带微秒（字符串排序即时间排序）
+_TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+
+def _now_iso() -> str:
+    """当前 UTC 时间的 ISO 8601 字符串"""
+    return datetime.now(timezone.utc).strftime(_TIMESTAMP_FORMAT)
 
 
 class ConversationService:
     """对话服务，管理对话的创建、查询、删除"""
     
+    # 元数据缓存（所有实例共享）：文件路径 -> (mtime_ns, size, 元数据)
+    # 服务在很多地方按请求创建，缓存放在类上才能跨实例复用
+    _metadata_cache: Dict[str, Tuple[int, int, Dict]] = {}
+    # 保护缓存的读取-修改-保存，避免线程池中的并发修改互相覆盖
+    _metadata_lock = threading.RLock()
+    # 保护消息日志的追加和旧格式迁移
+    _messages_lock = threading.Lock()
+    # 本进程中已检查过旧格式消息文件的对话，之后读写消息不再访问旧文件
+    _legacy_checked: set = set()
+    
     def __init__(self):
         self.metadata_dir = Path(config.settings.conversations_metadata_dir)
         self.conversations_dir = Path(config.settings.conversations_dir)
@@ -23,26 +46,54 @@ class ConversationService:
         self._load_metadata()
     
     def _load_metadata(self) -> Dict:
-        """加载对话元数据"""
-        if self.metadata_file.exists():
+        """加载对话元数据（文件未变化时直接返回内存中的缓存）
+        
+        多个 worker 进程共享同一个元数据文件，用 mtime/size 判断缓存是否仍然有效：
+        一次 stat 的开销远小于每次重新读取并解析整个 JSON。
+        返回的是缓存对象本身，修改后必须调用 _save_metadata。
+        """
+        key = str(self.metadata_file)
+        with self._metadata_lock:
             try:
-                with open(self.metadata_file, 'r', encoding='utf-8') as f:
-                    metadata = json.load(f)
-                    # 确保有必要的字段
-                    if "next_conversation_number" not in metadata:
-                        metadata["next_conversation_number"] = 1
-                    if "conversations" not in metadata:
-                        metadata["conversations"] = {}
-                    return metadata
-            except:
+                stat = self.metadata_file.stat()
+            except FileNotFoundError:
+                self._metadata_cache.pop(key, None)
                 return {"conversations": {}, "next_conversation_number": 1}
-        return {"conversations": {}, "next_conversation_number": 1}
+            
+            cached = self._metadata_cache.get(key)
+            if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+                return cached[2]
+            
+            metadata = self._load_metadata_from_disk()
+            self._metadata_cache[key] = (stat.st_mtime_ns, stat.st_size, metadata)
+            return metadata
+            
+    def _load_metadata_from_disk(self) -> Dict:
+        """从文件读取对话元数据（文件不存在或损坏时返回空元数据）"""
+        try:
+            metadata = orjson.loads(self.metadata_file.read_bytes())
+            # 确保有必要的字段
+            if "next_conversation_number" not in metadata:
+                metadata["next_conversation_number"] = 1
+            if "conversations" not in metadata:
+                metadata["conversations"] = {}
+            return metadata
+        except:
+            return {"conversations": {}, "next_conversation_number": 1}
     
     def _save_metadata(self, data: Dict):
-        """保存对话元数据"""
-        with open(self.metadata_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-    
+        """保存对话元数据，并以写入后的文件状态更新缓存"""
+        key = str(self.metadata_file)
+        with self._metadata_lock:
+            try:
+                atomic_write_bytes(self.metadata_file, orjson.dumps(data, option=orjson.OPT_INDENT_2))
+                stat = self.metadata_file.stat()
+            except Exception:
+                # 写入失败时丢弃缓存，下次从文件重新加载
+                self._metadata_cache.pop(key, None)
+                raise
+            self._metadata_cache[key] = (stat.st_mtime_ns, stat.st_size, data)
+            
     def create_conversation(self, title: Optional[str] = None) -> str:
         """创建新对话
         
@@ -53,37 +104,38 @@ class ConversationService:
             conversation_id: 对话的唯一ID
         """
         conversation_id = str(uuid.uuid4())
-        now = datetime.utcnow().isoformat() + "Z"
-        
-        # 加载现有元数据
-        metadata = self._load_metadata()
-        if "conversations" not in metadata:
-            metadata["conversations"] = {}
-        if "next_conversation_number" not in metadata:
-            metadata["next_conversation_number"] = 1
-        
-        # 如果没有提供标题，使用自动编号
-        if title is None:
-            next_number = metadata["next_conversation_number"]
-            title = f"对话_{next_number}"
-            # 递增编号
-            metadata["next_conversation_number"] = next_number + 1
-        
-        conversation_data = {
-            "conversation_id": conversation_id,
-            "title": title,
-            "created_at": now,
-            "updated_at": now,
-            "file_count": 0,
-            "status": "active"
-        }
-        
-        # 添加新对话
-        metadata["conversations"][conversation_id] = conversation_data
-        
-        # 保存元数据
-        self._save_metadata(metadata)
-        
+        now = _now_iso()
+        
+        with self._metadata_lock:
+            # 加载现有元数据
+            metadata = self._load_metadata()
+            if "conversations" not in metadata:
+                metadata["conversations"] = {}
+            if "next_conversation_number" not in metadata:
+                metadata["next_conversation_number"] = 1
+            
+            # 如果没有提供标题，使用自动编号
+            if title is None:
+                next_number = metadata["next_conversation_number"]
+                title = f"对话_{next_number}"
+                # 递增编号
+                metadata["next_conversation_number"] = next_number + 1
+            
+            conversation_data = {
+                "conversation_id": conversation_id,
+                "title": title,
+                "created_at": now,
+                "updated_at": now,
+                "file_count": 0,
+                "status": "active"
+            }
+            
+            # 添加新对话
+            metadata["conversations"][conversation_id] = conversation_data
+            
+            # 保存元数据
+            self._save_metadata(metadata)
+            
         # 创建对话目录
         conversation_dir = self.conversations_dir / conversation_id
         conversation_dir.mkdir(parents=True, exist_ok=True)
@@ -102,8 +154,11 @@ class ConversationService:
         """
         metadata = self._load_metadata()
         conversation = metadata.get("conversations", {}).get(conversation_id)
-        if conversation and "pinned" not in conversation:
-            conversation["pinned"] = False
+        if conversation is None:
+            return None
+        # 返回副本，调用方修改不会影响缓存
+        conversation = dict(conversation)
+        conversation.setdefault("pinned", False)
         return conversation
     
     def list_conversations(self, status: Optional[str] = None) -> List[Dict]:
@@ -116,12 +171,12 @@ class ConversationService:
             对话列表（置顶的排在前面，然后按更新时间倒序）
         """
         metadata = self._load_metadata()
-        conversations = list(metadata.get("conversations", {}).values())
+        # 复制每个对话，调用方修改不会影响缓存
+        conversations = [dict(conv) for conv in metadata.get("conversations", {}).values()]
         
         # 确保每个对话都有 pinned 字段
         for conv in conversations:
-            if "pinned" not in conv:
-                conv["pinned"] = False
+            conv.setdefault("pinned", False)
         
         if status:
             conversations = [c for c in conversations if c.get("status") == status]
@@ -148,29 +203,30 @@ class ConversationService:
         Returns:
             是否更新成功
         """
-        metadata = self._load_metadata()
-        
-        if conversation_id not in metadata.get("conversations", {}):
-            return False
-        
-        conversation = metadata["conversations"][conversation_id]
-        
-        # 更新标题
-        if title is not None:
-            conversation["title"] = title
-        
-        # 更新置顶状态
-        if pinned is not None:
-            conversation["pinned"] = pinned
-        
-        # 更新其他字段
-        for key, value in kwargs.items():
-            if value is not None:
-                conversation[key] = value
-        
-        conversation["updated_at"] = datetime.utcnow().isoformat() + "Z"
-        
-        self._save_metadata(metadata)
+        with self._metadata_lock:
+            metadata = self._load_metadata()
+            
+            if conversation_id not in metadata.get("conversations", {}):
+                return False
+            
+            conversation = metadata["conversations"][conversation_id]
+            
+            # 更新标题
+            if title is not None:
+                conversation["title"] = title
+            
+            # 更新置顶状态
+            if pinned is not None:
+                conversation["pinned"] = pinned
+            
+            # 更新其他字段
+            for key, value in kwargs.items():
+                if value is not None:
+                    conversation[key] = value
+            
+            conversation["updated_at"] = _now_iso()
+            
+            self._save_metadata(metadata)
         return True
     
     def increment_file_count(self, conversation_id: str) -> bool:
@@ -182,16 +238,17 @@ class ConversationService:
         Returns:
             是否成功
         """
-        metadata = self._load_metadata()
-        
-        if conversation_id not in metadata.get("conversations", {}):
-            return False
-        
-        conversation = metadata["conversations"][conversation_id]
-        conversation["file_count"] = conversation.get("file_count", 0) + 1
-        conversation["updated_at"] = datetime.utcnow().isoformat() + "Z"
-        
-        self._save_metadata(metadata)
+        with self._metadata_lock:
+            metadata = self._load_metadata()
+            
+            if conversation_id not in metadata.get("conversations", {}):
+                return False
+            
+            conversation = metadata["conversations"][conversation_id]
+            conversation["file_count"] = conversation.get("file_count", 0) + 1
+            conversation["updated_at"] = _now_iso()
+            
+            self._save_metadata(metadata)
         return True
     
     def decrement_file_count(self, conversation_id: str) -> bool:
@@ -203,17 +260,18 @@ class ConversationService:
         Returns:
             是否成功
         """
-        metadata = self._load_metadata()
-        
-        if conversation_id not in metadata.get("conversations", {}):
-            return False
-        
-        conversation = metadata["conversations"][conversation_id]
-        current_count = conversation.get("file_count", 0)
-        conversation["file_count"] = max(0, current_count - 1)
-        conversation["updated_at"] = datetime.utcnow().isoformat() + "Z"
-        
-        self._save_metadata(metadata)
+        with self._metadata_lock:
+            metadata = self._load_metadata()
+            
+            if conversation_id not in metadata.get("conversations", {}):
+                return False
+            
+            conversation = metadata["conversations"][conversation_id]
+            current_count = conversation.get("file_count", 0)
+            conversation["file_count"] = max(0, current_count - 1)
+            conversation["updated_at"] = _now_iso()
+            
+            self._save_metadata(metadata)
         return True
     
     def delete_conversation(self, conversation_id: str) -> bool:
@@ -225,26 +283,31 @@ class ConversationService:
         Returns:
             是否删除成功
         """
-        metadata = self._load_metadata()
-        
-        if conversation_id not in metadata.get("conversations", {}):
-            return False
-        
-        # 从元数据中删除
-        del metadata["conversations"][conversation_id]
-        self._save_metadata(metadata)
+        with self._metadata_lock:
+            metadata = self._load_metadata()
+            
+            if conversation_id not in metadata.get("conversations", {}):
+                return False
+            
+            # 从元数据中删除
+            del metadata["conversations"][conversation_id]
+            self._save_metadata(metadata)
+            
+        self._legacy_checked.discard(conversation_id)
         
         # 删除对话目录（包括所有文件和子目录）
         conversation_dir = self.conversations_dir / conversation_id
-        if conversation_dir.exists():
-            import shutil
+        try:
             shutil.rmtree(conversation_dir)
+        except FileNotFoundError:
+            pass
         
         # 删除 LightRAG 数据目录
         lightrag_dir = Path(config.settings.lightrag_working_dir).parent / conversation_id
-        if lightrag_dir.exists():
-            import shutil
+        try:
             shutil.rmtree(lightrag_dir)
+        except FileNotFoundError:
+            pass
         
         return True
     
@@ -260,9 +323,38 @@ class ConversationService:
         return self.conversations_dir / conversation_id
     
     def _get_messages_file(self, conversation_id: str) -> Path:
-        """获取消息历史文件路径"""
+        """获取消息历史文件路径（NDJSON，每行一条消息，只追加）"""
         conversation_dir = self.get_conversation_dir(conversation_id)
-        return conversation_dir / "messages.json"
+        return conversation_dir / "messages.ndjson"
+    
+    def _migrate_legacy_messages(self, conversation_id: str) -> Path:
+        """把旧格式的 messages.json（整个 JSON 数组）转换为 NDJSON，返回消息文件路径
+        
+        每个对话在本进程中只检查一次（旧格式文件不会再产生），之后不再访问文件系统。
+        """
+        messages_file = self._get_messages_file(conversation_id)
+        if conversation_id in self._legacy_checked:
+            return messages_file
+        
+        legacy_file = messages_file.with_name("messages.json")
+        with self._messages_lock:
+            try:
+                legacy_data = legacy_file.read_bytes()
+            except FileNotFoundError:
+                legacy_data = None
+            
+            if legacy_data is not None:
+                if not messages_file.exists():
+                    try:
+                        messages = orjson.loads(legacy_data)
+                    except orjson.JSONDecodeError:
+                        messages = []
+                    if not isinstance(messages, list):
+                        messages = []
+                    atomic_write_bytes(messages_file, b"".join(orjson.dumps(msg) + b"\n" for msg in messages))
+                legacy_file.unlink(missing_ok=True)
+            self._legacy_checked.add(conversation_id)
+        return messages_file
     
     def add_message(self, conversation_id: str, query: str, answer: str, tool_calls: Optional[List[dict]] = None, stream_items: Optional[List[dict]] = None) -> bool:
         """添加消息到对话历史
@@ -290,23 +382,20 @@ class ConversationService:
         Returns:
             是否成功
         """
-        messages_file = self._get_messages_file(conversation_id)
-        messages_file.parent.mkdir(parents=True, exist_ok=True)
+        messages_file = self._migrate_legacy_messages(conversation_id)
         
-        # 加载现有消息
+        # 本轮所有消息共用同一个时间戳
+        now = datetime.now(timezone.utc)
+        timestamp = now.strftime(_TIMESTAMP_FORMAT)
+        
+        # 本轮新增的消息（只追加到文件末尾，不重写已有历史）
         messages = []
-        if messages_file.exists():
-            try:
-                with open(messages_file, 'r', encoding='utf-8') as f:
-                    messages = json.load(f)
-            except:
-                messages = []
         
         # 添加用户消息
         user_message = {
             "role": "user",
             "content": query,
-            "timestamp": datetime.utcnow().isoformat() + "Z"
+            "timestamp": timestamp
         }
         messages.append(user_message)
         
@@ -314,12 +403,13 @@ class ConversationService:
         if tool_calls and len(tool_calls) > 0:
             # 构建 tool_calls 格式（OpenAI Function Calling 格式）
             assistant_tool_calls = []
+            now_ms = int(now.timestamp() * 1000)
             for i, tool_call in enumerate(tool_calls):
                 tool_name = tool_call.get("toolName", "")
                 arguments = tool_call.get("arguments", {})
                 
                 assistant_tool_calls.append({
-                    "id": f"call_{i}_{int(datetime.utcnow().timestamp() * 1000)}",
+                    "id": f"call_{i}_{now_ms}",
                     "type": "function",
                     "function": {
                         "name": tool_name,
@@ -332,7 +422,7 @@ class ConversationService:
                 "role": "assistant",
                 "content": "",  # 工具调用时 content 为空字符串
                 "tool_calls": assistant_tool_calls,
-                "timestamp": datetime.utcnow().isoformat() + "Z"
+                "timestamp": timestamp
             }
             messages.append(assistant_message)
             
@@ -358,7 +448,7 @@ class ConversationService:
                     "role": "tool",
                     "content": result_content,
                     "tool_call_id": assistant_tool_calls[i]["id"],
-                    "timestamp": datetime.utcnow().isoformat() + "Z"
+                    "timestamp": timestamp
                 }
                 messages.append(tool_message)
         
@@ -366,16 +456,24 @@ class ConversationService:
         assistant_message = {
             "role": "assistant",
             "content": answer,
-            "timestamp": datetime.utcnow().isoformat() + "Z"
+            "timestamp": timestamp
         }
         # 如果有 stream_items，保存到消息中
         if stream_items:
             assistant_message["stream_items"] = stream_items
         messages.append(assistant_message)
         
-        # 保存消息
-        with open(messages_file, 'w', encoding='utf-8') as f:
-            json.dump(messages, f, ensure_ascii=False, indent=2)
+        # 追加消息：整轮消息一次写入，并发读取时不会只看到半轮
+        data = b"".join(orjson.dumps(msg) + b"\n" for msg in messages)
+        with self._messages_lock:
+            try:
+                f = open(messages_file, 'ab')
+            except FileNotFoundError:
+                # 对话目录不存在（例如被手动删除）时重新创建
+                messages_file.parent.mkdir(parents=True, exist_ok=True)
+                f = open(messages_file, 'ab')
+            with f:
+                f.write(data)
         
         return True
     
@@ -388,15 +486,21 @@ class ConversationService:
         Returns:
             消息列表
         """
-        messages_file = self._get_messages_file(conversation_id)
-        
-        if not messages_file.exists():
-            return []
+        messages_file = self._migrate_legacy_messages(conversation_id)
         
         try:
-            with open(messages_file, 'r', encoding='utf-8') as f:
-                messages = json.load(f)
-                return messages if isinstance(messages, list) else []
-        except:
+            data = messages_file.read_bytes()
+        except FileNotFoundError:
             return []
+        
+        messages = []
+        for line in data.splitlines():
+            if not line:
+                continue
+            try:
+                messages.append(orjson.loads(line))
+            except orjson.JSONDecodeError:
+                # 跳过写入中断留下的残缺行
+                continue
+        return messages
 
@@ -1,19 +1,22 @@
 """文档服务，处理文档上传、解析、LightRAG 集成"""
 import asyncio
-import json
 import re
 import shutil
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 
+import orjson
 from fastapi import UploadFile
 
 import app.config as config
+from app.services.cache_service import invalidate_graph_cache
 from app.services.conversation_service import ConversationService
 from app.services.lightrag_service import LightRAGService
 from app.services.mindmap_service import MindMapService
 from app.storage.file_manager import FileManager
+from app.utils.atomic_write import atomic_write_bytes
 from app.utils.document_parser import DocumentParser
 
 # 全局信号量：限制同时处理的文档数量（避免 LightRAG 并发冲突）
@@ -26,6 +29,66 @@ _queue_lock = asyncio.Lock()
 # 等待队列：{ conversation_id: [document_id, ...] }
 _processing_queue: Dict[str, List[str]] = {}
 
+# base64 清理使用的正则（模块加载时编译一次，文档可能有几 MB，每次调用直接使用编译后的对象）
+# 一次扫描同时识别两种片段：<latexit> 标签（包括标签属性和标签内容）和独立的 base64 字符串（长度>=50）
+_BASE64_TOKEN_RE = re.compile(
+    r'<latexit[^>]*>(?P<latexit>[^<]*)</latexit>'
+    r'|(?P<base64>[A-Za-z0-9+/=]{50,})'
+)
+# 标签中的 sha1_base64 属性值
+_SHA1_BASE64_RE = re.compile(r'sha1_base64="([^"]+)"')
+# 标签内容中的 base64 字符串（通常是长字符串）
+_INNER_BASE64_RE = re.compile(r'[A-Za-z0-9+/=]{50,}')
+_BASE64_REF_PREFIX = '[BASE64_'
+
+
+def _scan_and_clean(text: str, base64_map: Dict[str, str], next_index: int) -> Tuple[str, int]:
+    """从左到右扫描一遍文本，把 <latexit> 标签和独立的 base64 字符串替换为 [BASE64_n] 引用
+    
+    替换掉的 base64 写入 base64_map。输出片段先收集到列表，最后统一拼接。
+    
+    Returns:
+        (清理后的文本, 下一个可用序号)
+    """
+    out: List[str] = []
+    pos = 0
+    for match in _BASE64_TOKEN_RE.finditer(text):
+        start, end = match.span()
+        base64_value = match.group('base64')
+        
+        if base64_value is None:
+            # <latexit> 标签：优先使用标签内容中的 base64，否则使用 sha1_base64 属性
+            tag_content = match.group('latexit').strip()
+            base64_in_content = _INNER_BASE64_RE.search(tag_content)
+            if base64_in_content:
+                base64_value = base64_in_content.group(0)
+            else:
+                sha1_match = _SHA1_BASE64_RE.search(text, start, end)
+                if sha1_match:
+                    base64_value = sha1_match.group(1)
+                elif len(tag_content) > 20:
+                    base64_value = tag_content
+        elif (
+            text.startswith(']', end)
+            or (start >= len(_BASE64_REF_PREFIX) and text.startswith(_BASE64_REF_PREFIX, start - len(_BASE64_REF_PREFIX)))
+        ):
+            # 已有的 [BASE64_n] 引用中的内容保持不变
+            continue
+        
+        out.append(text[pos:start])
+        pos = end
+        if base64_value:
+            index_str = str(next_index)
+            base64_map[index_str] = base64_value
+            next_index += 1
+            out.append(f"[BASE64_{index_str}]")
+        # 内容太短或没有 base64 的 <latexit> 标签直接移除
+    
+    if not pos:
+        return text, next_index
+    out.append(text[pos:])
+    return ''.join(out), next_index
+
 
 class DocumentService:
     """文档服务"""
@@ -38,6 +101,10 @@ class DocumentService:
         self.document_parser = DocumentParser()
         self.status_dir = Path(config.settings.conversations_metadata_dir) / "document_status"
         self.status_dir.mkdir(parents=True, exist_ok=True)
+        # 文档状态缓存：conversation_id -> ((mtime_ns, size), 已保存的 JSON 字节)
+        # 文件未变化时不再读取磁盘；其他 worker 写入后 mtime/size 变化会触发重新加载。
+        # 缓存的是字节而不是对象：每次加载都解码出新对象，调用方修改后未保存的内容不会被其他请求看到
+        self._status_cache: Dict[str, Tuple[Tuple[int, int], bytes]] = {}
     
     def _clean_base64_and_save(self, text: str, conversation_id: str) -> Tuple[str, Dict[str, str]]:
         """清理文本中的 base64 字符串，保存到 base_64.json，并返回清理后的文本和映射关系
@@ -57,73 +124,22 @@ class DocumentService:
         
         # 加载已有的 base64 数据（如果存在）
         base64_map = {}
-        if base64_file.exists():
-            try:
-                with open(base64_file, 'r', encoding='utf-8') as f:
-                    existing_data = json.load(f)
-                    base64_map = existing_data if isinstance(existing_data, dict) else {}
-            except:
-                base64_map = {}
+        try:
+            existing_data = orjson.loads(base64_file.read_bytes())
+            base64_map = existing_data if isinstance(existing_data, dict) else {}
+        except (OSError, orjson.JSONDecodeError):
+            base64_map = {}
         
         # 获取下一个序号（从已有最大序号+1开始）
         existing_indices = [int(k) for k in base64_map.keys() if k.isdigit()]
         next_index = max(existing_indices, default=0) + 1
         
-        cleaned_text = text
-        
-        # 1. 处理 <latexit> 标签及其内容
-        # 匹配 <latexit> 标签，包括标签属性和标签内容
-        latexit_pattern = r'<latexit[^>]*>([^<]*)</latexit>'
-        
-        def replace_latexit(match):
-            nonlocal next_index
-            full_match = match.group(0)
-            tag_content = match.group(1).strip()
-            
-            # 提取标签中的 sha1_base64 属性值（如果有）
-            sha1_match = re.search(r'sha1_base64="([^"]+)"', full_match)
-            
-            # 提取标签内容中的 base64 字符串（通常是长字符串）
-            base64_in_content = re.search(r'[A-Za-z0-9+/=]{50,}', tag_content)
-            
-            # 优先使用标签内容中的 base64，否则使用 sha1_base64 属性
-            if base64_in_content:
-                base64_value = base64_in_content.group(0)
-            elif sha1_match:
-                base64_value = sha1_match.group(1)
-            elif tag_content and len(tag_content) > 20:
-                base64_value = tag_content
-            else:
-                return ""  # 如果内容太短或没有 base64，直接移除
-            
-            index_str = str(next_index)
-            base64_map[index_str] = base64_value
-            next_index += 1
-            return f"[BASE64_{index_str}]"
-        
-        cleaned_text = re.sub(latexit_pattern, replace_latexit, cleaned_text, flags=re.DOTALL)
-        
-        # 2. 处理独立的 base64 字符串（长度>=50，且不在已替换的引用中）
-        # 先标记已替换的位置，避免重复处理
-        standalone_base64_pattern = r'(?<!\[BASE64_)[A-Za-z0-9+/=]{50,}(?!\])'
-        
-        def replace_standalone(match):
-            nonlocal next_index
-            base64_str = match.group(0)
-            # 验证是否为有效的 base64（不包含空格、换行等）
-            if re.match(r'^[A-Za-z0-9+/=]+$', base64_str):
-                index_str = str(next_index)
-                base64_map[index_str] = base64_str
-                next_index += 1
-                return f"[BASE64_{index_str}]"
-            return base64_str
-        
-        cleaned_text = re.sub(standalone_base64_pattern, replace_standalone, cleaned_text)
+        # 一次扫描同时处理 <latexit> 标签和独立的 base64 字符串
+        cleaned_text, next_index = _scan_and_clean(text, base64_map, next_index)
         
         # 保存 base64 映射到文件（如果有新增）
         if base64_map:
-            with open(base64_file, 'w', encoding='utf-8') as f:
-                json.dump(base64_map, f, ensure_ascii=False, indent=2)
+            atomic_write_bytes(base64_file, orjson.dumps(base64_map, option=orjson.OPT_INDENT_2))
         
         return cleaned_text, base64_map
     
@@ -132,21 +148,58 @@ class DocumentService:
         return self.status_dir / f"{conversation_id}.json"
     
     def _load_status(self, conversation_id: str) -> Dict:
-        """加载文档状态"""
+        """加载文档状态（每次返回新对象，修改后需要调用 _save_status 写回）"""
         status_file = self._get_status_file(conversation_id)
-        if status_file.exists():
-            try:
-                with open(status_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except:
-                return {"documents": {}}
-        return {"documents": {}}
+        try:
+            stat = status_file.stat()
+        except FileNotFoundError:
+            self._status_cache.pop(conversation_id, None)
+            return {"documents": {}}
+        
+        file_key = (stat.st_mtime_ns, stat.st_size)
+        cached = self._status_cache.get(conversation_id)
+        if cached is not None and cached[0] == file_key:
+            return orjson.loads(cached[1])
+        
+        try:
+            data = status_file.read_bytes()
+            status = orjson.loads(data)
+        except (OSError, orjson.JSONDecodeError):
+            return {"documents": {}}
+        self._status_cache[conversation_id] = (file_key, data)
+        return status
+    
+    def status_version(self, conversation_id: str) -> str:
+        """文档状态文件的版本标识（mtime_ns 和大小），文件不存在时为 "0"
+        
+        文档上传、处理完成和删除都会改写状态文件，所有 worker 都能看到变化，
+        可用作跨进程缓存的失效依据
+        """
+        try:
+            stat = self._get_status_file(conversation_id).stat()
+        except FileNotFoundError:
+            return "0"
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
+    
+    def delete_status(self, conversation_id: str):
+        """删除对话的文档状态文件（删除对话时调用）"""
+        self._status_cache.pop(conversation_id, None)
+        self._get_status_file(conversation_id).unlink(missing_ok=True)
     
     def _save_status(self, conversation_id: str, status: Dict):
         """保存文档状态"""
         status_file = self._get_status_file(conversation_id)
-        with open(status_file, 'w', encoding='utf-8') as f:
-            json.dump(status, f, ensure_ascii=False, indent=2)
+        data = orjson.dumps(status, option=orjson.OPT_INDENT_2)
+        try:
+            # 原子写入：崩溃或其他 worker 并发读取时不会看到写了一半的状态文件
+            atomic_write_bytes(status_file, data)
+            stat = status_file.stat()
+        except Exception:
+            # 写入结果未知，丢弃缓存，下次从文件重新加载
+            self._status_cache.pop(conversation_id, None)
+            raise
+        # 写入成功后才更新缓存
+        self._status_cache[conversation_id] = ((stat.st_mtime_ns, stat.st_size), data)
     
     def _validate_file(self, filename: str) -> tuple[bool, Optional[str]]:
         """验证文件类型
@@ -210,59 +263,65 @@ class DocumentService:
         
         uploaded_files = []
         
-        for file in files:
-            # 验证文件类型
-            is_valid, error_msg = self._validate_file(file.filename)
-            if not is_valid:
-                raise ValueError(error_msg)
-            
-            # 读取文件内容
-            file_content = await file.read()
-            
-            # 验证文件大小
-            is_valid, error_msg = await self._check_file_size(file_content)
-            if not is_valid:
-                raise ValueError(error_msg)
-            
-            # 保存文件
-            file_info = self.file_manager.save_file(
-                conversation_id=conversation_id,
-                file_content=file_content,
-                original_filename=file.filename
-            )
-            
-            # 创建文档记录
-            document_id = file_info["file_id"]
-            now = datetime.utcnow().isoformat() + "Z"
-            
-            document_data = {
-                "file_id": document_id,
-                "conversation_id": conversation_id,
-                "filename": file.filename,
-                "file_size": file_info["file_size"],
-                "file_extension": file_info["file_extension"],
-                "file_path": file_info["file_path"],
-                "upload_time": now,
-                "status": "pending",
-                "lightrag_track_id": None,
-            }
-            
-            # 更新状态
-            status = self._load_status(conversation_id)
-            if "documents" not in status:
-                status["documents"] = {}
-            status["documents"][document_id] = document_data
-            self._save_status(conversation_id, status)
-            
-            # 更新对话文件计数
-            self.conversation_service.increment_file_count(conversation_id)
-            
-            uploaded_files.append({
-                "file_id": document_id,
-                "filename": file.filename,
-                "file_size": file_info["file_size"],
-                "status": "pending"
-            })
+        new_documents: Dict[str, Dict] = {}
+        
+        try:
+            for file in files:
+                # 验证文件类型
+                is_valid, error_msg = self._validate_file(file.filename)
+                if not is_valid:
+                    raise ValueError(error_msg)
+                
+                # 读取文件内容
+                file_content = await file.read()
+                
+                # 验证文件大小
+                is_valid, error_msg = await self._check_file_size(file_content)
+                if not is_valid:
+                    raise ValueError(error_msg)
+                
+                # 保存文件
+                file_info = self.file_manager.save_file(
+                    conversation_id=conversation_id,
+                    file_content=file_content,
+                    original_filename=file.filename
+                )
+                
+                # 创建文档记录
+                document_id = file_info["file_id"]
+                now = datetime.utcnow().isoformat() + "Z"
+                
+                document_data = {
+                    "file_id": document_id,
+                    "conversation_id": conversation_id,
+                    "filename": file.filename,
+                    "file_size": file_info["file_size"],
+                    "file_extension": file_info["file_extension"],
+                    "file_path": file_info["file_path"],
+                    "upload_time": now,
+                    "status": "pending",
+                    "lightrag_track_id": None,
+                }
+                
+                # 更新状态（循环结束后统一写入）
+                new_documents[document_id] = document_data
+                
+                # 更新对话文件计数
+                self.conversation_service.increment_file_count(conversation_id)
+                
+                uploaded_files.append({
+                    "file_id": document_id,
+                    "filename": file.filename,
+                    "file_size": file_info["file_size"],
+                    "status": "pending"
+                })
+        finally:
+            # 整批上传只读写一次状态文件；中途出错时已保存的文件也会被记录
+            # 写入前重新加载，保留上传期间其他请求对状态的修改
+            if new_documents:
+                status = self._load_status(conversation_id)
+                status.setdefault("documents", {}).update(new_documents)
+                self._save_status(conversation_id, status)
         
         return {
             "conversation_id": conversation_id,
@@ -332,6 +391,9 @@ class DocumentService:
                     status["documents"][document_id]["lightrag_track_id"] = track_id
                     self._save_status(conversation_id, status)
                 
+                # 知识图谱已变化，清除该对话的图谱响应缓存
+                invalidate_graph_cache(conversation_id)
+                
                 print(f"✅ 文档处理完成: {document_id[:8]}...")
             
             except Exception as e:
@@ -524,17 +586,26 @@ class DocumentService:
             file_deleted = self.file_manager.delete_file(conversation_id, file_id)
             
             # 4. 从状态中删除
-            if file_id in self._load_status(conversation_id).get("documents", {}):
-                status = self._load_status(conversation_id)
+            status = self._load_status(conversation_id)
+            if file_id in status.get("documents", {}):
                 del status["documents"][file_id]
                 self._save_status(conversation_id, status)
             
             # 5. 更新对话文件计数
             self.conversation_service.decrement_file_count(conversation_id)
             
+            # 6. 清除该对话的图谱响应缓存（实体来源文档信息已变化）
+            invalidate_graph_cache(conversation_id)
+            
             return file_deleted
             
         except Exception as e:
             print(f"Error deleting document {file_id}: {e}")
             # 即使部分操作失败，也尝试删除文件
             return self.file_manager.delete_file(conversation_id, file_id)
+
+
+@lru_cache(maxsize=1)
+def get_document_service() -> DocumentService:
+    """获取全局共享的文档服务实例（首次调用时创建）"""
+    return DocumentService()
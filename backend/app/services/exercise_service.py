@@ -144,7 +144,8 @@ class ExerciseService:
                 "file_size": len(file_content),
                 "file_type": initial_metadata["file_type"],
                 "status": "pending",
-                "upload_time": upload_time
+                "upload_time": upload_time,
+                "original_file_path": str(original_file_path.resolve())
             })
         
         return {
@@ -1,9 +1,10 @@
 """知识图谱服务"""
-from typing import List, Dict, Any, Optional, Set
+from functools import lru_cache
+from typing import AsyncIterator, List, Dict, Any, Optional, Set
 from pathlib import Path
 from app.services.lightrag_service import LightRAGService
 from app.services.document_service import DocumentService
-from app.services.memory_service import MemoryService
+from app.services.memory_service import get_memory_service
 
 
 class GraphService:
@@ -14,7 +15,7 @@ class GraphService:
         self.document_service = DocumentService()
         from app.services.conversation_service import ConversationService
         self.conversation_service = ConversationService()
-        self.memory_service = MemoryService()
+        self.memory_service = get_memory_service()
     
     def _parse_file_path_to_doc_info(self, file_path: str, conversation_id: str) -> Optional[Dict[str, Any]]:
         """解析 file_path 到文档信息
@@ -101,13 +102,23 @@ class GraphService:
         Returns:
             实体列表
         """
+        return [entity async for entity in self.iter_all_entities(conversation_id)]
+    
+    async def iter_all_entities(self, conversation_id: str) -> AsyncIterator[Dict[str, Any]]:
+        """逐个产出对话的实体（用于流式输出，避免缓冲完整列表）
+        
+        Args:
+            conversation_id: 对话ID
+            
+        Yields:
+            实体字典
+        """
         lightrag = await self.lightrag_service.get_lightrag_for_conversation(conversation_id)
         
         # 获取所有节点（实体）
         entities = await lightrag.chunk_entity_relation_graph.get_all_nodes()
         
         # entities 已经是 list[dict] 格式
-        entity_list = []
         for entity_data in entities:
             # entity_data 是字典，id 字段就是节点ID（实体名称）
             entity_id = entity_data.get("id", "")
@@ -133,7 +144,7 @@ class GraphService:
                 if doc_info:
                     source_documents.append(doc_info)
             
-            entity_list.append({
+            yield {
                 "entity_id": entity_id,
                 "name": entity_id,  # 节点ID就是实体名称
                 "type": entity_data.get("entity_type", entity_data.get("type", "")),
@@ -141,9 +152,7 @@ class GraphService:
                 "source_id": source_id,
                 "file_path": file_path,
                 "source_documents": source_documents,  # 来源文档列表
-            })
-        
-        return entity_list
+            }
     
     async def get_all_relations(self, conversation_id: str) -> List[Dict[str, Any]]:
         """获取对话的所有关系
@@ -154,24 +163,32 @@ class GraphService:
         Returns:
             关系列表
         """
+        return [relation async for relation in self.iter_all_relations(conversation_id)]
+    
+    async def iter_all_relations(self, conversation_id: str) -> AsyncIterator[Dict[str, Any]]:
+        """逐个产出对话的关系（用于流式输出，避免缓冲完整列表）
+        
+        Args:
+            conversation_id: 对话ID
+            
+        Yields:
+            关系字典
+        """
         lightrag = await self.lightrag_service.get_lightrag_for_conversation(conversation_id)
         
         # 获取所有边（关系）
         relations = await lightrag.chunk_entity_relation_graph.get_all_edges()
         
         # relations 已经是 list[dict] 格式
-        relation_list = []
         for relation_data in relations:
             # source 和 target 已经在边数据中
-            relation_list.append({
+            yield {
                 "relation_id": f"{relation_data.get('source', '')}->{relation_data.get('target', '')}",
                 "source": relation_data.get("source", ""),
                 "target": relation_data.get("target", ""),
                 "type": relation_data.get("relation_type", relation_data.get("type", "")),
                 "description": relation_data.get("description", ""),
-            })
-        
-        return relation_list
+            }
     
     async def get_entity_detail(self, conversation_id: str, entity_id: str) -> Optional[Dict[str, Any]]:
         """获取实体详情
@@ -359,3 +376,8 @@ class GraphService:
         # 如果是其他类型，转换为字符串
         return str(result)
 
+
+@lru_cache(maxsize=1)
+def get_graph_service() -> GraphService:
+    """获取全局共享的知识图谱服务实例（首次调用时创建）"""
+    return GraphService()
@@ -1,3 +1,4 @@
+import asyncio
 import sys
 import os
 from pathlib import Path
@@ -21,12 +22,14 @@ class LightRAGService:
     _instance: Optional['LightRAGService'] = None
     _lightrag_instances: Dict[str, LightRAG] = {}  # conversation_id -> LightRAG 实例
     _initialized_instances: Dict[str, bool] = {}  # conversation_id -> 是否已初始化
+    _init_tasks: Dict[str, asyncio.Future] = {}  # conversation_id -> 正在进行的初始化任务
     
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
             cls._instance._lightrag_instances = {}
             cls._instance._initialized_instances = {}
+            cls._instance._init_tasks = {}
         return cls._instance
     
     def clear_all_instances(self):
@@ -52,6 +55,23 @@ class LightRAGService:
         if conversation_id in self._lightrag_instances and self._initialized_instances.get(conversation_id, False):
             return self._lightrag_instances[conversation_id]
         
+        # 同一对话的并发初始化共享同一个任务，避免重复创建实例
+        task = self._init_tasks.get(conversation_id)
+        if task is None:
+            task = asyncio.ensure_future(self._create_lightrag_for_conversation(conversation_id))
+            self._init_tasks[conversation_id] = task
+            task.add_done_callback(lambda _: self._init_tasks.pop(conversation_id, None))
+        return await asyncio.shield(task)
+    
+    async def _create_lightrag_for_conversation(self, conversation_id: str) -> LightRAG:
+        """创建并初始化指定对话的 LightRAG 实例，并缓存
+        
+        Args:
+            conversation_id: 对话ID
+            
+        Returns:
+            LightRAG 实例
+        """
         # 直接使用 data/<conversation_id> 作为工作目录，知识图谱文件直接保存在此目录下
         working_dir = Path(config.settings.data_dir) / conversation_id
         working_dir.mkdir(parents=True, exist_ok=True)
@@ -1,8 +1,17 @@
 """对话记忆服务 - 轻量级实现"""
-from typing import List, Dict, Optional
+import asyncio
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import List, Dict, Optional, Tuple
 from app.services.conversation_service import ConversationService
 
+_CHINESE_CHAR_PATTERN = re.compile(r'[\u4e00-\u9fa5]')
+_ENGLISH_WORD_PATTERN = re.compile(r'\b[a-zA-Z]+\b')
 
+
+@lru_cache(maxsize=1024)
 def estimate_tokens(text: str) -> int:
     """简单估算 token 数量（中文按字，英文按词）
     
@@ -15,10 +24,11 @@ def estimate_tokens(text: str) -> int:
     if not text:
         return 0
     # 简单估算：中文字符数 + 英文单词数 * 1.3（考虑标点等）
-    import re
-    chinese_chars = len(re.findall(r'[\u4e00-\u9fa5]', text))
-    english_words = len(re.findall(r'\b[a-zA-Z]+\b', text))
-    other_chars = len(text) - chinese_chars - sum(len(m) for m in re.findall(r'\b[a-zA-Z]+\b', text))
+    # 历史消息在每次请求中都会重新估算，按文本缓存结果
+    chinese_chars = len(_CHINESE_CHAR_PATTERN.findall(text))
+    words = _ENGLISH_WORD_PATTERN.findall(text)
+    english_words = len(words)
+    other_chars = len(text) - chinese_chars - sum(len(m) for m in words)
     # 估算：中文字符按1 token，英文单词按1.3 token，其他字符按0.5 token
     return int(chinese_chars + english_words * 1.3 + other_chars * 0.5)
 
@@ -26,15 +36,43 @@ def estimate_tokens(text: str) -> int:
 class MemoryService:
     """对话记忆服务，提供历史对话获取和关键词匹配"""
     
+    # 最多记录多少个对话的历史窗口起点（超出时淘汰最久未使用的）
+    MAX_TRACKED_WINDOWS = 1024
+    
     def __init__(self):
         self.conversation_service = ConversationService()
+        # (conversation_id, max_turns) -> 历史窗口起始消息下标
+        self._window_starts: "OrderedDict[Tuple[str, int], int]" = OrderedDict()
+        # 异步接口通过 asyncio.to_thread 在线程池中调用，读取-更新-淘汰需要加锁
+        self._window_lock = threading.Lock()
+    
+    def _window_start(self, conversation_id: str, max_turns: int, total: int) -> int:
+        """获取只追加的历史窗口起点
+        
+        窗口从 max_turns 轮增长到 2 * max_turns 轮后才一次性截到最近 max_turns 轮。
+        两次截断之间，每次请求的历史都是上一次的历史加上新消息，
+        前缀逐字节一致，LLM 端的前缀缓存可以命中。
+        """
+        window = max_turns * 2
+        key = (conversation_id, max_turns)
+        with self._window_lock:
+            start = self._window_starts.get(key)
+            # 首次请求、消息被清空或窗口超过 2 倍时，重置到最近 max_turns 轮
+            if start is None or start > total or total - start > window * 2:
+                start = max(0, total - window)
+            self._window_starts[key] = start
+            self._window_starts.move_to_end(key)
+            if len(self._window_starts) > self.MAX_TRACKED_WINDOWS:
+                self._window_starts.popitem(last=False)
+        return start
     
     def get_recent_history(self, conversation_id: str, max_turns: int = 5, max_tokens_per_message: int = 1000) -> List[Dict[str, str]]:
         """获取最近的对话历史
         
         Args:
             conversation_id: 对话ID
-            max_turns: 最大轮次（每轮包含user和assistant两条消息）
+            max_turns: 窗口轮次（每轮包含user和assistant两条消息）；
+                为保持前缀稳定，实际返回 max_turns 到 2 * max_turns 轮
             max_tokens_per_message: 每条消息的最大 token 数（超过会截断）
             
         Returns:
@@ -45,8 +83,8 @@ class MemoryService:
         if not messages:
             return []
         
-        # 只取最近的 max_turns 轮（每轮2条消息）
-        recent_messages = messages[-(max_turns * 2):] if len(messages) > max_turns * 2 else messages
+        # 取只追加的历史窗口（见 _window_start）
+        recent_messages = messages[self._window_start(conversation_id, max_turns, len(messages)):]
         
         # 转换为 LightRAG 需要的格式，并对长消息进行截断
         # 注意：过滤掉 tool 角色的消息，因为 OpenAI API 不支持 tool 角色（除非在 function calling 流程中）
@@ -77,6 +115,15 @@ class MemoryService:
         
         return history
     
+    async def aget_recent_history(self, conversation_id: str, max_turns: int = 5, max_tokens_per_message: int = 1000) -> List[Dict[str, str]]:
+        """get_recent_history 的异步版本（读取消息文件和估算 token 在线程中执行，不阻塞事件循环）"""
+        return await asyncio.to_thread(
+            self.get_recent_history,
+            conversation_id,
+            max_turns=max_turns,
+            max_tokens_per_message=max_tokens_per_message
+        )
+    
     def calculate_input_tokens(self, query: str, history: List[Dict[str, str]], mode: str) -> Dict[str, int]:
         """计算输入 token 数量
         
@@ -107,6 +154,10 @@ class MemoryService:
             "history_assistant_count": assistant_messages
         }
     
+    async def acalculate_input_tokens(self, query: str, history: List[Dict[str, str]], mode: str) -> Dict[str, int]:
+        """calculate_input_tokens 的异步版本（在线程中执行）"""
+        return await asyncio.to_thread(self.calculate_input_tokens, query, history, mode)
+    
     def match_keywords(self, query: str, history: List[Dict[str, str]], keywords: Optional[List[str]] = None) -> bool:
         """简单的关键词匹配
         
@@ -124,7 +175,6 @@ class MemoryService:
         # 如果没有提供关键词，从查询中提取简单关键词（中文单字或英文单词）
         if keywords is None:
             # 简单提取：去除标点，保留中文字符和英文单词
-            import re
             keywords = re.findall(r'[\u4e00-\u9fa5]|\b\w+\b', query.lower())
         
         # 检查历史对话中是否包含这些关键词
@@ -136,3 +186,8 @@ class MemoryService:
         
         return False
 
+
+@lru_cache(maxsize=1)
+def get_memory_service() -> MemoryService:
+    """获取全局共享的对话记忆服务实例（首次调用时创建）"""
+    return MemoryService()
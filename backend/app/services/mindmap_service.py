@@ -1,14 +1,15 @@
 """思维脑图服务，处理文档的思维脑图生成和合并"""
 import asyncio
-import json
 import re
 from pathlib import Path
 from typing import AsyncGenerator, Dict, List, Optional
 import aiohttp
+import orjson
 
 import app.config as config
 from app.utils.document_parser import DocumentParser
 from app.services.conversation_service import ConversationService
+from app.utils.sse import SSE_DONE, iter_sse_data
 
 
 class MindMapService:
@@ -291,41 +292,30 @@ class MindMapService:
                         raise Exception(f"LLM API 错误: {response.status}, {error_text}")
                     
                     accumulated_content = ""
-                    async for line in response.content:
-                        if not line:
+                    async for chunk in iter_sse_data(response):
+                        if chunk == SSE_DONE:
+                            # 流式输出结束，保存完整脑图
+                            if accumulated_content:
+                                # 提取 mindmap 代码块内容
+                                mindmap_content = self._extract_mindmap_content(accumulated_content)
+                                if mindmap_content:
+                                    self._save_mindmap(conversation_id, mindmap_content)
+                            return
+                        
+                        try:
+                            data = orjson.loads(chunk)
+                        except orjson.JSONDecodeError:
                             continue
+                        if 'choices' in data and len(data['choices']) > 0:
+                            delta = data['choices'][0].get('delta', {})
+                            content = delta.get('content', '')
+                            if content:
+                                accumulated_content += content
+                                # 实时流式输出，不等待保存
+                                yield content
                         
-                        line_text = line.decode('utf-8')
-                        for chunk in line_text.split('\n'):
-                            if not chunk.strip() or chunk.startswith(':'):
-                                continue
-                            
-                            if chunk.startswith('data: '):
-                                chunk = chunk[6:]  # 移除 'data: ' 前缀
-                            
-                            if chunk.strip() == '[DONE]':
-                                # 流式输出结束，保存完整脑图
-                                if accumulated_content:
-                                    # 提取 mindmap 代码块内容
-                                    mindmap_content = self._extract_mindmap_content(accumulated_content)
-                                    if mindmap_content:
-                                        self._save_mindmap(conversation_id, mindmap_content)
-                                return
-                            
-                            try:
-                                data = json.loads(chunk)
-                                if 'choices' in data and len(data['choices']) > 0:
-                                    delta = data['choices'][0].get('delta', {})
-                                    content = delta.get('content', '')
-                                    if content:
-                                        accumulated_content += content
-                                        # 实时流式输出，不等待保存
-                                        yield content
-                            except json.JSONDecodeError:
-                                continue
-                            
-                            # 注意：不在流式过程中保存，只在流式结束时保存完整内容
-                            # 这样可以确保前端能够实时接收和渲染内容
+                        # 注意：不在流式过程中保存，只在流式结束时保存完整内容
+                        # 这样可以确保前端能够实时接收和渲染内容
         except Exception as e:
             print(f"[❌ 思维脑图生成失败] {e}")
             raise
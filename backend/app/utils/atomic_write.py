@@ -0,0 +1,18 @@
+"""原子写文件 - 先写临时文件再 os.replace，崩溃或并发读取时不会看到写了一半的文件"""
+import os
+import threading
+from pathlib import Path
+
+
+def atomic_write_bytes(path: Path, data: bytes) -> None:
+    """原子地把 data 写入 path
+    
+    临时文件名带进程和线程标识，多个 worker 同时写同一文件也不会互相覆盖。
+    """
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
@@ -0,0 +1,30 @@
+"""响应压缩 - 仅对指定路径启用 GZip
+
+Starlette 的 GZipMiddleware 在流式响应中不会逐块 flush，会吞掉
+LLM 逐字输出的实时性，因此只对知识图谱等大体积 JSON 接口启用。
+"""
+from typing import Iterable
+
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+
+class ScopedGZipMiddleware:
+    """路径中包含指定片段的 HTTP 请求使用 GZip 压缩，其余请求原样透传"""
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        path_segments: Iterable[str],
+        minimum_size: int = 1024,
+        compresslevel: int = 5,
+    ):
+        self.app = app
+        self.path_segments = tuple(path_segments)
+        self.gzip_app = GZipMiddleware(app, minimum_size=minimum_size, compresslevel=compresslevel)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http" and any(seg in scope["path"] for seg in self.path_segments):
+            await self.gzip_app(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
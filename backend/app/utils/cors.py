@@ -0,0 +1,147 @@
+"""CORS 中间件 - 纯 ASGI 实现，常量响应头在初始化时预先编码
+
+行为与 Starlette CORSMiddleware 在本项目配置下一致（明确的来源列表），
+但每个请求只做一次请求头扫描和列表拼接。
+"""
+from typing import Iterable, List, Optional, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+ALL_METHODS = ("DELETE", "GET", "HEAD", "OPTIONS", "PATCH", "POST", "PUT")
+# CORS 安全列表中的请求头，总是允许
+SAFELISTED_HEADERS = ("accept", "accept-language", "content-language", "content-type")
+
+Header = Tuple[bytes, bytes]
+
+
+class FastCORSMiddleware:
+    """为允许的来源添加 CORS 响应头，并直接响应预检（OPTIONS）请求"""
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        allow_origins: Iterable[str],
+        allow_methods: Iterable[str] = ("GET",),
+        allow_headers: Iterable[str] = (),
+        allow_credentials: bool = False,
+        expose_headers: Iterable[str] = (),
+        max_age: int = 600,
+    ):
+        self.app = app
+        self.allow_origins = frozenset(origin.encode("latin-1") for origin in allow_origins)
+
+        allow_methods = [method.upper() for method in allow_methods]
+        if "*" in allow_methods:
+            allow_methods = list(ALL_METHODS)
+        self.allow_methods = frozenset(method.encode("latin-1") for method in allow_methods)
+
+        # allow_headers 为 "*" 时回显浏览器声明的请求头；否则预先拼接固定列表
+        allow_headers = [header.lower() for header in allow_headers]
+        self.allow_all_headers = "*" in allow_headers
+        if self.allow_all_headers:
+            self.allow_headers = frozenset()
+        else:
+            allow_headers = sorted(set(allow_headers) | set(SAFELISTED_HEADERS))
+            self.allow_headers = frozenset(allow_headers)
+
+        common: List[Header] = [(b"vary", b"Origin")]
+        if allow_credentials:
+            common.append((b"access-control-allow-credentials", b"true"))
+
+        self.simple_headers: List[Header] = list(common)
+        expose = ", ".join(expose_headers)
+        if expose:
+            self.simple_headers.append((b"access-control-expose-headers", expose.encode("latin-1")))
+
+        self.preflight_headers: List[Header] = common + [
+            (b"access-control-allow-methods", ", ".join(allow_methods).encode("latin-1")),
+            (b"access-control-max-age", str(max_age).encode("latin-1")),
+            (b"content-type", b"text/plain; charset=utf-8"),
+            (b"content-length", b"2"),
+        ]
+        if not self.allow_all_headers:
+            self.preflight_headers.append(
+                (b"access-control-allow-headers", ", ".join(allow_headers).encode("latin-1"))
+            )
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        origin: Optional[bytes] = None
+        request_method: Optional[bytes] = None
+        request_headers: Optional[bytes] = None
+        for name, value in scope["headers"]:
+            if name == b"origin":
+                origin = value
+            elif name == b"access-control-request-method":
+                request_method = value
+            elif name == b"access-control-request-headers":
+                request_headers = value
+
+        if origin is None:
+            await self.app(scope, receive, send)
+            return
+
+        if scope["method"] == "OPTIONS" and request_method is not None:
+            await self._preflight_response(origin, request_method, request_headers, send)
+            return
+
+        if origin not in self.allow_origins:
+            await self.app(scope, receive, send)
+            return
+
+        cors_headers = [(b"access-control-allow-origin", origin), *self.simple_headers]
+
+        async def send_with_cors(message: Message):
+            if message["type"] == "http.response.start":
+                # 替换应用自己设置的 CORS 响应头（与 MutableHeaders 赋值一致），
+                # 重复的 Access-Control-Allow-Origin 会被浏览器拒绝
+                message["headers"] = [
+                    *(header for header in message.get("headers", ()) if not header[0].lower().startswith(b"access-control-")),
+                    *cors_headers,
+                ]
+            await send(message)
+
+        await self.app(scope, receive, send_with_cors)
+
+    def _preflight_error(self, origin: bytes, request_method: bytes, request_headers: Optional[bytes]) -> Optional[str]:
+        """检查预检请求，不允许时返回错误说明"""
+        errors = []
+        if origin not in self.allow_origins:
+            errors.append("origin")
+        if request_method not in self.allow_methods:
+            errors.append("method")
+        if request_headers and not self.allow_all_headers:
+            requested = (h.strip().lower() for h in request_headers.decode("latin-1").split(","))
+            if any(h and h not in self.allow_headers for h in requested):
+                errors.append("headers")
+        if errors:
+            return f"Disallowed CORS {', '.join(errors)}"
+        return None
+
+    async def _preflight_response(
+        self, origin: bytes, request_method: bytes, request_headers: Optional[bytes], send: Send
+    ):
+        """响应预检请求：允许时返回 200，否则返回 400"""
+        error = self._preflight_error(origin, request_method, request_headers)
+        if error:
+            body = error.encode("latin-1")
+            await send({
+                "type": "http.response.start",
+                "status": 400,
+                "headers": [
+                    (b"content-type", b"text/plain; charset=utf-8"),
+                    (b"content-length", str(len(body)).encode("latin-1")),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        headers = [(b"access-control-allow-origin", origin), *self.preflight_headers]
+        if self.allow_all_headers and request_headers:
+            # 允许全部请求头：回显浏览器声明的请求头
+            headers.append((b"access-control-allow-headers", request_headers))
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        await send({"type": "http.response.body", "body": b"OK"})
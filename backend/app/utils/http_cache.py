@@ -0,0 +1,77 @@
+"""HTTP 缓存工具 - 为静态文件响应生成 ETag / Cache-Control 并处理条件请求"""
+from pathlib import Path
+from typing import Dict, Optional
+
+from fastapi import Request, Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# 上传后不再变化的文件（样本图片、原始文件等）使用长期缓存
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# 静态目录中的图片会在原路径上重新生成，只短期缓存，过期后凭 ETag / Last-Modified 重新验证
+STATIC_IMAGE_MAX_AGE = 300
+
+
+def file_etag(path: Path) -> str:
+    """根据文件修改时间和大小生成强 ETag"""
+    st = path.stat()
+    return f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """判断请求的 If-None-Match 是否命中指定 ETag"""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in (tag.strip() for tag in if_none_match.split(","))
+
+
+def cache_headers(path: Path, cache_control: str = IMMUTABLE_CACHE_CONTROL) -> Dict[str, str]:
+    """构建文件响应的缓存头"""
+    return {
+        "Cache-Control": cache_control,
+        "ETag": file_etag(path),
+    }
+
+
+def not_modified_response(request: Request, headers: Dict[str, str]) -> Optional[Response]:
+    """若客户端缓存仍然有效，返回 304 响应；否则返回 None"""
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return None
+
+
+class ImageCacheControl:
+    """包装 StaticFiles 等 ASGI 应用，为成功返回的图片响应补充 Cache-Control
+
+    StaticFiles 只发送 ETag / Last-Modified，浏览器每次都会发条件请求；
+    max_age 内直接使用本地缓存，过期后仍用 ETag / Last-Modified 重新验证。
+    immutable 只适用于内容寻址（内容变化时路径也变化）的文件，原路径重新生成的图片不能使用。
+    非图片响应（如 JSON 记录）不受影响。
+    """
+
+    def __init__(self, app: ASGIApp, max_age: int, immutable: bool = False):
+        self.app = app
+        cache_control = f"public, max-age={max_age}, " + ("immutable" if immutable else "must-revalidate")
+        self._header = (b"cache-control", cache_control.encode("latin-1"))
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cache_control(message: Message):
+            if message["type"] == "http.response.start" and 200 <= message["status"] < 300:
+                headers = list(message.get("headers", ()))
+                is_image = any(
+                    name == b"content-type" and value.startswith(b"image/")
+                    for name, value in headers
+                )
+                if is_image:
+                    headers.append(self._header)
+                    message["headers"] = headers
+            await send(message)
+
+        await self.app(scope, receive, send_with_cache_control)
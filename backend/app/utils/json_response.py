@@ -0,0 +1,31 @@
+"""JSON 响应 - 优先使用 msgspec 编码，未安装时回退到 orjson"""
+from typing import Any
+
+import orjson
+from fastapi.responses import Response
+
+try:
+    import msgspec
+    MSGSPEC_AVAILABLE = True
+except ImportError:
+    MSGSPEC_AVAILABLE = False
+
+
+if MSGSPEC_AVAILABLE:
+    _encoder = msgspec.json.Encoder()
+
+    def encode_json(content: Any) -> bytes:
+        """将 dict/list 等结构编码为 JSON bytes"""
+        return _encoder.encode(content)
+else:
+    def encode_json(content: Any) -> bytes:
+        """将 dict/list 等结构编码为 JSON bytes"""
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+class MsgspecJSONResponse(Response):
+    """直接编码内容的 JSON 响应，不经过 Pydantic 校验和 jsonable_encoder"""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return encode_json(content)
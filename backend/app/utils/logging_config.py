@@ -0,0 +1,40 @@
+"""日志配置 - 根日志器通过有界队列输出，写入 stdout 的 I/O 在后台线程中完成"""
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+# 日志队列容量，超出时丢弃新日志，避免阻塞请求处理
+LOG_QUEUE_SIZE = 10000
+
+LOG_FORMAT = "%(asctime)s %(levelname)s [%(name)s] %(message)s"
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """队列已满时直接丢弃日志记录，而不是阻塞或报错"""
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+def setup_queue_logging(level: str = "INFO") -> QueueListener:
+    """为根日志器安装队列处理器，返回需要在启动时 start、关闭时 stop 的监听器
+
+    Args:
+        level: 根日志级别（如 "DEBUG"、"INFO"）
+
+    Returns:
+        QueueListener 实例
+    """
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    root = logging.getLogger()
+    root.addHandler(_DroppingQueueHandler(log_queue))
+    root.setLevel(level.upper())
+
+    return QueueListener(log_queue, stream_handler, respect_handler_level=True)
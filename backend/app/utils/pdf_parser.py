@@ -5,7 +5,7 @@ logging.getLogger('pdfminer.pdfinterp').setLevel(logging.ERROR)
 logging.getLogger('pdfminer').setLevel(logging.ERROR)
 
 import pdfplumber
-from typing import List, Dict, Any
+from typing import List, Dict, Any, BinaryIO
 from pathlib import Path
 
 
@@ -55,14 +55,29 @@ class PDFParser:
         Returns:
             所有页面文本内容（用换行符分隔）
         """
-        texts = []
-        
         with pdfplumber.open(file_path) as pdf:
-            for page in pdf.pages:
-                text = page.extract_text()
-                if text and text.strip():
-                    texts.append(text.strip())
+            return self._join_page_texts(pdf)
+    
+    def extract_text_from_stream(self, stream: BinaryIO) -> str:
+        """从文件流提取 PDF 的纯文本内容（无需落盘临时文件）
         
+        Args:
+            stream: 可 seek 的 PDF 二进制文件流
+            
+        Returns:
+            所有页面文本内容（用换行符分隔）
+        """
+        stream.seek(0)
+        with pdfplumber.open(stream) as pdf:
+            return self._join_page_texts(pdf)
+    
+    def _join_page_texts(self, pdf) -> str:
+        """拼接所有页面的非空文本"""
+        texts = []
+        for page in pdf.pages:
+            text = page.extract_text()
+            if text and text.strip():
+                texts.append(text.strip())
         return "\n\n".join(texts)
     
     def _extract_text(self, page) -> str:
@@ -0,0 +1,39 @@
+"""探活接口 - 绕过 CORS/压缩等中间件的轻量子应用
+
+负载均衡器和 k8s 的存活/就绪探针不需要 CORS，也不需要 OpenAPI，
+单独用 Starlette 处理，并在中间件链最外层直接分流。
+"""
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Route
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+PROBE_PREFIX = "/_probe"
+
+
+_HEALTH_BODY = b'{"status":"healthy"}'
+
+
+async def _probe_health(request: Request) -> Response:
+    """存活探针"""
+    return Response(_HEALTH_BODY, media_type="application/json")
+
+
+# 路由使用完整路径，分流时不改写 scope，与 Starlette 版本的 root_path 处理方式无关
+probe_app = Starlette(routes=[
+    Route(f"{PROBE_PREFIX}/health", _probe_health),
+])
+
+
+class ProbeBypassMiddleware:
+    """以 PROBE_PREFIX 开头的请求直接交给 probe_app，不经过内层中间件和主路由"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http" and scope["path"].startswith(PROBE_PREFIX):
+            await probe_app(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
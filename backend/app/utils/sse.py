@@ -0,0 +1,45 @@
+"""SSE 流解析 - 按原始字节解析 LLM 的流式响应（OpenAI 兼容接口）"""
+from typing import AsyncIterator, Optional
+
+import aiohttp
+
+# 流式响应结束标记
+SSE_DONE = b"[DONE]"
+
+
+def _sse_line_payload(buffer: bytearray, start: int, end: int) -> Optional[bytes]:
+    """取出缓冲区中 [start, end) 这一行 SSE 的 data 内容；空行和注释行返回 None
+
+    直接在缓冲区上按下标判断帧类型，只对 data 内容切片一次。
+    """
+    if end > start and buffer[end - 1] == 0x0D:  # 去掉行尾的 \r
+        end -= 1
+    if buffer.startswith(b"data:", start, end):
+        start += 5
+        if start < end and buffer[start] == 0x20:  # "data:" 后的单个空格
+            start += 1
+    elif start == end or buffer[start] == 0x3A:  # 空行，或以 ":" 开头的注释行（心跳）
+        return None
+    return bytes(buffer[start:end])
+
+
+async def iter_sse_data(response: aiohttp.ClientResponse) -> AsyncIterator[bytes]:
+    """按行解析 SSE 流，逐条产出 data 字段内容（含结束标记 [DONE]）
+
+    按原始字节缓冲拼接，跨 TCP 分片的行会等到完整后再产出；
+    产出的是 bytes，直接交给 orjson 解析，不做 UTF-8 解码和重复切分。
+    """
+    buffer = bytearray()
+    async for data in response.content.iter_any():
+        buffer.extend(data)
+        start = 0
+        while (newline := buffer.find(b"\n", start)) != -1:
+            payload = _sse_line_payload(buffer, start, newline)
+            start = newline + 1
+            if payload is not None:
+                yield payload
+        del buffer[:start]
+    # 流结束时最后一行可能没有换行符
+    payload = _sse_line_payload(buffer, 0, len(buffer))
+    if payload is not None:
+        yield payload
@@ -0,0 +1,208 @@
+"""上传限流中间件 - 在读取请求体之前限制上传的并发数、大小和频率，避免大文件同时进入内存"""
+import asyncio
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, Mapping, Optional, Tuple
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+# 接收文件上传的接口（路径后缀）
+UPLOAD_PATH_SUFFIXES = (
+    "/documents/upload",
+    "/exercises/samples/upload",
+    "/exercises/submissions",
+)
+
+
+def is_upload_request(scope: Scope, suffixes: Iterable[str] = UPLOAD_PATH_SUFFIXES) -> bool:
+    """判断是否为文件上传请求"""
+    return (
+        scope["type"] == "http"
+        and scope["method"] in ("POST", "PUT")
+        and scope["path"].rstrip("/").endswith(tuple(suffixes))
+    )
+
+
+async def send_plain_response(send: Send, status: int, body: bytes, headers=()):
+    """直接发送纯文本响应（不经过路由）"""
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"text/plain; charset=utf-8"),
+            (b"content-length", str(len(body)).encode("latin-1")),
+            *headers,
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class UploadConcurrencyLimiter:
+    """限制同时处理的上传请求数，等待超时返回 503"""
+
+    def __init__(self, app: ASGIApp, concurrency: int, wait_seconds: float):
+        self.app = app
+        self.wait_seconds = wait_seconds
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._retry_after = (b"retry-after", str(max(1, int(wait_seconds))).encode("latin-1"))
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if not is_upload_request(scope):
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.wait_seconds)
+        except asyncio.TimeoutError:
+            await send_plain_response(send, 503, "上传请求过多，请稍后重试".encode("utf-8"), [self._retry_after])
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self._semaphore.release()
+
+
+class MaxUploadBodySize:
+    """按上传接口分别限制请求体大小，超出时返回 413
+
+    - 带 Content-Length 的请求在读取任何请求体之前直接拒绝
+    - 分块传输（无 Content-Length）的请求边读边计数，超出后向应用报告连接断开，
+      并把应用的错误响应替换为 413
+    """
+
+    def __init__(self, app: ASGIApp, limits: Mapping[str, int]):
+        """limits: 上传接口路径后缀 -> 请求体大小上限（字节）"""
+        self.app = app
+        self._rules: Dict[str, Tuple[int, bytes]] = {
+            suffix: (limit, f"请求体过大，上限为 {limit // (1024 * 1024)}MB".encode("utf-8"))
+            for suffix, limit in limits.items()
+        }
+
+    def _rule_for(self, scope: Scope) -> Optional[Tuple[int, bytes]]:
+        """返回请求对应的 (上限, 413 响应体)，不受限制的请求返回 None"""
+        if not is_upload_request(scope, self._rules):
+            return None
+        path = scope["path"].rstrip("/")
+        for suffix, rule in self._rules.items():
+            if path.endswith(suffix):
+                return rule
+        return None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        rule = self._rule_for(scope)
+        if rule is None:
+            await self.app(scope, receive, send)
+            return
+        limit, body = rule
+
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                if value.isdigit() and int(value) > limit:
+                    await send_plain_response(send, 413, body)
+                    return
+                break
+
+        received = 0
+        too_large = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, too_large
+            if too_large:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    too_large = True
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+            if too_large:
+                # 丢弃应用因读取中断产生的响应，改为 413
+                if message["type"] == "http.response.start" and not response_started:
+                    response_started = True
+                    await send_plain_response(send, 413, body)
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            # 读取中断引发的异常不再向上抛出，统一返回 413
+            if not too_large:
+                raise
+        if too_large and not response_started:
+            await send_plain_response(send, 413, body)
+
+
+_RATE_UNITS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+def parse_rate_limit(rate: str) -> Tuple[int, int]:
+    """解析 "15/minute" 形式的限流配置，返回 (次数, 窗口秒数)"""
+    count, _, unit = rate.partition("/")
+    unit = unit.strip().lower().rstrip("s")
+    if unit not in _RATE_UNITS:
+        raise ValueError(f"无效的限流配置: {rate}")
+    return int(count), _RATE_UNITS[unit]
+
+
+class UploadRateLimiter:
+    """按客户端 IP 限制上传频率（滑动窗口，进程内计数），超出返回 429
+
+    多 worker 部署时每个进程单独计数，实际上限为 次数 × worker 数。
+    """
+
+    # 每处理这么多次请求清理一次过期的 IP 记录
+    _CLEANUP_INTERVAL = 1024
+
+    def __init__(self, app: ASGIApp, rate: str, trust_proxy_headers: bool = False):
+        self.app = app
+        self.max_requests, self.window = parse_rate_limit(rate)
+        self.trust_proxy_headers = trust_proxy_headers
+        self._hits: Dict[str, Deque[float]] = {}
+        self._calls = 0
+
+    def _client_ip(self, scope: Scope) -> str:
+        if self.trust_proxy_headers:
+            for name, value in scope["headers"]:
+                if name == b"x-real-ip":
+                    return value.decode("latin-1")
+                if name == b"x-forwarded-for":
+                    return value.decode("latin-1").split(",", 1)[0].strip()
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if not is_upload_request(scope):
+            await self.app(scope, receive, send)
+            return
+
+        now = time.monotonic()
+        cutoff = now - self.window
+
+        self._calls += 1
+        if self._calls % self._CLEANUP_INTERVAL == 0:
+            for ip in [ip for ip, hits in self._hits.items() if not hits or hits[-1] <= cutoff]:
+                del self._hits[ip]
+
+        hits = self._hits.setdefault(self._client_ip(scope), deque())
+        while hits and hits[0] <= cutoff:
+            hits.popleft()
+
+        if len(hits) >= self.max_requests:
+            retry_after = max(1, int(hits[0] + self.window - now) + 1)
+            await send_plain_response(
+                send, 429, "上传过于频繁，请稍后重试".encode("utf-8"),
+                [(b"retry-after", str(retry_after).encode("latin-1"))],
+            )
+            return
+
+        hits.append(now)
+        await self.app(scope, receive, send)